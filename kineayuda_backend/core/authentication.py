@@ -1,6 +1,185 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+from django.conf import settings
+from django.core.cache import caches
 from firebase_admin import auth
 from rest_framework import authentication, exceptions  
 
+class CacheTokens:
+    """
+    Claims de ID tokens ya verificados, por sha256 del token. Cada entrada vence en el `exp` del propio token
+    y se descartan las menos usadas al pasar de `tamano_max`. Thread-safe.
+    """
+
+    def __init__(self, tamano_max):
+        self.tamano_max = max(0, int(tamano_max))
+        self._entradas = OrderedDict()  # clave -> (exp, claims)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._tiempos = {}  # camino ('local', 'sdk', 'revocacion') -> [llamadas, segundos]
+
+    @staticmethod
+    def _clave(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def obtener(self, token):
+        clave = self._clave(token)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[0] > time.time():
+                self._entradas.move_to_end(clave)
+                self.hits += 1
+                return entrada[1]
+            if entrada:
+                del self._entradas[clave]
+            self.misses += 1
+            return None
+
+    def guardar(self, token, claims):
+        exp = claims.get('exp')
+        if not self.tamano_max or not exp:
+            return
+        clave = self._clave(token)
+        with self._lock:
+            self._entradas[clave] = (float(exp), claims)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.tamano_max:
+                self._entradas.popitem(last=False)
+
+    def registrar_tiempo(self, camino, segundos):
+        with self._lock:
+            acumulado = self._tiempos.setdefault(camino, [0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+
+    def invalidar(self, uid=None):
+        """Sin uid vacía la caché; con uid borra solo los tokens de ese usuario."""
+        with self._lock:
+            if uid is None:
+                self._entradas.clear()
+                return
+            for clave in [c for c, (_, claims) in self._entradas.items() if claims.get('uid') == uid]:
+                del self._entradas[clave]
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'entradas': len(self._entradas),
+                'hits': self.hits,
+                'misses': self.misses,
+                'tasa_hits': self.hits / consultas if consultas else 0.0,
+                'latencias': {camino: {'llamadas': n, 'promedio_ms': 1000 * segundos / n}
+                              for camino, (n, segundos) in self._tiempos.items()},
+            }
+
+_cache_tokens = None
+_lock_cache_tokens = threading.Lock()
+
+def obtener_cache_tokens():
+    global _cache_tokens
+    if _cache_tokens is None:
+        with _lock_cache_tokens:
+            if _cache_tokens is None:
+                _cache_tokens = CacheTokens(getattr(settings, 'FIREBASE_TOKEN_CACHE_TAMANO', 10000))
+    return _cache_tokens
+
+# Un ID token de Firebase dura 1 hora: pasado ese tiempo, ninguno emitido antes de la revocación sigue vigente
+VIDA_MAXIMA_TOKEN = 3600
+_REVOCADOS_TODOS = 'firebase:valido_desde:*'
+
+class TokenRevocado(Exception):
+    pass
+
+def _cache_revocaciones():
+    return caches[getattr(settings, 'FIREBASE_REVOCACION_CACHE', 'default')]
+
+def _clave_revocacion(uid):
+    return f'firebase:valido_desde:{uid}'
+
+# Copia local de las marcas de revocación: uid -> (vence, válido desde). Evita leer el caché compartido
+# (archivos en disco) en cada request; una revocación hecha en otro worker rige a más tardar en
+# FIREBASE_REVOCACION_TTL_LOCAL segundos.
+_marcas_locales = {}
+_lock_marcas = threading.Lock()
+_MARCAS_LOCALES_MAX = 10000
+
+def _valido_desde(uid):
+    ahora = time.monotonic()
+    with _lock_marcas:
+        entrada = _marcas_locales.get(uid)
+    if entrada and entrada[0] > ahora:
+        return entrada[1]
+    inicio = time.perf_counter()
+    marcas = _cache_revocaciones().get_many([_REVOCADOS_TODOS, _clave_revocacion(uid)])
+    obtener_cache_tokens().registrar_tiempo('revocacion', time.perf_counter() - inicio)
+    valido_desde = max(marcas.values(), default=0)
+    with _lock_marcas:
+        if len(_marcas_locales) >= _MARCAS_LOCALES_MAX:
+            _marcas_locales.clear()
+        _marcas_locales[uid] = (ahora + getattr(settings, 'FIREBASE_REVOCACION_TTL_LOCAL', 5), valido_desde)
+    return valido_desde
+
+def _olvidar_marcas(uid=None):
+    with _lock_marcas:
+        if uid is None:
+            _marcas_locales.clear()
+        else:
+            _marcas_locales.pop(uid, None)
+
+def _revisar_revocacion(claims):
+    """
+    Rechaza el token si se emitió antes de la última revocación del usuario (o de todos). La marca vive en el
+    caché compartido, así una revocación en un worker rige para todos, aunque otro tenga el token en su CacheTokens.
+    """
+    if claims.get('iat', 0) < _valido_desde(claims.get('uid')):
+        raise TokenRevocado('El token fue revocado.')
+
+def verificar_id_token(token):
+    """Verifica un ID token de Firebase y retorna sus claims, reutilizando la verificación mientras no expire."""
+    cache = obtener_cache_tokens()
+    claims = cache.obtener(token)
+    if claims is None:
+        inicio = time.perf_counter()
+        if getattr(settings, 'FIREBASE_VERIFICACION_LOCAL', False):
+            # Verificación con PyJWT contra las claves ya descargadas (sin HTTPS en el camino del request)
+            from core.utils.firebase_keys import obtener_almacen, project_id_firebase, verificar_token_local
+            claims = verificar_token_local(token, obtener_almacen(), project_id_firebase())
+            camino = 'local'
+        else:
+            claims = auth.verify_id_token(token)
+            camino = 'sdk'
+        cache.registrar_tiempo(camino, time.perf_counter() - inicio)
+        cache.guardar(token, claims)
+    _revisar_revocacion(claims)
+    return claims
+
+def invalidar_tokens(uid=None):
+    """
+    Revocación: desde ahora se rechazan los ID tokens de `uid` (o de todos) emitidos antes de este segundo,
+    en todos los workers. Los tokens que el cliente obtenga después siguen valiendo.
+    """
+    clave = _REVOCADOS_TODOS if uid is None else _clave_revocacion(uid)
+    _cache_revocaciones().set(clave, int(time.time()), timeout=VIDA_MAXIMA_TOKEN)
+    _olvidar_marcas(uid)
+    obtener_cache_tokens().invalidar(uid)
+
+def revocar_sesiones(uid):
+    """Revoca los refresh tokens del usuario en Firebase y rechaza sus ID tokens ya emitidos."""
+    auth.revoke_refresh_tokens(uid)
+    invalidar_tokens(uid)
+
+def estadisticas_tokens():
+    """
+    Tasa de hits de la caché de tokens de este proceso y latencia promedio de las verificaciones reales
+    ('local' con PyJWT o 'sdk' con firebase_admin) y de las lecturas de marcas de revocación ('revocacion').
+    """
+    return obtener_cache_tokens().estadisticas()
+
 class FirebaseUser:
     def __init__(self, uid, email=None):
         self.uid = uid
@@ -10,6 +189,13 @@ class FirebaseUser:
     def is_authenticated(self):
         return True
 
+    @cached_property
+    def kinesiologo(self):
+        # Se crea un FirebaseUser por request, así el perfil se consulta una sola vez por request
+        # aunque lo pidan los permisos, get_queryset y perform_create.
+        from core.models import kinesiologo
+        return kinesiologo.objects.filter(firebase_ide=self.uid).first()
+
 class FirebaseAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         auth_header = request.headers.get('Authorization', '')
@@ -21,7 +207,7 @@ class FirebaseAuthentication(authentication.BaseAuthentication):
             raise exceptions.AuthenticationFailed('No se proporcionó un token.')
         
         try:
-            decoded = auth.verify_id_token(token)
+            decoded = verificar_id_token(token)
         except Exception:
             raise exceptions.AuthenticationFailed('Token inválido o expirado.')
         
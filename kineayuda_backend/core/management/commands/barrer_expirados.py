@@ -0,0 +1,41 @@
+import json
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.utils.barrido import barrer
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = ("Barrido de expiración: libera los horarios retenidos cuya retención de Webpay venció (AGENDA_RETENCION_MINUTOS), "
+            "marca 'expirado' los horarios disponibles que ya pasaron y los pagos de cita "
+            "y de suscripción abandonados en 'pendiente' (PAGO_PENDIENTE_TTL_MINUTOS), cancela esas citas y "
+            "sincroniza las suscripciones vencidas. Actualiza en tandas cortas y emite una línea JSON de métricas "
+            "por pasada. Con --intervalo queda corriendo como proceso periódico.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por UPDATE')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos entre pasadas; 0 hace una sola pasada y termina')
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+        try:
+            while True:
+                t = time.perf_counter()
+                try:
+                    metricas = barrer(lote=options['lote'])
+                except Exception:
+                    logger.exception("Error en el barrido de expiración")
+                    if not intervalo:
+                        raise
+                else:
+                    metricas['duracion_ms'] = (time.perf_counter() - t) * 1000
+                    self.stdout.write(json.dumps(metricas))
+                if not intervalo:
+                    break
+                time.sleep(intervalo)
+        except KeyboardInterrupt:
+            pass
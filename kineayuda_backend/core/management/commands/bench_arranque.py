@@ -0,0 +1,78 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Cada medición corre en un proceso nuevo, para que los imports no queden en caché entre corridas.
+# Con ruta_base se importa esa versión de core.modulo_ia (la que carga el modelo al importarse) en vez de la actual.
+SCRIPT = """
+import importlib.util, json, sys, time, django
+django.setup()
+t0 = time.perf_counter()
+if {ruta_base!r}:
+    spec = importlib.util.spec_from_file_location('core.modulo_ia', {ruta_base!r})
+    sys.modules['core.modulo_ia'] = modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+import core.serializer
+t1 = time.perf_counter()
+if not {ruta_base!r}:
+    from core.modulo_ia import obtener_modelo
+    obtener_modelo()
+t2 = time.perf_counter()
+print(json.dumps({{"import_serializer": t1 - t0, "primera_carga": t2 - t1}}))
+"""
+
+class Command(BaseCommand):
+    help = ("Mide cuánto cuesta importar core.serializer con el modelo de sentimiento diferido (actual) "
+            "versus con core/modulo_ia.py de una versión anterior que lo carga al importar (por defecto el primer commit).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--base', help='Commit de git del que se toma core/modulo_ia.py para la medición base '
+                                           '(por defecto el primer commit del repositorio)')
+
+    def _git(self, *args):
+        try:
+            return subprocess.run(['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CommandError(f"No se pudo leer la versión base con git: {getattr(e, 'stderr', '') or e}")
+
+    def _modulo_base(self, ref, destino):
+        """Escribe core/modulo_ia.py tal como estaba en `ref` dentro de `destino` y retorna su ruta."""
+        ref = ref or self._git('rev-list', '--max-parents=0', 'HEAD').split()[0]
+        ruta = os.path.join(destino, 'modulo_ia_base.py')
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(self._git('show', f'{ref}:./core/modulo_ia.py'))
+        return ruta
+
+    def _medir(self, ruta_base):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'kineayuda_backend.settings'))
+        out = subprocess.run(
+            [sys.executable, '-c', SCRIPT.format(ruta_base=ruta_base)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        reps = options['repeticiones']
+        resultados = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for nombre, ruta_base in (('diferido', ''), ('al_importar', self._modulo_base(options['base'], tmp))):
+                muestras = [self._medir(ruta_base) for _ in range(reps)]
+                resultados[nombre] = {
+                    'import_serializer_mediana_s': statistics.median(m['import_serializer'] for m in muestras),
+                    'import_serializer_min_s': min(m['import_serializer'] for m in muestras),
+                }
+                if not ruta_base:
+                    # Lo que el worker paga después, en el primer análisis (o en precargar_modelo si está activo)
+                    resultados[nombre]['primera_carga_mediana_s'] = statistics.median(m['primera_carga'] for m in muestras)
+
+        resultados['ahorro_por_arranque_s'] = (
+            resultados['al_importar']['import_serializer_mediana_s'] - resultados['diferido']['import_serializer_mediana_s']
+        )
+        self.stdout.write(json.dumps(resultados, indent=2))
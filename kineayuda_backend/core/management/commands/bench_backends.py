@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.modulo_ia import BACKENDS, cargar_modelo, inferir_lote
+from core.utils.bench import cargar_datos, resumen_latencias, rss_actual_mb, rss_pico_mb
+
+class Command(BaseCommand):
+    help = ("Reporta latencia, throughput y RSS de cada backend de inferencia (float32 / int8). "
+            "Cada backend se mide en un proceso aparte para que la memoria no se mezcle.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=16, help='Tamaño de lote para medir throughput')
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--solo', choices=BACKENDS, help='Uso interno: mide un solo backend en este proceso')
+
+    def _medir_backend(self, backend, lote, repeticiones):
+        textos = [r['texto'] for r in cargar_datos('resenas_referencia.json')]
+        rss_inicial = rss_actual_mb()
+        t0 = time.perf_counter()
+        tokenizer, model = cargar_modelo(backend)
+        carga_s = time.perf_counter() - t0
+        rss_modelo = rss_actual_mb()
+        inferir_lote(textos[:lote], tokenizer=tokenizer, model=model)  # calentamiento
+
+        # Latencia: un texto por pasada, como una reseña aislada
+        latencias = []
+        for _ in range(repeticiones):
+            for texto in textos:
+                t = time.perf_counter()
+                inferir_lote([texto], tokenizer=tokenizer, model=model)
+                latencias.append(time.perf_counter() - t)
+
+        # Throughput: lotes con padding
+        t = time.perf_counter()
+        for _ in range(repeticiones):
+            for i in range(0, len(textos), lote):
+                inferir_lote(textos[i:i + lote], tokenizer=tokenizer, model=model)
+        throughput = repeticiones * len(textos) / (time.perf_counter() - t)
+
+        return {
+            'backend': backend,
+            'carga_s': carga_s,
+            'latencia_lote_1': resumen_latencias(latencias),
+            'textos_por_segundo_lote': throughput,
+            'lote': lote,
+            'rss_modelo_mb': rss_modelo - rss_inicial,
+            'rss_pico_mb': rss_pico_mb(),
+        }
+
+    def handle(self, *args, **options):
+        if options['solo']:
+            resultado = self._medir_backend(options['solo'], options['lote'], options['repeticiones'])
+            self.stdout.write(json.dumps(resultado))
+            return
+
+        resultados = []
+        for backend in BACKENDS:
+            out = subprocess.run(
+                [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_backends', '--solo', backend,
+                 '--lote', str(options['lote']), '--repeticiones', str(options['repeticiones'])],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            resultados.append(json.loads(out.strip().splitlines()[-1]))
+        self.stdout.write(json.dumps(resultados, indent=2))
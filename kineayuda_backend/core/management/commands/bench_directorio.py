@@ -0,0 +1,103 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from core.models import kinesiologo
+from core.serializer import kinesiologoSerializer
+from core.utils import busqueda as modulo_busqueda
+from core.utils.bench import resumen_latencias
+from core.views import KinesiologosPublicosView
+
+NOMBRES = ['José', 'María', 'Martín', 'Sofía', 'Tomás', 'Valentina', 'Matías', 'Catalina', 'Benjamín', 'Josefa', 'Agustín', 'Antonia']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda',
+             'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela']
+ESPECIALIDADES = ['Deportiva', 'Traumatológica', 'Respiratoria', 'Neurológica', 'Geriátrica', 'Pediátrica', 'Piso pélvico']
+# Búsquedas como las escribe un paciente: sin tildes y con errores de tipeo
+BUSQUEDAS = ['munoz', 'gonzales', 'deportiba', 'sepulbeda', 'maria rojas', 'neurologica', 'kine respiratoria', 'valensuela']
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ("Compara el directorio público antes (lista completa con kinesiologoSerializer) y ahora (páginas por "
+            "cursor con KinesiologoDirectorioSerializer): bytes de respuesta y tiempo de consulta + serialización. "
+            "También mide la búsqueda difusa ?q=. Los kinesiologos de prueba se crean dentro de una transacción que se revierte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinesiologos', type=int, default=5000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def _medir(self, funcion, repeticiones):
+        latencias, tamano = [], 0
+        for _ in range(repeticiones):
+            t = time.perf_counter()
+            tamano = funcion()
+            latencias.append(time.perf_counter() - t)
+        return {'bytes': tamano, **resumen_latencias(latencias)}
+
+    def handle(self, *args, **options):
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if '*' not in h), 'localhost')
+        factory = APIRequestFactory(HTTP_HOST=host)
+        vista = KinesiologosPublicosView.as_view()
+
+        def antes():
+            qs = kinesiologo.objects.filter(estado_verificacion='aprobado')
+            return len(JSONRenderer().render(kinesiologoSerializer(qs, many=True).data))
+
+        def pagina(url='/api/public/kinesiologos/'):
+            respuesta = vista(factory.get(url))
+            respuesta.render()
+            return respuesta
+
+        def primera_pagina():
+            return len(pagina().content)
+
+        def directorio_completo():
+            total, url = 0, '/api/public/kinesiologos/?limite=100'
+            while url:
+                respuesta = pagina(url)
+                total += len(respuesta.content)
+                url = respuesta.data['next']
+            return total
+
+        busquedas = iter(BUSQUEDAS * (options['repeticiones'] + 1))
+
+        def busqueda():
+            return len(pagina(f'/api/public/kinesiologos/?q={next(busquedas)}').content)
+
+        def busqueda_en_frio():
+            # Sin PostgreSQL, incluye rearmar el índice en memoria (invalidar_indice espera al commit, que aquí no llega)
+            modulo_busqueda._indice = None
+            return busqueda()
+
+        try:
+            with transaction.atomic():
+                kinesiologo.objects.bulk_create([
+                    kinesiologo(nombre=NOMBRES[i % len(NOMBRES)], apellido=f'{APELLIDOS[i % 20]} {APELLIDOS[i // 20 % 20]}',
+                                email=f'bench-dir-{i}@kineayuda.local', nro_titulo=str(i), rut=f'{10000000 + i}-{i % 10}',
+                                doc_verificacion='doc', especialidad=ESPECIALIDADES[i % len(ESPECIALIDADES)],
+                                estado_verificacion='aprobado', firebase_ide=f'bench-dir-{i}')
+                    for i in range(options['kinesiologos'])
+                ], batch_size=1000)
+                rep = options['repeticiones']
+                resultados = {
+                    'antes_lista_completa': self._medir(antes, rep),
+                    'ahora_primera_pagina': self._medir(primera_pagina, rep),
+                    'ahora_directorio_completo_limite_100': self._medir(directorio_completo, rep),
+                    'busqueda_q_en_frio': self._medir(busqueda_en_frio, rep),
+                    'busqueda_q_primera_pagina': self._medir(busqueda, len(BUSQUEDAS) * rep),
+                }
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(json.dumps({
+            'motor': connection.vendor,
+            'kinesiologos': options['kinesiologos'],
+            'resultados': resultados,
+        }, indent=2))
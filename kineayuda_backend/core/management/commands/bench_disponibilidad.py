@@ -0,0 +1,85 @@
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import agenda, kinesiologo
+from core.utils.agenda import buscar_disponibilidad
+from core.utils.bench import resumen_latencias
+
+ESPECIALIDADES = ['deportiva', 'traumatologica', 'respiratoria', 'neurologica', 'geriatrica']
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ("Mide la búsqueda pública de disponibilidad (buscar_disponibilidad) con miles de kinesiologos. "
+            "Los datos se crean dentro de una transacción que se revierte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinesiologos', type=int, default=2000)
+        parser.add_argument('--horas', type=int, default=60, help='Horas disponibles por kinesiologo')
+        parser.add_argument('--consultas', type=int, default=50, help='Búsquedas medidas por escenario')
+
+    def _poblar(self, n_kx, n_horas, base):
+        kxs = kinesiologo.objects.bulk_create([
+            kinesiologo(nombre=f'Bench{i}', apellido=f'Disponibilidad{i:05d}', email=f'bench-disp-{i}@kineayuda.local',
+                        nro_titulo='0', rut=f'bench-disp-{i}', doc_verificacion='',
+                        especialidad=ESPECIALIDADES[i % len(ESPECIALIDADES)], estado_verificacion='aprobado')
+            for i in range(n_kx)
+        ], batch_size=1000)
+        horas = []
+        for kx in kxs:
+            # Horas de 30 o 60 minutos repartidas en 14 días, con un desfase distinto por kinesiologo
+            desfase = random.randrange(48)
+            for j in range(n_horas):
+                inicio = base + timedelta(minutes=30 * (desfase + j * 11))
+                horas.append(agenda(kinesiologo=kx, inicio=inicio,
+                                    fin=inicio + timedelta(minutes=random.choice([30, 60]))))
+            if len(horas) >= 20000:
+                agenda.objects.bulk_create(horas, batch_size=5000)
+                horas = []
+        agenda.objects.bulk_create(horas, batch_size=5000)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE core_kinesiologo")
+                cursor.execute("ANALYZE core_agenda")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        base = timezone.now() + timedelta(hours=1)
+        escenarios = {
+            'especialidad_semana': dict(especialidad='deportiva', dias=7),
+            'especialidad_tarde_60min': dict(especialidad='deportiva', dias=1, duracion_min=60, orden='pronto'),
+            'todas_semana_pronto': dict(especialidad=None, dias=7, orden='pronto'),
+        }
+        resultados = {}
+        try:
+            with transaction.atomic():
+                t = time.perf_counter()
+                self._poblar(options['kinesiologos'], options['horas'], base)
+                self.stderr.write(f"Datos creados en {time.perf_counter() - t:.1f}s")
+                for nombre, e in escenarios.items():
+                    latencias = []
+                    for _ in range(options['consultas']):
+                        desde = base + timedelta(hours=random.randrange(24 * 3))
+                        t = time.perf_counter()
+                        buscar_disponibilidad(desde, desde + timedelta(days=e['dias']), e['especialidad'],
+                                              e.get('duracion_min', 0), orden=e.get('orden', 'nombre'))
+                        latencias.append(time.perf_counter() - t)
+                    resultados[nombre] = resumen_latencias(latencias)
+                    self.stderr.write(f"{nombre}: p50={resultados[nombre]['p50_ms']:.1f} ms")
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(json.dumps({
+            'motor': connection.vendor,
+            'kinesiologos': options['kinesiologos'],
+            'horas_por_kinesiologo': options['horas'],
+            'resultados': resultados,
+        }, indent=2))
@@ -0,0 +1,141 @@
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.authentication import FirebaseUser
+from core.models import agenda, cita, kinesiologo, paciente, pagoCita
+from core.utils.bench import resumen_latencias
+from core.utils.metricas import agregar, inicio_del_dia, reconstruir, recalcular_dias
+from core.views import kinesiologoViewSet
+
+MONTO = Decimal('25000')
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ("Mide metricas-citas sobre un dataset sintético de millones de citas (con su agenda y pagos): "
+            "agregación en vivo sobre cita/agenda/pagoCita vs lectura de metricaCitaDiaria, refresco incremental "
+            "de un día y reconstrucción completa. Los datos se crean dentro de una transacción que se revierte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--citas', type=int, default=2000000)
+        parser.add_argument('--kinesiologos', type=int, default=500)
+        parser.add_argument('--dias', type=int, default=730, help='Días de historia')
+        parser.add_argument('--consultas', type=int, default=20, help='Mediciones por escenario')
+
+    def _poblar(self, n_citas, n_kx, n_dias, desde):
+        pac = paciente.objects.create(nombre='Bench', apellido='Metricas', rut='bench-metricas',
+                                      email='bench-metricas@kineayuda.local', telefono='0', fecha_nacimiento=date(1990, 1, 1))
+        kxs = kinesiologo.objects.bulk_create([
+            kinesiologo(nombre=f'Bench{i}', apellido='Metricas', email=f'bench-metricas-{i}@kineayuda.local',
+                        nro_titulo='0', rut=f'bench-metricas-{i}', doc_verificacion='', especialidad='bench',
+                        estado_verificacion='aprobado', firebase_ide=f'bench-metricas-{i}')
+            for i in range(n_kx)
+        ], batch_size=1000)
+        por_kx = min(n_citas // n_kx, n_dias * 10)
+        for n, kx in enumerate(kxs):
+            # Horas de 8:00 a 18:00 sin repetir, para no chocar con la restricción de solapamiento
+            bloques = random.sample(range(n_dias * 10), por_kx)
+            inicios = [inicio_del_dia(desde + timedelta(days=b // 10)) + timedelta(hours=8 + b % 10) for b in bloques]
+            citas = cita.objects.bulk_create([
+                cita(paciente=pac, kinesiologo=kx, fecha_hora=inicio,
+                     estado=random.choices(['completada', 'cancelada', 'pendiente'], [70, 20, 10])[0])
+                for inicio in inicios
+            ], batch_size=5000)
+            agenda.objects.bulk_create([
+                agenda(kinesiologo=kx, inicio=c.fecha_hora, fin=c.fecha_hora + timedelta(minutes=45),
+                       estado='expirado' if c.estado == 'cancelada' else 'reservado')
+                for c in citas
+            ], batch_size=5000)
+            pagoCita.objects.bulk_create([
+                pagoCita(cita=c, kinesiologo=kx, paciente=pac, monto=MONTO, estado='pagado',
+                         fecha_pago=c.fecha_hora - timedelta(hours=random.randrange(1, 72)))
+                for c in citas if c.estado == 'completada'
+            ], batch_size=5000)
+            if (n + 1) % 50 == 0:
+                self.stderr.write(f"{(n + 1) * por_kx} citas creadas")
+        return kxs
+
+    def _medir(self, funcion, repeticiones):
+        latencias = []
+        for _ in range(repeticiones):
+            t = time.perf_counter()
+            funcion()
+            latencias.append(time.perf_counter() - t)
+        return resumen_latencias(latencias)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if '*' not in h), 'localhost')
+        factory = APIRequestFactory(HTTP_HOST=host)
+        vista = kinesiologoViewSet.as_view({'get': 'metricas_citas'})
+        hoy = timezone.localdate()
+        desde = hoy - timedelta(days=options['dias'])
+        rep = options['consultas']
+
+        try:
+            with transaction.atomic():
+                t = time.perf_counter()
+                kxs = self._poblar(options['citas'], options['kinesiologos'], options['dias'], desde)
+                carga_s = time.perf_counter() - t
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE core_cita; ANALYZE core_agenda; ANALYZE core_pagocita")
+
+                t = time.perf_counter()
+                filas = reconstruir()
+                reconstruccion_s = time.perf_counter() - t
+
+                def en_vivo():
+                    # Lo que costaría la respuesta sin rollup: agregar cita, agenda y pagoCita del kinesiologo
+                    return agregar([random.choice(kxs).id])
+
+                def endpoint(granularidad):
+                    def llamar():
+                        request = factory.get('/api/kinesiologos/metricas-citas/', {'granularidad': granularidad})
+                        force_authenticate(request, user=FirebaseUser(uid=random.choice(kxs).firebase_ide))
+                        respuesta = vista(request)
+                        respuesta.render()
+                        return respuesta
+                    return llamar
+
+                def refresco():
+                    kx = random.choice(kxs)
+                    recalcular_dias([(kx.id, desde + timedelta(days=random.randrange(options['dias'])))])
+
+                kx = kxs[0]
+                request = factory.get('/api/kinesiologos/metricas-citas/')
+                force_authenticate(request, user=FirebaseUser(uid=kx.firebase_ide))
+                resumen = vista(request).data['resumen']
+                vivo = agregar([kx.id]).values()
+                coincide = all(resumen[campo] == sum(v[campo] for v in vivo) for campo in ('citas', 'completadas', 'ingresos'))
+
+                resultados = {
+                    'carga_s': carga_s,
+                    'reconstruccion': {'filas': filas, 'duracion_s': reconstruccion_s},
+                    'en_vivo_por_kinesiologo': self._medir(en_vivo, rep),
+                    'endpoint_mes': self._medir(endpoint('mes'), rep),
+                    'endpoint_dia': self._medir(endpoint('dia'), rep),
+                    'refresco_incremental_un_dia': self._medir(refresco, rep),
+                    'rollup_coincide_con_vivo': coincide,
+                }
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(json.dumps({
+            'motor': connection.vendor,
+            'citas': min(options['citas'] // options['kinesiologos'], options['dias'] * 10) * options['kinesiologos'],
+            'kinesiologos': options['kinesiologos'],
+            'dias': options['dias'],
+            'resultados': resultados,
+        }, indent=2))
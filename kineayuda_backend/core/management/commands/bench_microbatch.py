@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.modulo_ia import ColaInferencia, inferir_lote, obtener_modelo
+
+TEXTOS = [
+    "Excelente atención, muy profesional.",
+    "Muy bueno.",
+    "La sesión fue puntual y me explicó bien los ejercicios para la rodilla.",
+    "No me gustó, llegó tarde y la consulta fue muy corta.",
+    "Normal, nada especial.",
+    "Después de cuatro sesiones el dolor de espalda bajó bastante, lo recomiendo.",
+    "Pésima experiencia, no volvería.",
+    "Buena disposición pero el lugar era pequeño y ruidoso.",
+]
+
+class Command(BaseCommand):
+    help = ("Compara el throughput de analizar reseñas una por una (lote de 1) contra la cola de "
+            "micro-batching, con varios hilos enviando textos al mismo tiempo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=16, help='Llamadores concurrentes')
+        parser.add_argument('--por-hilo', type=int, default=20, help='Textos que analiza cada hilo')
+        parser.add_argument('--batch-max', type=int, default=16)
+        parser.add_argument('--espera-ms', type=float, default=10)
+
+    def _correr(self, hilos, por_hilo, analizar):
+        def trabajo(i):
+            for j in range(por_hilo):
+                analizar(TEXTOS[(i + j) % len(TEXTOS)])
+
+        threads = [threading.Thread(target=trabajo, args=(i,)) for i in range(hilos)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duracion = time.perf_counter() - t0
+        total = hilos * por_hilo
+        return {'textos': total, 'segundos': duracion, 'textos_por_segundo': total / duracion}
+
+    def handle(self, *args, **options):
+        hilos, por_hilo = options['hilos'], options['por_hilo']
+        obtener_modelo()
+        inferir_lote(TEXTOS)  # calentamiento
+
+        # Antes: cada request hacía su propia pasada de tamaño 1 en su hilo
+        individual = self._correr(hilos, por_hilo, lambda t: inferir_lote([t])[0])
+
+        cola = ColaInferencia(options['batch_max'], options['espera_ms'])
+        batch = self._correr(hilos, por_hilo, cola.analizar)
+
+        self.stdout.write(json.dumps({
+            'hilos': hilos,
+            'batch_max': options['batch_max'],
+            'espera_ms': options['espera_ms'],
+            'individual': individual,
+            'micro_batch': batch,
+            'mejora': batch['textos_por_segundo'] / individual['textos_por_segundo'],
+        }, indent=2))
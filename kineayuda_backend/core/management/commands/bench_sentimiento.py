@@ -0,0 +1,90 @@
+import json
+import os
+import platform
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.modulo_ia import BACKENDS, MODEL_NAME, backend_configurado, cargar_modelo, inferir_lote
+from core.utils.bench import cargar_datos, resumen_latencias, rss_actual_mb, rss_pico_mb
+
+def _lista_enteros(valor):
+    return [int(v) for v in valor.split(',') if v.strip()]
+
+class Command(BaseCommand):
+    help = ("Benchmark reproducible de analizar_sentimiento sobre el corpus de core/data/corpus_benchmark.json: "
+            "latencia p50/p95/p99 y throughput por tamaño de lote, hilos de torch y max_length, más memoria pico. "
+            "Emite JSON para comparar entre versiones y dimensionar nodos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lotes', type=_lista_enteros, default=[1, 8, 32])
+        parser.add_argument('--hilos', type=_lista_enteros, default=[1, 2, 4], help='torch.set_num_threads')
+        parser.add_argument('--max-length', type=_lista_enteros, default=[64, 128, 256])
+        parser.add_argument('--repeticiones', type=int, default=3, help='Pasadas completas sobre el corpus por combinación')
+        parser.add_argument('--backend', choices=BACKENDS, help='Por defecto SENTIMIENTO_BACKEND')
+        parser.add_argument('--salida', help='Archivo donde escribir el JSON (por defecto stdout)')
+
+    def handle(self, *args, **options):
+        import torch
+
+        corpus = cargar_datos('corpus_benchmark.json')
+        backend = options['backend'] or backend_configurado()
+        hilos_originales = torch.get_num_threads()
+
+        rss_inicial = rss_actual_mb()
+        t0 = time.perf_counter()
+        tokenizer, model = cargar_modelo(backend)
+        carga_s = time.perf_counter() - t0
+        rss_modelo = rss_actual_mb() - rss_inicial
+        inferir_lote(corpus[:8], tokenizer=tokenizer, model=model)  # calentamiento
+
+        resultados = []
+        try:
+            for hilos in options['hilos']:
+                torch.set_num_threads(hilos)
+                for max_length in options['max_length']:
+                    for lote in options['lotes']:
+                        latencias = []
+                        t = time.perf_counter()
+                        for _ in range(options['repeticiones']):
+                            for i in range(0, len(corpus), lote):
+                                inicio = time.perf_counter()
+                                inferir_lote(corpus[i:i + lote], max_length, tokenizer=tokenizer, model=model)
+                                latencias.append(time.perf_counter() - inicio)
+                        duracion = time.perf_counter() - t
+                        resultados.append({
+                            'hilos': hilos,
+                            'max_length': max_length,
+                            'lote': lote,
+                            'latencia_por_lote': resumen_latencias(latencias),
+                            'textos_por_segundo': options['repeticiones'] * len(corpus) / duracion,
+                        })
+                        self.stderr.write(f"hilos={hilos} max_length={max_length} lote={lote}: "
+                                          f"{resultados[-1]['textos_por_segundo']:.1f} textos/s")
+        finally:
+            torch.set_num_threads(hilos_originales)
+
+        largos = [len(tokenizer(t)['input_ids']) for t in corpus]
+        reporte = {
+            'fecha': timezone.now().isoformat(),
+            'modelo': MODEL_NAME,
+            'backend': backend,
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'corpus': {'textos': len(corpus), 'tokens_min': min(largos), 'tokens_max': max(largos),
+                       'tokens_promedio': sum(largos) / len(largos)},
+            'carga_modelo_s': carga_s,
+            'rss_modelo_mb': rss_modelo,
+            'rss_pico_mb': rss_pico_mb(),
+            'resultados': resultados,
+        }
+
+        salida = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as f:
+                f.write(salida)
+            self.stdout.write(self.style.SUCCESS(f"Resultados escritos en {options['salida']}"))
+        else:
+            self.stdout.write(salida)
@@ -0,0 +1,70 @@
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import agenda, kinesiologo
+from core.utils.agenda import hay_solapamiento
+from core.utils.bench import resumen_latencias
+
+def _lista_enteros(valor):
+    return [int(v) for v in valor.split(',') if v.strip()]
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ("Mide la latencia de la validación de solapamiento a medida que crece la agenda de un kinesiologo "
+            "(por defecto hasta 100k horarios). Los datos se crean dentro de una transacción que se revierte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=_lista_enteros, default=[1000, 10000, 100000])
+        parser.add_argument('--consultas', type=int, default=200, help='Validaciones medidas por tamaño')
+
+    def _medir(self, kx, base, total, consultas):
+        latencias = []
+        for _ in range(consultas):
+            # Bloque de 30 min en una posición aleatoria: la mitad choca con un horario existente
+            inicio = base + timedelta(minutes=random.randrange(total) * 60 + random.choice([0, 45]))
+            t = time.perf_counter()
+            hay_solapamiento(kx.id, inicio, inicio + timedelta(minutes=30))
+            latencias.append(time.perf_counter() - t)
+        return resumen_latencias(latencias)
+
+    def handle(self, *args, **options):
+        resultados = []
+        random.seed(0)
+        base = timezone.now() + timedelta(days=1)
+        try:
+            with transaction.atomic():
+                kx = kinesiologo.objects.create(
+                    nombre='Bench', apellido='Solapamiento', email='bench-solapamiento@kineayuda.local',
+                    nro_titulo='0', rut='bench-solap', doc_verificacion='', especialidad='bench',
+                )
+                creados = 0
+                for tamano in sorted(options['tamanos']):
+                    # Horarios de 45 min cada hora, sin solaparse entre sí
+                    nuevos = [
+                        agenda(kinesiologo=kx, inicio=base + timedelta(hours=i), fin=base + timedelta(hours=i, minutes=45))
+                        for i in range(creados, tamano)
+                    ]
+                    agenda.objects.bulk_create(nuevos, batch_size=5000)
+                    creados = tamano
+                    with connection.cursor() as cursor:
+                        if connection.vendor == 'postgresql':
+                            cursor.execute("ANALYZE core_agenda")
+                    resultados.append({'horarios': tamano, **self._medir(kx, base, tamano, options['consultas'])})
+                    self.stderr.write(f"{tamano} horarios: p50={resultados[-1]['p50_ms']:.3f} ms")
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(json.dumps({
+            'motor': connection.vendor,
+            'metodo': 'rango GiST (tstzrange &&)' if connection.vendor == 'postgresql' else 'inicio < fin AND fin > inicio',
+            'resultados': resultados,
+        }, indent=2))
@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import agenda, cita, kinesiologo, paciente
+from core.utils.agenda import HorarioNoDisponible, retener_horario, tomar_horario
+from core.utils.bench import resumen_latencias
+
+class Command(BaseCommand):
+    help = ("Prueba de concurrencia de las retenciones de horario: muchos hilos intentan retener a la vez el mismo "
+            "horario y luego horarios distintos. Verifica que cada horario quede retenido una sola vez y mide "
+            "cuánto tarda en fallar un request que pierde la carrera. Crea sus datos y los borra al terminar. "
+            "SKIP LOCKED solo aplica en PostgreSQL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=50)
+        parser.add_argument('--espera-ms', type=float, default=20,
+                            help='Tiempo que cada ganador mantiene el lock (simula crear paciente, cita y pago)')
+
+    def _intentar(self, slot_id, cita_obj, espera, resultados, barrera):
+        barrera.wait()
+        t = time.perf_counter()
+        try:
+            with transaction.atomic():
+                slot = tomar_horario(slot_id)
+                time.sleep(espera)
+                retener_horario(slot, cita_obj)
+            resultado = 'retenido'
+        except HorarioNoDisponible:
+            resultado = 'rechazado'
+        except Exception as e:  # p. ej. "database is locked" en SQLite
+            resultado = f'error: {type(e).__name__}'
+        finally:
+            connection.close()
+        resultados.append((resultado, time.perf_counter() - t))
+
+    def _escenario(self, slot_ids, citas, espera):
+        resultados = []
+        barrera = threading.Barrier(len(citas))
+        hilos = [threading.Thread(target=self._intentar, args=(slot_id, c, espera, resultados, barrera))
+                 for slot_id, c in zip(slot_ids, citas)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        conteo = {}
+        for resultado, _ in resultados:
+            conteo[resultado] = conteo.get(resultado, 0) + 1
+        retenidos = agenda.objects.filter(id__in=set(slot_ids), estado='retenido').count()
+        return {
+            'intentos': len(resultados),
+            'resultados': conteo,
+            'horarios_retenidos': retenidos,
+            'horarios_distintos': len(set(slot_ids)),
+            'latencia_exito': resumen_latencias([d for r, d in resultados if r == 'retenido']),
+            'latencia_rechazo': resumen_latencias([d for r, d in resultados if r == 'rechazado']),
+        }
+
+    def handle(self, *args, **options):
+        n, espera = options['hilos'], options['espera_ms'] / 1000
+        base = timezone.now() + timedelta(days=1)
+        kx = kinesiologo.objects.create(
+            nombre='Estres', apellido='Reservas', email='estres-reservas@kineayuda.local',
+            nro_titulo='0', rut='estres-reservas', doc_verificacion='', especialidad='bench',
+        )
+        pac = paciente.objects.create(nombre='Estres', apellido='Reservas', rut='estres-reservas',
+                                      email='estres-reservas-paciente@kineayuda.local', telefono='0',
+                                      fecha_nacimiento='2000-01-01')
+        try:
+            slots = agenda.objects.bulk_create([
+                agenda(kinesiologo=kx, inicio=base + timedelta(hours=i), fin=base + timedelta(hours=i, minutes=45))
+                for i in range(n + 1)
+            ])
+            citas = cita.objects.bulk_create([
+                cita(paciente=pac, kinesiologo=kx, fecha_hora=base, estado='pendiente') for _ in range(2 * n)
+            ])
+            reporte = {
+                'motor': connection.vendor,
+                'hilos': n,
+                'mismo_horario': self._escenario([slots[0].id] * n, citas[:n], espera),
+                'horarios_distintos': self._escenario([s.id for s in slots[1:]], citas[n:], espera),
+            }
+        finally:
+            kx.delete()
+            pac.delete()
+
+        self.stdout.write(json.dumps(reporte, indent=2))
+        if reporte['mismo_horario']['resultados'].get('retenido', 0) > 1:
+            self.stderr.write(self.style.ERROR("El mismo horario quedó retenido por más de un request."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.utils.suscripciones import sincronizar_vencidas
+
+class Command(BaseCommand):
+    help = ("Barrido de suscripciones vencidas: recalcula suscripcion_vence_en desde los pagos para los "
+            "kinesiologos cuya suscripción ya venció y tienen un pago posterior sin reflejar. "
+            "`barrer_expirados` ya lo incluye en cada pasada.")
+
+    def handle(self, *args, **options):
+        corregidos = sincronizar_vencidas()
+        self.stdout.write(self.style.SUCCESS(f"Kinesiologos con suscripción vencida corregidos: {corregidos}"))
@@ -0,0 +1,126 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import reseña
+from core.modulo_ia import analizar_sentimientos, estadisticas_cache, purgar_cache
+from core.utils.resenas import registrar_cambios
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = ("Worker que analiza en lotes las reseñas guardadas sin sentimiento (SENTIMIENTO_ASINCRONO) "
+            "y completa el campo. Se pueden correr varios en paralelo: cada lote se reserva (SKIP LOCKED) antes de analizarlo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=32, help='Reseñas por pasada del modelo')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos de espera cuando no hay pendientes')
+        parser.add_argument('--una-vez', action='store_true', help='Procesa las pendientes actuales y termina')
+        parser.add_argument('--reintentar', action='store_true',
+                            help='Vuelve a intentar las reseñas que agotaron SENTIMIENTO_INTENTOS_MAX (p. ej. tras arreglar el modelo)')
+
+    def tomar_lote(self, lote):
+        """
+        Reserva hasta `lote` reseñas pendientes y retorna [(id, comentario)]. La transacción solo dura la
+        selección: la reserva es sentimiento_tomada_en, así otros workers no toman las mismas mientras se analizan.
+        """
+        ahora = timezone.now()
+        vencidas = ahora - timedelta(minutes=getattr(settings, 'SENTIMIENTO_TOMA_MINUTOS', 10))
+        with transaction.atomic():
+            tomadas = list(
+                reseña.objects.select_for_update(skip_locked=True)
+                .filter(sentimiento__isnull=True, sentimiento_intentos__lt=getattr(settings, 'SENTIMIENTO_INTENTOS_MAX', 3))
+                .filter(Q(sentimiento_tomada_en__isnull=True) | Q(sentimiento_tomada_en__lt=vencidas))
+                .order_by('id')
+                .values_list('id', 'comentario')[:lote]
+            )
+            reseña.objects.filter(id__in=[id_ for id_, _ in tomadas]).update(sentimiento_tomada_en=ahora)
+        return tomadas
+
+    def analizar(self, tomadas):
+        """
+        Analiza [(id, comentario)] fuera de toda transacción y retorna ({id: etiqueta}, [ids que fallaron]).
+        Si el lote falla se parte en mitades, así un comentario que rompe el modelo no arrastra al resto.
+        """
+        try:
+            return dict(zip((id_ for id_, _ in tomadas), analizar_sentimientos([c for _, c in tomadas]))), []
+        except Exception:
+            if len(tomadas) == 1:
+                logger.exception("Error analizando la reseña %s", tomadas[0][0])
+                return {}, [tomadas[0][0]]
+            mitad = len(tomadas) // 2
+            etiquetas, fallidas = self.analizar(tomadas[:mitad])
+            etiquetas_2, fallidas_2 = self.analizar(tomadas[mitad:])
+            return {**etiquetas, **etiquetas_2}, fallidas + fallidas_2
+
+    def guardar(self, tomadas, etiquetas, fallidas):
+        """Guarda las etiquetas de las reseñas que siguen pendientes y con el mismo texto. Retorna cuántas guardó."""
+        comentarios = dict(tomadas)
+        with transaction.atomic():
+            pendientes = [
+                r for r in reseña.objects.select_for_update(of=('self',))
+                .filter(id__in=etiquetas, sentimiento__isnull=True)
+                .only('id', 'comentario')
+                .annotate(kx_id=F('cita__kinesiologo_id'), fecha_cita=F('cita__fecha_hora'))
+                .order_by('id')
+                # Si el texto cambió mientras se analizaba, la etiqueta ya no corresponde: queda para otra pasada
+                if r.comentario == comentarios[r.id]
+            ]
+            for r in pendientes:
+                r.sentimiento = etiquetas[r.id]
+                r.sentimiento_tomada_en = None
+            reseña.objects.bulk_update(pendientes, ['sentimiento', 'sentimiento_tomada_en'])
+            # bulk_update no emite señales: el resumen por kinesiologo se ajusta aquí
+            registrar_cambios([(r.kx_id, r.fecha_cita, None, r.sentimiento) for r in pendientes])
+            # Las que fallaron quedan tomadas: se reintentan cuando vence la reserva, hasta SENTIMIENTO_INTENTOS_MAX veces
+            reseña.objects.filter(id__in=fallidas).update(sentimiento_intentos=F('sentimiento_intentos') + 1)
+        return len(pendientes)
+
+    def procesar_lote(self, lote):
+        """Toma hasta `lote` reseñas pendientes, las analiza y guarda el resultado. Retorna cuántas tomó."""
+        tomadas = self.tomar_lote(lote)
+        if not tomadas:
+            return 0
+        etiquetas, fallidas = self.analizar(tomadas)
+        self.guardar(tomadas, etiquetas, fallidas)
+        if fallidas:
+            logger.warning("No se pudo analizar el sentimiento de las reseñas %s", fallidas)
+        return len(tomadas)
+
+    def handle(self, *args, **options):
+        lote, intervalo = options['lote'], options['intervalo']
+        total = 0
+        if options['reintentar']:
+            reseña.objects.filter(sentimiento__isnull=True).update(sentimiento_intentos=0, sentimiento_tomada_en=None)
+        # Una vez por arranque del worker: la tabla cacheSentimiento no crece sin límite
+        purgadas = purgar_cache()
+        if purgadas:
+            self.stdout.write(f"Caché de sentimiento: {purgadas} entradas obsoletas borradas")
+        try:
+            while True:
+                try:
+                    procesadas = self.procesar_lote(lote)
+                except Exception:
+                    logger.exception("Error analizando un lote de reseñas pendientes")
+                    if options['una_vez']:
+                        raise
+                    time.sleep(intervalo)
+                    continue
+
+                total += procesadas
+                if procesadas:
+                    self.stdout.write(f"{procesadas} reseñas analizadas ({total} en total)")
+                if procesadas < lote:
+                    if options['una_vez']:
+                        break
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Reseñas analizadas: {total}"))
+        self.stdout.write(f"Caché de sentimiento: {estadisticas_cache()}")
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import reseña
+from core.modulo_ia import MODEL_NAME, analizar_sentimientos, purgar_cache
+from core.utils.resenas import registrar_cambios
+
+class Command(BaseCommand):
+    help = ("Recalcula el sentimiento de reseñas existentes (por ejemplo tras cambiar MODEL_NAME o LABELS_MAP). "
+            "Recorre las reseñas por id en bloques, las analiza en lotes ordenados por largo y guarda con bulk_update. "
+            "Se puede retomar con --desde-id usando el último checkpoint informado.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinesiologo', type=int, help='Solo reseñas de citas de este kinesiologo (id)')
+        parser.add_argument('--desde', help='Solo reseñas creadas desde esta fecha (YYYY-MM-DD)')
+        parser.add_argument('--hasta', help='Solo reseñas creadas hasta esta fecha (YYYY-MM-DD, inclusive)')
+        parser.add_argument('--solo-pendientes', action='store_true', help='Solo reseñas con sentimiento NULL')
+        parser.add_argument('--desde-id', type=int, default=0, help='Checkpoint: procesa reseñas con id mayor a este')
+        parser.add_argument('--bloque', type=int, default=500, help='Reseñas leídas y guardadas por bloque')
+
+    def _guardar(self, bloque):
+        """
+        Analiza un bloque [(id, comentario, sentimiento_actual, kinesiologo_id, fecha_cita)] y guarda solo las que cambiaron.
+        Los deltas del resumen salen de las filas releídas con FOR UPDATE: si procesar_sentimientos u otra escritura
+        las tocó desde la lectura, se parte de su valor actual y no se cuenta dos veces el mismo cambio.
+        """
+        etiquetas = dict(zip((fila[0] for fila in bloque), analizar_sentimientos([fila[1] for fila in bloque])))
+        comentarios = {fila[0]: fila[1] for fila in bloque}
+        with transaction.atomic():
+            bloqueadas = (reseña.objects.select_for_update(of=('self',)).filter(id__in=etiquetas).order_by('id')
+                          .values_list('id', 'comentario', 'sentimiento', 'cita__kinesiologo_id', 'cita__fecha_hora'))
+            cambiadas = [
+                (id_, kx_id, fecha_cita, actual, etiquetas[id_])
+                for id_, comentario, actual, kx_id, fecha_cita in bloqueadas
+                # Si el texto cambió, la etiqueta calculada ya no corresponde: la reseña se deja como está
+                if comentario == comentarios[id_] and etiquetas[id_] != actual
+            ]
+            reseña.objects.bulk_update([reseña(id=id_, sentimiento=etiqueta) for id_, _, _, _, etiqueta in cambiadas], ['sentimiento'])
+            # bulk_update no emite señales: el resumen por kinesiologo se ajusta aquí
+            registrar_cambios([(kx_id, fecha_cita, actual, etiqueta) for _, kx_id, fecha_cita, actual, etiqueta in cambiadas])
+        return len(cambiadas)
+
+    def handle(self, *args, **options):
+        qs = reseña.objects.filter(id__gt=options['desde_id'])
+        if options['kinesiologo']:
+            qs = qs.filter(cita__kinesiologo_id=options['kinesiologo'])
+        if options['desde']:
+            qs = qs.filter(fecha_creacion__date__gte=options['desde'])
+        if options['hasta']:
+            qs = qs.filter(fecha_creacion__date__lte=options['hasta'])
+        if options['solo_pendientes']:
+            qs = qs.filter(sentimiento__isnull=True)
+
+        self.stdout.write(f"Recalculando sentimiento con {MODEL_NAME}")
+        tamano = options['bloque']
+        procesadas = cambiadas = 0
+        t0 = time.perf_counter()
+        bloque = []
+
+        def vaciar():
+            nonlocal procesadas, cambiadas, bloque
+            cambiadas += self._guardar(bloque)
+            procesadas += len(bloque)
+            checkpoint = bloque[-1][0]
+            bloque = []
+            velocidad = procesadas / (time.perf_counter() - t0)
+            self.stdout.write(f"{procesadas} reseñas ({cambiadas} cambiadas), {velocidad:.1f} reseñas/s. "
+                              f"Checkpoint: --desde-id {checkpoint}")
+
+        for fila in qs.order_by('id').values_list('id', 'comentario', 'sentimiento', 'cita__kinesiologo_id', 'cita__fecha_hora').iterator(chunk_size=tamano):
+            bloque.append(fila)
+            if len(bloque) >= tamano:
+                vaciar()
+        if bloque:
+            vaciar()
+
+        duracion = time.perf_counter() - t0
+        velocidad = procesadas / duracion if duracion else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {procesadas} reseñas en {duracion:.1f}s ({velocidad:.1f} reseñas/s), {cambiadas} cambiadas."
+        ))
+        # Tras un cambio de modelo o backend las entradas anteriores de la caché ya no se leen: se borran aquí
+        self.stdout.write(f"Caché de sentimiento: {purgar_cache()} entradas obsoletas borradas")
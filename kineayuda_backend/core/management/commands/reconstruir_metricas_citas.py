@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.utils.metricas import reconstruir
+
+class Command(BaseCommand):
+    help = ("Recalcula desde cero las métricas diarias de metricas-citas (citas por estado, ocupación de agenda e "
+            "ingresos) desde cita, agenda y pagoCita. Útil tras cargas masivas, updates manuales o si cambió TIME_ZONE.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinesiologo', type=int, action='append', help='Solo este kinesiologo (id); se puede repetir')
+        parser.add_argument('--bloque', type=int, default=200, help='Kinesiologos recalculados por transacción')
+
+    def handle(self, *args, **options):
+        filas = reconstruir(options['kinesiologo'], tamano_bloque=options['bloque'])
+        self.stdout.write(self.style.SUCCESS(f"Días con métricas de citas reconstruidos: {filas}"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.utils.resenas import reconstruir
+
+class Command(BaseCommand):
+    help = ("Recalcula desde cero el resumen de reseñas por kinesiologo (conteos y score) y las métricas diarias "
+            "de metricas-resenas, agregando todas las reseñas. Útil tras cargas masivas, si se reagendó una cita "
+            "ya reseñada o si cambió TIME_ZONE.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kinesiologo', type=int, action='append', help='Solo este kinesiologo (id); se puede repetir')
+
+    def handle(self, *args, **options):
+        resumenes, dias = reconstruir(options['kinesiologo'])
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes de reseñas reconstruidos: {resumenes} (días con reseñas: {dias})"))
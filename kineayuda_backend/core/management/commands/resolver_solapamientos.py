@@ -0,0 +1,65 @@
+import bisect
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import agenda
+
+# Ante un choque se conserva el de menor prioridad: el reservado tiene una cita detrás, el retenido un pago en
+# curso y el bloqueo es una decisión del kinesiologo; un disponible que choca con ellos no se pierde nada.
+PRIORIDAD = {'reservado': 0, 'retenido': 1, 'no_disponible': 2, 'disponible': 3}
+
+# Solo columnas que ya existen antes de la migración 0011, para poder correrlo cuando esa migración aborta
+_COLUMNAS = ('id', 'inicio', 'fin', 'estado')
+
+def resolver_kinesiologo(horarios):
+    """
+    Recibe [(id, inicio, fin, estado)] activos de un kinesiologo y retorna (descartados, dobles_reservas), listas de
+    pares (id, id con el que choca). Se recorren por prioridad y luego por inicio; cada uno que choca con uno ya
+    conservado se descarta, salvo dos reservados que se solapan: eso es una doble reserva real y no se decide aquí.
+    """
+    conservados = []  # (inicio, fin, id) sin solapes entre sí, ordenados por inicio
+    descartados, dobles_reservas = [], []
+    for id_, inicio, fin, estado in sorted(horarios, key=lambda h: (PRIORIDAD[h[3]], h[1], h[0])):
+        i = bisect.bisect_left(conservados, (fin,))
+        # Solo el conservado anterior puede alcanzar a este: los conservados no se solapan entre sí
+        choque = next((c for c in conservados[max(0, i - 1):i + 1] if c[0] < fin and c[1] > inicio), None)
+        if choque is None:
+            conservados.insert(i, (inicio, fin, id_))
+        elif estado == 'reservado':
+            dobles_reservas.append((id_, choque[2]))
+        else:
+            descartados.append((id_, choque[2]))
+    return descartados, dobles_reservas
+
+class Command(BaseCommand):
+    help = ("Lista los horarios activos que se solapan con otro del mismo kinesiologo (los que impiden crear la "
+            "restricción de la migración 0011). Con --aplicar marca 'expirado' el de menor prioridad de cada choque "
+            "(disponible, luego no_disponible, luego retenido) sin borrar nada. Las dobles reservas se listan "
+            "para resolverlas a mano.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--aplicar', action='store_true', help="Marca 'expirado' los horarios descartados")
+
+    def handle(self, *args, **options):
+        activos = agenda.objects.filter(estado__in=list(PRIORIDAD))
+        kinesiologos = activos.order_by('kinesiologo_id').values_list('kinesiologo_id', flat=True).distinct()
+        total_descartados, total_dobles = 0, []
+        for kx_id in kinesiologos.iterator():
+            with transaction.atomic():
+                horarios = activos.filter(kinesiologo_id=kx_id).select_for_update()
+                descartados, dobles = resolver_kinesiologo(list(horarios.values_list(*_COLUMNAS)))
+                for id_, con in descartados:
+                    self.stdout.write(f"Kinesiologo {kx_id}: horario {id_} se solapa con {con}"
+                                      + (" -> expirado" if options['aplicar'] else ""))
+                for a, b in dobles:
+                    self.stdout.write(self.style.WARNING(f"Kinesiologo {kx_id}: horarios reservados {a} y {b} se solapan"))
+                if options['aplicar'] and descartados:
+                    agenda.objects.filter(id__in=[id_ for id_, _ in descartados]).update(estado='expirado')
+            total_descartados += len(descartados)
+            total_dobles += dobles
+
+        accion = "marcados 'expirado'" if options['aplicar'] else "por descartar (usa --aplicar)"
+        self.stdout.write(f"Horarios {accion}: {total_descartados}")
+        if total_dobles:
+            raise CommandError(f"{len(total_dobles)} dobles reservas: reprograma o cancela una de las citas de cada par.")
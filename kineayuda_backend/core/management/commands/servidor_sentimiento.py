@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.modulo_ia import precargar_modelo
+from core.utils.sidecar_sentimiento import ServidorSentimiento, ruta_socket
+
+class Command(BaseCommand):
+    help = ("Sidecar de inferencia de sentimiento: carga el modelo una vez y atiende a los workers de Django "
+            "por un socket Unix (SENTIMIENTO_SIDECAR_SOCKET).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', help='Ruta del socket (por defecto SENTIMIENTO_SIDECAR_SOCKET)')
+
+    def handle(self, *args, **options):
+        ruta = options['socket'] or ruta_socket()
+        if not ruta:
+            raise CommandError("Define SENTIMIENTO_SIDECAR_SOCKET o usa --socket.")
+
+        self.stdout.write("Cargando modelo de sentimiento...")
+        precargar_modelo()
+
+        servidor = ServidorSentimiento(ruta)
+        self.stdout.write(self.style.SUCCESS(f"Sidecar de sentimiento escuchando en {ruta}"))
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+            if os.path.exists(ruta):
+                os.unlink(ruta)
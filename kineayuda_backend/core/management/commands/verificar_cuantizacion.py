@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.modulo_ia import cargar_modelo, inferir_lote
+from core.utils.bench import cargar_datos
+
+class Command(BaseCommand):
+    help = ("Compara el backend int8 contra el modelo float32 sobre el conjunto de reseñas de referencia "
+            "(core/data/resenas_referencia.json). Falla si el acuerdo entre ambos baja del mínimo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-acuerdo', type=float, default=0.95,
+                            help='Fracción mínima de reseñas con la misma etiqueta en ambos backends')
+        parser.add_argument('--lote', type=int, default=16)
+
+    def _predecir(self, backend, textos, lote):
+        tokenizer, model = cargar_modelo(backend)
+        etiquetas = []
+        for i in range(0, len(textos), lote):
+            etiquetas += inferir_lote(textos[i:i + lote], tokenizer=tokenizer, model=model)
+        return etiquetas
+
+    def handle(self, *args, **options):
+        referencia = cargar_datos('resenas_referencia.json')
+        textos = [r['texto'] for r in referencia]
+        esperadas = [r['sentimiento'] for r in referencia]
+
+        float32 = self._predecir('float32', textos, options['lote'])
+        int8 = self._predecir('int8', textos, options['lote'])
+
+        def exactitud(pred):
+            return sum(p == e for p, e in zip(pred, esperadas)) / len(esperadas)
+
+        acuerdo = sum(a == b for a, b in zip(float32, int8)) / len(textos)
+        diferencias = [
+            {'texto': t, 'esperado': e, 'float32': a, 'int8': b}
+            for t, e, a, b in zip(textos, esperadas, float32, int8) if a != b
+        ]
+        self.stdout.write(json.dumps({
+            'reseñas': len(textos),
+            'acuerdo_int8_float32': acuerdo,
+            'exactitud_float32': exactitud(float32),
+            'exactitud_int8': exactitud(int8),
+            'diferencias': diferencias,
+        }, indent=2, ensure_ascii=False))
+
+        if acuerdo < options['min_acuerdo']:
+            raise CommandError(f"El backend int8 coincide en {acuerdo:.1%}, bajo el mínimo de {options['min_acuerdo']:.1%}.")
+        self.stdout.write(self.style.SUCCESS(f"Paridad int8/float32: {acuerdo:.1%}"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.utils.suscripciones import inconsistencias, reconstruir_vencimientos
+
+class Command(BaseCommand):
+    help = ("Compara kinesiologo.suscripcion_vence_en con el historial de pagos de suscripción. "
+            "Con --corregir lo reconstruye para todos los kinesiologos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corregir', action='store_true', help='Reconstruye el valor desde los pagos')
+
+    def handle(self, *args, **options):
+        distintos = inconsistencias()
+        for kx in distintos:
+            self.stdout.write(f"kinesiologo {kx.id}: guardado={kx.suscripcion_vence_en} según pagos={kx.esperado}")
+
+        if options['corregir']:
+            actualizados = reconstruir_vencimientos()
+            self.stdout.write(self.style.SUCCESS(f"Vencimientos reconstruidos: {actualizados} kinesiologos."))
+        elif distintos:
+            self.stdout.write(self.style.WARNING(f"{len(distintos)} inconsistencias. Use --corregir para repararlas."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Sin inconsistencias."))
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_cita_estado_pago_pagocita'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='cacheSentimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('sentimiento', models.CharField(choices=[('positiva', 'positiva'), ('neutral', 'neutral'), ('negativa', 'negativa')], max_length=10)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def poblar_vencimientos(apps, schema_editor):
+    kinesiologo = apps.get_model('core', 'kinesiologo')
+    pagoSuscripcion = apps.get_model('core', 'pagoSuscripcion')
+    ultimo_vencimiento = (pagoSuscripcion.objects
+                          .filter(kinesiologo=OuterRef('pk'), estado='pagado', fecha_expiracion__isnull=False)
+                          .order_by('-fecha_expiracion')
+                          .values('fecha_expiracion')[:1])
+    kinesiologo.objects.update(suscripcion_vence_en=Subquery(ultimo_vencimiento))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_cachesentimiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kinesiologo',
+            name='suscripcion_vence_en',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(poblar_vencimientos, migrations.RunPython.noop),
+    ]
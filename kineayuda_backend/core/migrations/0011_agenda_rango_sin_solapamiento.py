@@ -0,0 +1,91 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:21
+
+import itertools
+
+from django.db import migrations, models
+
+# Solo PostgreSQL: columna generada con el rango [inicio, fin) y restricción de exclusión GiST para que
+# dos horarios activos del mismo kinesiologo nunca se solapen, aunque lleguen requests concurrentes.
+# En otros motores el solapamiento se sigue validando en Python (core/utils/agenda.py).
+SQL_CREAR = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "ALTER TABLE core_agenda ADD COLUMN rango tstzrange GENERATED ALWAYS AS (tstzrange(inicio, fin, '[)')) STORED",
+    "ALTER TABLE core_agenda ADD CONSTRAINT agenda_sin_solapamiento "
+    "EXCLUDE USING gist (kinesiologo_id WITH =, rango WITH &&) "
+    "WHERE (estado IN ('disponible', 'reservado', 'no_disponible'))",
+]
+SQL_BORRAR = [
+    "ALTER TABLE core_agenda DROP CONSTRAINT IF EXISTS agenda_sin_solapamiento",
+    "ALTER TABLE core_agenda DROP COLUMN IF EXISTS rango",
+]
+
+
+# Estados activos al momento de esta migración (los que cubre la restricción)
+ESTADOS_ACTIVOS = ['disponible', 'reservado', 'no_disponible']
+# Pares que se listan en el error; el resto se ve con `manage.py resolver_solapamientos`
+PARES_EN_ERROR = 50
+
+
+class HorariosSolapados(Exception):
+    pass
+
+
+def buscar_solapados(Agenda):
+    """
+    Genera pares (id, id) de horarios activos del mismo kinesiologo que se solapan. Recorre un kinesiologo a
+    la vez por inicio, comparando cada horario con el que termina más tarde de los anteriores, sin cargar
+    la agenda completa en memoria.
+    """
+    activos = Agenda.objects.filter(estado__in=ESTADOS_ACTIVOS)
+    kinesiologos = activos.order_by('kinesiologo_id').values_list('kinesiologo_id', flat=True).distinct()
+    for kx_id in kinesiologos.iterator():
+        fin_max = id_fin_max = None
+        horarios = activos.filter(kinesiologo_id=kx_id).order_by('inicio', 'id').values_list('id', 'inicio', 'fin')
+        for id_, inicio, fin in horarios.iterator(chunk_size=2000):
+            if fin_max is not None and inicio < fin_max:
+                yield (id_fin_max, id_)
+            if fin_max is None or fin > fin_max:
+                fin_max, id_fin_max = fin, id_
+
+
+def _verificar_sin_solapados(apps, schema_editor):
+    """
+    El camino de actualización previo no validaba solapamientos: si quedan horarios que chocan, la restricción
+    no se puede crear. La migración no borra ni cambia datos; aborta con los pares para resolverlos a mano.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    pares = list(itertools.islice(buscar_solapados(apps.get_model('core', 'agenda')), PARES_EN_ERROR + 1))
+    if pares:
+        raise HorariosSolapados(
+            "Hay horarios activos que se solapan (id, id): "
+            + ", ".join(f"({a}, {b})" for a, b in pares[:PARES_EN_ERROR])
+            + (" y más" if len(pares) > PARES_EN_ERROR else "")
+            + ". Revísalos con `python manage.py resolver_solapamientos` (con --aplicar los resuelve) "
+            "y vuelve a correr la migración."
+        )
+
+
+def _ejecutar_en_postgres(sentencias):
+    def operacion(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in sentencias:
+            schema_editor.execute(sql)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_kinesiologo_suscripcion_vence_en'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agenda',
+            index=models.Index(fields=['kinesiologo', 'estado', 'inicio'], name='agenda_kx_estado_inicio'),
+        ),
+        migrations.RunPython(_verificar_sin_solapados, migrations.RunPython.noop),
+        migrations.RunPython(_ejecutar_en_postgres(SQL_CREAR), _ejecutar_en_postgres(SQL_BORRAR)),
+    ]
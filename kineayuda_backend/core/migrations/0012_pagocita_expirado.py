@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_agenda_rango_sin_solapamiento'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pagocita',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'pendiente'), ('pagado', 'pagado'), ('fallido', 'fallido'), ('expirado', 'expirado')], db_index=True, default='pendiente', max_length=20),
+        ),
+    ]
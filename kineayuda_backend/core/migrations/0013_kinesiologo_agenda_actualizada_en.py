@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_pagocita_expirado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kinesiologo',
+            name='agenda_actualizada_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+# Solo PostgreSQL: la restricción de exclusión de 0011 pasa a incluir los horarios 'retenido',
+# para que una retención de Webpay también impida publicar un horario que la solape.
+SQL_RESTRICCION = (
+    "ALTER TABLE core_agenda ADD CONSTRAINT agenda_sin_solapamiento "
+    "EXCLUDE USING gist (kinesiologo_id WITH =, rango WITH &&) "
+    "WHERE (estado IN ({estados}))"
+)
+SQL_CON_RETENIDO = [
+    "ALTER TABLE core_agenda DROP CONSTRAINT IF EXISTS agenda_sin_solapamiento",
+    SQL_RESTRICCION.format(estados="'disponible', 'reservado', 'no_disponible', 'retenido'"),
+]
+SQL_SIN_RETENIDO = [
+    "ALTER TABLE core_agenda DROP CONSTRAINT IF EXISTS agenda_sin_solapamiento",
+    SQL_RESTRICCION.format(estados="'disponible', 'reservado', 'no_disponible'"),
+]
+
+
+def _ejecutar_en_postgres(sentencias):
+    def operacion(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in sentencias:
+            schema_editor.execute(sql)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_kinesiologo_agenda_actualizada_en'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agenda',
+            name='retenido_hasta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='agenda',
+            name='estado',
+            field=models.CharField(choices=[('disponible', 'disponible'), ('reservado', 'reservado'), ('no_disponible', 'no_disponible'), ('expirado', 'expirado'), ('retenido', 'retenido')], default='disponible', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='pagocita',
+            name='token_ws',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.RunPython(_ejecutar_en_postgres(SQL_CON_RETENIDO), _ejecutar_en_postgres(SQL_SIN_RETENIDO)),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_agenda_retencion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kinesiologo',
+            name='ical_token',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_kinesiologo_ical_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='kinesiologo',
+            index=models.Index(fields=['estado_verificacion', 'apellido', 'nombre', 'id'], name='kx_directorio'),
+        ),
+    ]
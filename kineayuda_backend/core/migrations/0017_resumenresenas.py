@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:37
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+
+def poblar_resumenes(apps, schema_editor):
+    kinesiologo = apps.get_model('core', 'kinesiologo')
+    reseña = apps.get_model('core', 'reseña')
+    resumenReseñas = apps.get_model('core', 'resumenReseñas')
+    conteos = {
+        fila.pop('cita__kinesiologo_id'): fila
+        for fila in reseña.objects.values('cita__kinesiologo_id').annotate(
+            total=Count('id'),
+            positivas=Count('id', filter=Q(sentimiento='positiva')),
+            neutrales=Count('id', filter=Q(sentimiento='neutral')),
+            negativas=Count('id', filter=Q(sentimiento='negativa')),
+            pendientes=Count('id', filter=Q(sentimiento__isnull=True)),
+        )
+    }
+    resumenReseñas.objects.bulk_create(
+        [resumenReseñas(kinesiologo_id=kx_id, **conteos.get(kx_id, {}))
+         for kx_id in kinesiologo.objects.values_list('id', flat=True)],
+        batch_size=1000,
+    )
+    analizadas = F('positivas') + F('neutrales') + F('negativas')
+    resumenReseñas.objects.filter(Q(positivas__gt=0) | Q(neutrales__gt=0) | Q(negativas__gt=0)).update(
+        score_promedio=Cast(F('positivas') - F('negativas'), FloatField()) / Cast(analizadas, FloatField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_kinesiologo_directorio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='resumenReseñas',
+            fields=[
+                ('kinesiologo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumen_resenas', serialize=False, to='core.kinesiologo')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('positivas', models.PositiveIntegerField(default=0)),
+                ('neutrales', models.PositiveIntegerField(default=0)),
+                ('negativas', models.PositiveIntegerField(default=0)),
+                ('pendientes', models.PositiveIntegerField(default=0)),
+                ('score_promedio', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(models.OrderBy(django.db.models.functions.comparison.Coalesce('score_promedio', models.Value(-2.0)), descending=True), models.F('kinesiologo'), name='resumen_resenas_rating')],
+            },
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
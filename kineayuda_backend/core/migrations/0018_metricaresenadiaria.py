@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+
+def poblar_metricas(apps, schema_editor):
+    reseña = apps.get_model('core', 'reseña')
+    metricaReseñaDiaria = apps.get_model('core', 'metricaReseñaDiaria')
+    filas = (
+        reseña.objects.annotate(dia=TruncDate('cita__fecha_hora'))
+        .values('cita__kinesiologo_id', 'dia')
+        .annotate(
+            total=Count('id'),
+            positivas=Count('id', filter=Q(sentimiento='positiva')),
+            neutrales=Count('id', filter=Q(sentimiento='neutral')),
+            negativas=Count('id', filter=Q(sentimiento='negativa')),
+            pendientes=Count('id', filter=Q(sentimiento__isnull=True)),
+        )
+    )
+    metricaReseñaDiaria.objects.bulk_create(
+        [metricaReseñaDiaria(kinesiologo_id=fila.pop('cita__kinesiologo_id'), **fila) for fila in filas],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_resumenresenas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='metricaReseñaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('positivas', models.PositiveIntegerField(default=0)),
+                ('neutrales', models.PositiveIntegerField(default=0)),
+                ('negativas', models.PositiveIntegerField(default=0)),
+                ('pendientes', models.PositiveIntegerField(default=0)),
+                ('kinesiologo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_resenas', to='core.kinesiologo')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kinesiologo', 'dia'), name='metrica_resena_kx_dia')],
+            },
+        ),
+        migrations.RunPython(poblar_metricas, migrations.RunPython.noop),
+    ]
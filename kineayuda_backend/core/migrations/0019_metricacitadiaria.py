@@ -0,0 +1,84 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:42
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def poblar_metricas(apps, schema_editor):
+    cita = apps.get_model('core', 'cita')
+    agenda = apps.get_model('core', 'agenda')
+    pagoCita = apps.get_model('core', 'pagoCita')
+    metricaCitaDiaria = apps.get_model('core', 'metricaCitaDiaria')
+    filas = defaultdict(dict)
+    consultas = [
+        cita.objects.annotate(dia=TruncDate('fecha_hora')).values('kinesiologo_id', 'dia').annotate(
+            citas=Count('id'),
+            pendientes=Count('id', filter=Q(estado='pendiente')),
+            completadas=Count('id', filter=Q(estado='completada')),
+            canceladas=Count('id', filter=Q(estado='cancelada')),
+        ),
+        agenda.objects.exclude(estado='no_disponible').annotate(dia=TruncDate('inicio')).values('kinesiologo_id', 'dia').annotate(
+            horarios_ofrecidos=Count('id'),
+            horarios_reservados=Count('id', filter=Q(estado='reservado')),
+        ),
+        pagoCita.objects.filter(estado='pagado', fecha_pago__isnull=False).annotate(dia=TruncDate('fecha_pago'))
+        .values('kinesiologo_id', 'dia').annotate(pagos=Count('id'), ingresos=Sum('monto')),
+    ]
+    for consulta in consultas:
+        for fila in consulta:
+            filas[(fila.pop('kinesiologo_id'), fila.pop('dia'))].update(fila)
+    metricaCitaDiaria.objects.bulk_create(
+        [metricaCitaDiaria(kinesiologo_id=kx_id, dia=dia, **valores) for (kx_id, dia), valores in filas.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_metricaresenadiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='metricaCitaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('citas', models.PositiveIntegerField(default=0)),
+                ('pendientes', models.PositiveIntegerField(default=0)),
+                ('completadas', models.PositiveIntegerField(default=0)),
+                ('canceladas', models.PositiveIntegerField(default=0)),
+                ('horarios_ofrecidos', models.PositiveIntegerField(default=0)),
+                ('horarios_reservados', models.PositiveIntegerField(default=0)),
+                ('pagos', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='agenda',
+            index=models.Index(fields=['kinesiologo', 'inicio'], name='agenda_kx_inicio'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['kinesiologo', 'fecha_hora'], name='cita_kx_fecha_hora'),
+        ),
+        migrations.AddIndex(
+            model_name='pagocita',
+            index=models.Index(fields=['kinesiologo', 'estado', 'fecha_pago'], name='pagocita_kx_estado_fecha'),
+        ),
+        migrations.AddField(
+            model_name='metricacitadiaria',
+            name='kinesiologo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_citas', to='core.kinesiologo'),
+        ),
+        migrations.AddConstraint(
+            model_name='metricacitadiaria',
+            constraint=models.UniqueConstraint(fields=('kinesiologo', 'dia'), name='metrica_cita_kx_dia'),
+        ),
+        migrations.RunPython(poblar_metricas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:45
+
+from django.db import migrations
+
+# Solo PostgreSQL: búsqueda difusa del directorio (?q=) con pg_trgm sobre nombre, apellido y especialidad
+# sin tildes. unaccent() no es IMMUTABLE, así que se envuelve en f_unaccent (diccionario fijo) para poder
+# indexarla. La expresión del índice debe ser idéntica a DocumentoBusqueda (core/utils/busqueda.py).
+# En otros motores se usa un índice de trigramas en memoria.
+SQL_CREAR = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+    "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$",
+    "CREATE INDEX IF NOT EXISTS kx_busqueda_trgm ON core_kinesiologo "
+    "USING gin (f_unaccent(lower(nombre || ' ' || apellido || ' ' || especialidad)) gin_trgm_ops)",
+]
+SQL_BORRAR = [
+    "DROP INDEX IF EXISTS kx_busqueda_trgm",
+    "DROP FUNCTION IF EXISTS f_unaccent(text)",
+]
+
+
+def _ejecutar_en_postgres(sentencias):
+    def operacion(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in sentencias:
+            schema_editor.execute(sql)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_metricacitadiaria'),
+    ]
+
+    operations = [
+        migrations.RunPython(_ejecutar_en_postgres(SQL_CREAR), _ejecutar_en_postgres(SQL_BORRAR)),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_kinesiologo_busqueda_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reseña',
+            name='sentimiento_intentos',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reseña',
+            name='sentimiento_tomada_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_resena_sentimiento_toma'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachesentimiento',
+            name='firma',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from decimal import Decimal
 import os
@@ -29,10 +30,53 @@ class kinesiologo (models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     foto_perfil = models.ImageField(upload_to=kx_profile_upload_path, blank=True, null=True)
+    #Copia del vencimiento del último pago de suscripción (ver core/utils/suscripciones.py)
+    suscripcion_vence_en = models.DateTimeField(blank=True, null=True, db_index=True)
+    #Última modificación de sus horarios; versión del ETag de las horas disponibles (ver core/utils/agenda.py)
+    agenda_actualizada_en = models.DateTimeField(blank=True, null=True)
+    #Secreto de la URL del calendario iCal (core/utils/ical.py); nunca se expone en los serializers
+    ical_token = models.CharField(max_length=64, unique=True, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            #Directorio público: aprobados ordenados por apellido, nombre (core/pagination.py)
+            models.Index(fields=['estado_verificacion', 'apellido', 'nombre', 'id'], name='kx_directorio'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} {self.apellido}"
 
+    #Solo se escriben con UPDATE directo: agenda_actualizada_en en marcar_agenda_modificada (core/utils/agenda.py)
+    #y suscripcion_vence_en en core/utils/suscripciones.py
+    CAMPOS_SOLO_UPDATE = ('agenda_actualizada_en', 'suscripcion_vence_en')
+
+    def save(self, *args, **kwargs):
+        # Un save() del perfil con la instancia ya cargada (p. ej. la memoizada del request) no debe
+        # volver esos campos a un valor anterior, como pisar una extensión que webpay_retorno acaba de escribir.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in self.CAMPOS_SOLO_UPDATE]
+        super().save(*args, **kwargs)
+
+    #Campos que muestra o filtra el directorio público; los primeros tres además arman el índice de búsqueda (?q=)
+    CAMPOS_BUSQUEDA = ('nombre', 'apellido', 'especialidad')
+    CAMPOS_DIRECTORIO = CAMPOS_BUSQUEDA + ('estado_verificacion', 'foto_perfil')
+
+    def valores_directorio(self):
+        return tuple(str(getattr(self, campo) or '') for campo in self.CAMPOS_DIRECTORIO)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        #Valores leídos de la base: las señales solo invalidan el directorio y la búsqueda si alguno cambió
+        if all(campo in instancia.__dict__ for campo in cls.CAMPOS_DIRECTORIO):
+            instancia._directorio_original = instancia.valores_directorio()
+        return instancia
+
+    @property
+    def suscripcion_activa(self) -> bool:
+        return bool(self.suscripcion_vence_en and self.suscripcion_vence_en > timezone.now())
+
 class paciente(models.Model):
     nombre = models.CharField(max_length=100)
     apellido = models.CharField(max_length=100)
@@ -62,9 +106,23 @@ class cita(models.Model):
                                     default='pendiente')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            #Citas de un kinesiologo por rango de fechas (métricas diarias, core/utils/metricas.py)
+            models.Index(fields=['kinesiologo', 'fecha_hora'], name='cita_kx_fecha_hora'),
+        ]
+
     def __str__(self):
         return f"Cita {self.id} - {self.paciente} con {self.kinesiologo}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        #Día que ocupaba la cita al leerla: si se reagenda, las señales recalculan también el día anterior
+        if 'kinesiologo_id' in instancia.__dict__ and 'fecha_hora' in instancia.__dict__:
+            instancia._original = (instancia.kinesiologo_id, instancia.fecha_hora)
+        return instancia
+
 class reseña(models.Model):
     OPCIONES_SENTIMIENTO = [
         ('positiva', 'positiva'),
@@ -76,17 +134,82 @@ class reseña(models.Model):
     comentario = models.TextField()
     sentimiento = models.CharField(max_length=10, choices=OPCIONES_SENTIMIENTO, blank=True, null=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    #Estado del worker procesar_sentimientos: cuándo tomó la reseña pendiente y cuántas veces falló su análisis
+    sentimiento_tomada_en = models.DateTimeField(blank=True, null=True)
+    sentimiento_intentos = models.PositiveSmallIntegerField(default=0)
 
     def __str__(self):
         return f"Reseña cita {self.cita.id} - {self.sentimiento}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        #Cita y sentimiento leídos de la base: las señales ajustan resumenReseñas solo con lo que cambió (core/utils/resenas.py)
+        if 'sentimiento' in instancia.__dict__ and 'cita_id' in instancia.__dict__:
+            instancia._original = (instancia.cita_id, instancia.sentimiento)
+        return instancia
+
+class resumenReseñas(models.Model):
+    """Conteos de reseñas por kinesiologo, actualizados en la misma transacción que cada reseña (core/utils/resenas.py)."""
+    kinesiologo = models.OneToOneField(kinesiologo, on_delete=models.CASCADE, primary_key=True, related_name='resumen_resenas')
+    total = models.PositiveIntegerField(default=0)
+    positivas = models.PositiveIntegerField(default=0)
+    neutrales = models.PositiveIntegerField(default=0)
+    negativas = models.PositiveIntegerField(default=0)
+    pendientes = models.PositiveIntegerField(default=0) #Aún sin analizar: cuentan en el total pero no en el score
+    #Promedio de positiva=+1, neutral=0, negativa=-1 sobre las analizadas; NULL si no hay ninguna
+    score_promedio = models.FloatField(blank=True, null=True)
+
+    SIN_SCORE = -2.0 #Valor de orden para quien no tiene reseñas analizadas: queda después de score -1
+
+    class Meta:
+        indexes = [
+            #Directorio ordenado (?orden=rating) o filtrado (?rating_min=) por reputación
+            models.Index(Coalesce('score_promedio', models.Value(-2.0)).desc(), 'kinesiologo', name='resumen_resenas_rating'),
+        ]
+
+    def __str__(self):
+        return f"{self.kinesiologo_id} - {self.total} reseñas ({self.score_promedio})"
+
+class metricaReseñaDiaria(models.Model):
+    """Conteos de reseñas por kinesiologo y día de la cita, mantenidos junto con resumenReseñas (core/utils/resenas.py)."""
+    kinesiologo = models.ForeignKey(kinesiologo, on_delete=models.CASCADE, related_name='metricas_resenas')
+    dia = models.DateField() #Día local (TIME_ZONE) de la cita reseñada
+    total = models.PositiveIntegerField(default=0)
+    positivas = models.PositiveIntegerField(default=0)
+    neutrales = models.PositiveIntegerField(default=0)
+    negativas = models.PositiveIntegerField(default=0)
+    pendientes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            #También es el índice de las consultas de metricas-resenas (kinesiologo + rango de días)
+            models.UniqueConstraint(fields=['kinesiologo', 'dia'], name='metrica_resena_kx_dia'),
+        ]
+
+    def __str__(self):
+        return f"{self.kinesiologo_id} {self.dia} - {self.total} reseñas"
+
+class cacheSentimiento(models.Model):
+    """Resultados del modelo de sentimiento por texto, compartidos entre workers (ver modulo_ia.CacheSentimiento)."""
+    clave = models.CharField(max_length=64, unique=True) #sha256 de modelo + etiquetas + texto normalizado
+    firma = models.CharField(max_length=64, default='', db_index=True) #sha256 de modelo + backend + etiquetas, para purgar lo de modelos anteriores
+    sentimiento = models.CharField(max_length=10, choices=reseña.OPCIONES_SENTIMIENTO)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.clave[:12]} - {self.sentimiento}"
+
 class agenda(models.Model):
     ESTADO_HORARIO = [
         ('disponible', 'disponible'),
         ('reservado', 'reservado'),
         ('no_disponible', 'no_disponible'),
         ('expirado', 'expirado'),
+        ('retenido', 'retenido'), #Tomado mientras el paciente paga en Webpay, hasta retenido_hasta
     ]
+    #Estados que ocupan el horario: no pueden solaparse entre sí para un mismo kinesiologo
+    ESTADOS_ACTIVOS = ['disponible', 'reservado', 'no_disponible', 'retenido']
 
     kinesiologo = models.ForeignKey(kinesiologo, on_delete=models.CASCADE, related_name='agenda')
     inicio = models.DateTimeField()
@@ -94,10 +217,27 @@ class agenda(models.Model):
     estado = models.CharField(max_length=20, choices=ESTADO_HORARIO, default='disponible')
     paciente = models.ForeignKey('paciente', on_delete=models.SET_NULL, blank=True, null=True, related_name='cupo_reservado')
     cita = models.OneToOneField('cita', on_delete=models.SET_NULL, blank=True, null=True, related_name='cupo_agenda')
+    retenido_hasta = models.DateTimeField(blank=True, null=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            #Horas disponibles de un kinesiologo desde ahora, ordenadas por inicio
+            models.Index(fields=['kinesiologo', 'estado', 'inicio'], name='agenda_kx_estado_inicio'),
+            #Todos los horarios de un kinesiologo por rango de fechas (ocupación diaria, core/utils/metricas.py)
+            models.Index(fields=['kinesiologo', 'inicio'], name='agenda_kx_inicio'),
+        ]
+
     def __str__(self):
         return f"{self.kinesiologo.nombre} {self.kinesiologo.apellido} - {self.inicio} a {self.fin} ({self.estado})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        #Día que ocupaba el horario al leerlo: si se mueve, las señales recalculan también el día anterior
+        if 'kinesiologo_id' in instancia.__dict__ and 'inicio' in instancia.__dict__:
+            instancia._original = (instancia.kinesiologo_id, instancia.inicio)
+        return instancia
     
     def activa_para_reserva(self):
         return (self.estado == 'disponible' and self.inicio >= timezone.now())
@@ -172,6 +312,7 @@ class pagoCita(models.Model):
         ('pendiente', 'pendiente'),
         ('pagado', 'pagado'),
         ('fallido', 'fallido'),
+        ('expirado', 'expirado'),
     ]
 
     cita = models.OneToOneField('cita', on_delete=models.CASCADE, related_name='pago_cita')
@@ -181,11 +322,38 @@ class pagoCita(models.Model):
     estado = models.CharField(max_length=20, choices=ESTADO_TRANSACCION, default='pendiente', db_index=True)
     buy_order = models.CharField(max_length=120, unique=True, blank=True, null=True)
     session_id = models.CharField(max_length=120, blank=True, null=True)
-    token_ws = models.CharField(max_length=200, blank=True, null=True)
+    token_ws = models.CharField(max_length=200, blank=True, null=True, db_index=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_pago = models.DateTimeField(blank=True, null=True)
 
     raw_payload = models.JSONField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            #Ingresos de un kinesiologo por día de pago (métricas diarias, core/utils/metricas.py)
+            models.Index(fields=['kinesiologo', 'estado', 'fecha_pago'], name='pagocita_kx_estado_fecha'),
+        ]
+
+    def __str__(self):
+        return f"Cita {self.cita_id} - {self.estado} - {self.monto} CLP"
+
+class metricaCitaDiaria(models.Model):
+    """Citas, ocupación de agenda e ingresos por kinesiologo y día local, recalculados al cambiar (core/utils/metricas.py)."""
+    kinesiologo = models.ForeignKey(kinesiologo, on_delete=models.CASCADE, related_name='metricas_citas')
+    dia = models.DateField()
+    citas = models.PositiveIntegerField(default=0) #Citas agendadas para el día, en cualquier estado
+    pendientes = models.PositiveIntegerField(default=0)
+    completadas = models.PositiveIntegerField(default=0)
+    canceladas = models.PositiveIntegerField(default=0)
+    horarios_ofrecidos = models.PositiveIntegerField(default=0) #Horarios de agenda del día, salvo 'no_disponible'
+    horarios_reservados = models.PositiveIntegerField(default=0)
+    pagos = models.PositiveIntegerField(default=0) #Pagos de cita confirmados ese día (fecha_pago)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kinesiologo', 'dia'], name='metrica_cita_kx_dia'),
+        ]
+
     def __str__(self):
-        return f"Cita {self.cita_id} - {self.estado} - {self.monto} CLP"
\ No newline at end of file
+        return f"{self.kinesiologo_id} {self.dia} - {self.citas} citas, {self.ingresos} CLP"
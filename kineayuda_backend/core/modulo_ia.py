@@ -1,44 +1,405 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import torch.nn.functional as F
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 
 # Cargamos un modelo público de sentimiento en español
 MODEL_NAME = "finiteautomata/beto-sentiment-analysis"
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-
 LABELS_MAP = {
     "NEG": "negativa",
     "NEU": "neutral",
     "POS": "positiva",
 }
 
-def analizar_sentimiento(texto: str) -> str:
+# El modelo se carga recién en la primera llamada (torch + transformers son pesados),
+# así manage.py, las migraciones y los workers que nunca analizan reseñas no pagan ese costo.
+_tokenizer = None
+_model = None
+_lock_carga = threading.Lock()
+
+BACKENDS = ("float32", "int8")
+
+def backend_configurado() -> str:
+    backend = getattr(settings, 'SENTIMIENTO_BACKEND', 'float32')
+    if backend not in BACKENDS:
+        raise ValueError(f"SENTIMIENTO_BACKEND inválido: {backend!r}. Opciones: {', '.join(BACKENDS)}")
+    return backend
+
+def cargar_modelo(backend=None):
     """
-    Analiza el sentimiento de un texto en español y retorna:
-    'positiva', 'neutral' o 'negativa'.
+    Carga y retorna (tokenizer, model) desde MODEL_NAME, sin usar la instancia compartida.
+    backend 'int8' cuantiza dinámicamente las capas Linear del clasificador (solo CPU).
+    """
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    backend = backend or backend_configurado()
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
+    model.eval()
+    if backend == "int8":
+        import torch
+
+        # torch.ao.quantization está deprecado (quedará solo en torchao); requirements.txt fija torch==2.8.0, donde
+        # todavía existe. Para subir torch: agregar torchao y reemplazar esta línea por
+        # `torchao.quantization.quantize_(model, Int8DynamicActivationInt8WeightConfig())`, registrarlo como un backend
+        # nuevo en BACKENDS (así la caché de sentimiento no mezcla resultados) y volver a correr verificar_cuantizacion.
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != "float32":
+        raise ValueError(f"Backend de inferencia desconocido: {backend!r}")
+    return tokenizer, model
+
+def obtener_modelo():
+    """Retorna el (tokenizer, model) del proceso, cargándolo una sola vez aunque haya varios hilos."""
+    global _tokenizer, _model
+    if _model is None:
+        with _lock_carga:
+            # Doble verificación: otro hilo pudo terminar la carga mientras esperábamos el lock
+            if _model is None:
+                _tokenizer, _model = cargar_modelo()
+    return _tokenizer, _model
+
+def modelo_cargado() -> bool:
+    return _model is not None
+
+def precargar_modelo():
+    """
+    Hook de calentamiento para el arranque del worker (ver wsgi.py / asgi.py).
+    Carga el modelo y hace una inferencia corta para inicializar los kernels de torch.
+    """
+    obtener_modelo()
+    inferir_lote(["Muy buena atención."])
+
+def inferir_lote(textos, max_length=256, tokenizer=None, model=None):
+    """
+    Corre una sola pasada del modelo sobre varios textos (padding al más largo del lote)
+    y retorna una etiqueta por texto, en el mismo orden.
     """
+    import torch
+
+    if not textos:
+        return []
+    if model is None:
+        tokenizer, model = obtener_modelo()
+
     # Tokenizar
     inputs = tokenizer(
-        texto,
+        list(textos),
         return_tensors="pt",
         truncation=True,
         padding=True,
-        max_length=256,
+        max_length=max_length,
     )
 
-    # Pasar por el modelo sin gradientes
+    # Pasar por el modelo sin gradientes. El argmax de los logits es el mismo que el del softmax.
     with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
+        logits = model(**inputs).logits
 
-    # Softmax para probabilidades
-    probs = F.softmax(logits, dim=-1)
+    # Convertimos índice -> etiqueta del modelo -> etiqueta nuestra
+    id2label = model.config.id2label  # 'NEG', 'NEU', 'POS'
+    return [LABELS_MAP.get(id2label[idx], "neutral") for idx in logits.argmax(dim=-1).tolist()]
 
-    # Índice de la clase más probable
-    pred_idx = probs.argmax(dim=-1).item()
+def inferir_ordenado(textos, tamano_lote, max_length=256, tokenizer=None, model=None):
+    """
+    Infere muchos textos en lotes de `tamano_lote` ordenados por largo, para que cada lote
+    tenga poco padding. Retorna las etiquetas en el orden original.
+    """
+    orden = sorted(range(len(textos)), key=lambda i: len(textos[i]))
+    etiquetas = [None] * len(textos)
+    for inicio in range(0, len(orden), max(1, tamano_lote)):
+        indices = orden[inicio:inicio + max(1, tamano_lote)]
+        lote = inferir_lote([textos[i] for i in indices], max_length, tokenizer=tokenizer, model=model)
+        for i, etiqueta in zip(indices, lote):
+            etiquetas[i] = etiqueta
+    return etiquetas
 
-    # Convertimos índice -> etiqueta del modelo -> etiqueta nuestra
-    raw_label = model.config.id2label[pred_idx]  # 'NEG', 'NEU', 'POS'
-    return LABELS_MAP.get(raw_label, "neutral")
+class _Solicitud:
+    __slots__ = ("texto", "resultado", "error", "evento", "con_hilo_ocupado")
+
+    def __init__(self, texto, con_hilo_ocupado=False):
+        self.texto = texto
+        self.con_hilo_ocupado = con_hilo_ocupado  # llegó mientras se procesaba otro lote
+        self.resultado = None
+        self.error = None
+        self.evento = threading.Event()
+
+class ColaInferencia:
+    """
+    Junta las llamadas concurrentes a analizar_sentimiento en lotes: el lote se procesa cuando
+    llega a `tamano_max` textos o cuando pasan `espera_ms` desde el primer texto en cola.
+    Si el hilo estaba ocioso y llega un solo texto, se procesa de inmediato: solo se espera
+    a juntar un lote cuando hay otras llamadas en curso.
+    Un hilo de fondo hace la inferencia y cada llamador recibe su propia etiqueta.
+    """
+
+    def __init__(self, tamano_max, espera_ms):
+        self.tamano_max = max(1, int(tamano_max))
+        self.espera = max(0.0, espera_ms / 1000.0)
+        self._cond = threading.Condition()
+        self._pendientes = []
+        self._hilo = None
+        self._pid = None
+        self._ocupado = False
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+            self._pendientes = []
+            self._ocupado = False
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name="cola-sentimiento", daemon=True)
+            self._hilo.start()
+
+    def analizar(self, texto: str) -> str:
+        with self._cond:
+            self._asegurar_hilo()
+            solicitud = _Solicitud(texto, con_hilo_ocupado=self._ocupado)
+            self._pendientes.append(solicitud)
+            self._cond.notify_all()
+        solicitud.evento.wait()
+        if solicitud.error is not None:
+            raise solicitud.error
+        return solicitud.resultado
+
+    def _siguiente_lote(self):
+        with self._cond:
+            while not self._pendientes:
+                self._cond.wait()
+            # Un pedido aislado con el hilo libre no tiene con quién agruparse: esperar solo agrega latencia
+            aislado = len(self._pendientes) == 1 and not self._pendientes[0].con_hilo_ocupado
+            limite = time.monotonic() + (0.0 if aislado else self.espera)
+            while len(self._pendientes) < self.tamano_max:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+            lote = self._pendientes[:self.tamano_max]
+            del self._pendientes[:self.tamano_max]
+            self._ocupado = True
+            return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._siguiente_lote()
+            try:
+                etiquetas = inferir_lote([s.texto for s in lote])
+                for solicitud, etiqueta in zip(lote, etiquetas):
+                    solicitud.resultado = etiqueta
+            except Exception as e:
+                for solicitud in lote:
+                    solicitud.error = e
+            finally:
+                with self._cond:
+                    self._ocupado = False
+                for solicitud in lote:
+                    solicitud.evento.set()
+
+_cola = None
+_lock_cola = threading.Lock()
+
+def obtener_cola():
+    """Retorna la cola de micro-batching del proceso, o None si SENTIMIENTO_BATCH_MAX <= 1."""
+    global _cola
+    tamano_max = getattr(settings, 'SENTIMIENTO_BATCH_MAX', 16)
+    if tamano_max <= 1:
+        return None
+    if _cola is None:
+        with _lock_cola:
+            if _cola is None:
+                _cola = ColaInferencia(tamano_max, getattr(settings, 'SENTIMIENTO_BATCH_ESPERA_MS', 10))
+    return _cola
+
+def normalizar_texto(texto: str) -> str:
+    """Normalización para la clave de caché: Unicode NFC y espacios colapsados (no cambia la tokenización)."""
+    return " ".join(unicodedata.normalize("NFC", texto or "").split())
+
+class CacheSentimiento:
+    """
+    Caché de resultados por contenido: LRU en memoria acotado a `tamano` entradas y, opcionalmente,
+    la tabla cacheSentimiento para que los resultados sobrevivan reinicios y se compartan entre workers.
+    La clave incluye MODEL_NAME, el backend y LABELS_MAP, así un cambio de modelo o de etiquetas invalida lo anterior.
+    """
+
+    def __init__(self, tamano, persistente):
+        self.tamano = max(0, int(tamano))
+        self.persistente = persistente
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memoria = 0
+        self.hits_persistente = 0
+        self.misses = 0
+
+    def clave(self, texto: str) -> str:
+        etiquetas = ",".join(f"{k}={v}" for k, v in sorted(LABELS_MAP.items()))
+        contenido = "\x00".join([MODEL_NAME, backend_configurado(), etiquetas, normalizar_texto(texto)])
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def firma(self) -> str:
+        """Identifica modelo + backend + etiquetas actuales; las filas con otra firma ya no se pueden volver a leer."""
+        etiquetas = ",".join(f"{k}={v}" for k, v in sorted(LABELS_MAP.items()))
+        contenido = "\x00".join([MODEL_NAME, backend_configurado(), etiquetas])
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _recordar(self, clave, etiqueta):
+        # Llamar con self._lock tomado
+        if not self.tamano:
+            return
+        self._lru[clave] = etiqueta
+        self._lru.move_to_end(clave)
+        while len(self._lru) > self.tamano:
+            self._lru.popitem(last=False)
+
+    def obtener_muchos(self, claves):
+        """Retorna {clave: etiqueta} para las claves que están en caché."""
+        encontrados = {}
+        with self._lock:
+            for clave in claves:
+                if clave in self._lru:
+                    self._lru.move_to_end(clave)
+                    encontrados[clave] = self._lru[clave]
+            self.hits_memoria += len(encontrados)
+
+        faltantes = [c for c in set(claves) if c not in encontrados]
+        if faltantes and self.persistente:
+            from .models import cacheSentimiento
+
+            desde_db = dict(cacheSentimiento.objects.filter(clave__in=faltantes).values_list('clave', 'sentimiento'))
+            with self._lock:
+                for clave, etiqueta in desde_db.items():
+                    self._recordar(clave, etiqueta)
+                self.hits_persistente += len(desde_db)
+            encontrados.update(desde_db)
+
+        with self._lock:
+            self.misses += len(set(claves)) - len(set(encontrados))
+        return encontrados
+
+    def guardar_muchos(self, resultados):
+        """Guarda {clave: etiqueta} en memoria y, si corresponde, en la tabla persistente."""
+        if not resultados:
+            return
+        with self._lock:
+            for clave, etiqueta in resultados.items():
+                self._recordar(clave, etiqueta)
+        if self.persistente:
+            from .models import cacheSentimiento
+
+            firma = self.firma()
+            cacheSentimiento.objects.bulk_create(
+                [cacheSentimiento(clave=c, firma=firma, sentimiento=e) for c, e in resultados.items()],
+                ignore_conflicts=True,
+            )
+
+    def purgar(self, dias=None) -> int:
+        """
+        Borra de la tabla persistente las filas de otro modelo/backend/etiquetas (nunca más se consultan)
+        y las con más de `dias` días (SENTIMIENTO_CACHE_DIAS; 0 o None no borra por antigüedad).
+        Retorna cuántas filas borró.
+        """
+        from .models import cacheSentimiento
+
+        if dias is None:
+            dias = getattr(settings, 'SENTIMIENTO_CACHE_DIAS', 180)
+        obsoletas = ~Q(firma=self.firma())
+        if dias:
+            obsoletas |= Q(fecha_creacion__lt=timezone.now() - timedelta(days=dias))
+        borradas, _ = cacheSentimiento.objects.filter(obsoletas).delete()
+        return borradas
+
+    def limpiar(self):
+        """Vacía el LRU en memoria del proceso (la tabla persistente no se toca)."""
+        with self._lock:
+            self._lru.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.hits_memoria + self.hits_persistente + self.misses
+            return {
+                "entradas_memoria": len(self._lru),
+                "hits_memoria": self.hits_memoria,
+                "hits_persistente": self.hits_persistente,
+                "misses": self.misses,
+                "tasa_hits": (self.hits_memoria + self.hits_persistente) / consultas if consultas else 0.0,
+            }
+
+_cache = None
+_lock_cache = threading.Lock()
+
+def obtener_cache():
+    """Retorna la caché de resultados del proceso, o None si está desactivada."""
+    global _cache
+    tamano = getattr(settings, 'SENTIMIENTO_CACHE_TAMANO', 10000)
+    persistente = getattr(settings, 'SENTIMIENTO_CACHE_PERSISTENTE', True)
+    if not tamano and not persistente:
+        return None
+    if _cache is None:
+        with _lock_cache:
+            if _cache is None:
+                _cache = CacheSentimiento(tamano, persistente)
+    return _cache
+
+def purgar_cache(dias=None) -> int:
+    """Purga la tabla cacheSentimiento (ver CacheSentimiento.purgar). Retorna las filas borradas."""
+    cache = obtener_cache()
+    return cache.purgar(dias) if cache and cache.persistente else 0
+
+def estadisticas_cache() -> dict:
+    """Contadores de hits/misses de la caché de sentimiento de este proceso."""
+    cache = obtener_cache()
+    return cache.estadisticas() if cache else {}
+
+def _con_cache(textos, inferir):
+    """Resuelve desde la caché lo que se pueda e infiere el resto (una vez por texto distinto)."""
+    cache = obtener_cache()
+    if cache is None:
+        return inferir(textos)
+
+    claves = [cache.clave(t) for t in textos]
+    resultados = cache.obtener_muchos(claves)
+
+    faltantes = {}
+    for clave, texto in zip(claves, textos):
+        if clave not in resultados:
+            faltantes.setdefault(clave, texto)
+    if faltantes:
+        nuevos = dict(zip(faltantes.keys(), inferir(list(faltantes.values()))))
+        cache.guardar_muchos(nuevos)
+        resultados.update(nuevos)
+    return [resultados[c] for c in claves]
+
+def inferir_local(textos):
+    """
+    Inferencia en este proceso: un texto suelto pasa por la cola de micro-batching;
+    varios van en lotes de SENTIMIENTO_BATCH_MAX ordenados por largo.
+    """
+    cola = obtener_cola()
+    if cola is not None and len(textos) == 1:
+        return [cola.analizar(textos[0])]
+    return inferir_ordenado(textos, getattr(settings, 'SENTIMIENTO_BATCH_MAX', 16))
+
+def _inferir(textos):
+    # Si hay sidecar (manage.py servidor_sentimiento) se usa su modelo compartido; si no, el de este proceso
+    from .utils.sidecar_sentimiento import SidecarNoDisponible, inferir_remoto
+
+    try:
+        return inferir_remoto(textos)
+    except SidecarNoDisponible:
+        return inferir_local(textos)
+
+def analizar_sentimientos(textos):
+    """Analiza varios textos de una vez (sin pasar por la cola) y retorna una etiqueta por texto."""
+    return _con_cache(list(textos), _inferir)
+
+def analizar_sentimiento(texto: str) -> str:
+    """
+    Analiza el sentimiento de un texto en español y retorna:
+    'positiva', 'neutral' o 'negativa'.
+    """
+    return _con_cache([texto], _inferir)[0]
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+class DirectorioPagination(CursorPagination):
+    """Paginación por cursor del directorio público: páginas estables aunque se registren kinesiologos nuevos."""
+    page_size = 24
+    page_size_query_param = 'limite'
+    max_page_size = 100
+    ordering = ('apellido', 'nombre', 'id')
+
+    def get_ordering(self, request, queryset, view):
+        # ?orden=rating: mejor score primero; la vista anota `rating` (ver KinesiologosPublicosView)
+        if request.query_params.get('orden') == 'rating':
+            return ('-rating', 'id')
+        # ?q=: más relevantes primero, salvo que se pida otro orden; la vista anota `relevancia`
+        if request.query_params.get('q', '').strip():
+            return ('-relevancia', 'id')
+        return super().get_ordering(request, queryset, view)
@@ -22,6 +22,10 @@ def commit_transaction(token_ws: str):
     tx = Transaction(options=options)
     return tx.commit(token_ws)
 
+def refund_transaction(token_ws: str, amount: float):
+    tx = Transaction(options=options)
+    return tx.refund(token_ws, amount)
+
 def get_status(token_ws: str):
     tx = Transaction(options=options)
     return tx.status(token_ws)
\ No newline at end of file
@@ -1,14 +1,22 @@
 from rest_framework import serializers
-from .models import kinesiologo, paciente, cita, reseña, agenda, metodoPago, pagoSuscripcion, documentoVerificacion
+from .models import kinesiologo, paciente, cita, reseña, agenda, metodoPago, pagoSuscripcion, documentoVerificacion, resumenReseñas
 from django.utils import timezone
 from .modulo_ia import analizar_sentimiento
 from .utils.rut import normalizar_rut, formatear_rut
 from django.db import transaction
+from django.conf import settings
+
+def _sentimiento_al_crear(texto):
+    """Con SENTIMIENTO_ASINCRONO la reseña se guarda sin sentimiento y la analiza `manage.py procesar_sentimientos`."""
+    if getattr(settings, 'SENTIMIENTO_ASINCRONO', False):
+        return None
+    return analizar_sentimiento(texto) #devuelve 'positiva', 'neutral' o 'negativa'
 
 class kinesiologoSerializer(serializers.ModelSerializer):
     class Meta:
         model = kinesiologo
-        fields = '__all__'
+        exclude = ['ical_token']
+        read_only_fields = ['suscripcion_vence_en', 'agenda_actualizada_en']
 
     def validate_estado_verificacion(self, value):
         if value not in dict(kinesiologo.ESTADO_VERIFICACION):
@@ -29,6 +37,38 @@ class kinesiologoSerializer(serializers.ModelSerializer):
             pass
         return data
 
+class KinesiologoDirectorioSerializer(serializers.ModelSerializer):
+    """Solo lectura, para el directorio público: sin RUT, documentos ni datos internos."""
+    foto_url = serializers.SerializerMethodField()
+    score_promedio = serializers.SerializerMethodField()
+    total_resenas = serializers.SerializerMethodField()
+
+    class Meta:
+        model = kinesiologo
+        fields = ['id', 'nombre', 'apellido', 'especialidad', 'foto_url', 'score_promedio', 'total_resenas']
+        read_only_fields = fields
+
+    def _resumen(self, obj):
+        try:
+            return obj.resumen_resenas
+        except resumenReseñas.DoesNotExist:
+            return None
+
+    def get_score_promedio(self, obj):
+        resumen = self._resumen(obj)
+        return resumen.score_promedio if resumen else None
+
+    def get_total_resenas(self, obj):
+        resumen = self._resumen(obj)
+        return resumen.total if resumen else 0
+
+    def get_foto_url(self, obj):
+        if not obj.foto_perfil:
+            return None
+        request = self.context.get('request')
+        url = obj.foto_perfil.url
+        return request.build_absolute_uri(url) if request else url
+
 class pacienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = paciente
@@ -83,9 +123,11 @@ class citaSerializer(serializers.ModelSerializer):
         return data
 
 class reseñaSerializer(serializers.ModelSerializer):
+    sentimiento_pendiente = serializers.SerializerMethodField()
+
     class Meta:
         model = reseña
-        fields = '__all__'
+        exclude = ['sentimiento_tomada_en', 'sentimiento_intentos']
     
     def validate(self, data):
         cita = data.get('cita')
@@ -97,13 +139,17 @@ class reseñaSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Ya existe una reseña para esta cita.")
         
         return data
+
+    def get_sentimiento_pendiente(self, obj):
+        # True mientras el worker de sentimiento no procese la reseña (modo asíncrono)
+        return obj.sentimiento is None
     
     def create(self, validated_data): #se sobreescribe el método create para agregar el análisis de sentimiento
         # Analizar el sentimiento del texto de la reseña utilizando el módulo de IA
         texto = validated_data.get('comentario')
-        sentimiento = analizar_sentimiento(texto) #devuelve 'positiva', 'neutral' o 'negativa'
-        validated_data['sentimiento'] = sentimiento
-        return super().create(validated_data)
+        validated_data['sentimiento'] = _sentimiento_al_crear(texto)
+        with transaction.atomic(): #la reseña y su ajuste en resumenReseñas (señal) se guardan juntos
+            return super().create(validated_data)
 
 class ReseñaPublicaSerializer(serializers.Serializer):
     rut = serializers.CharField(max_length=15)
@@ -147,20 +193,21 @@ class ReseñaPublicaSerializer(serializers.Serializer):
         cita_obj = validated_data["cita_obj"]
         comentario = validated_data["comentario"]
 
-        sentimiento = analizar_sentimiento(comentario)  # 'positiva', 'neutral' o 'negativa'
+        sentimiento = _sentimiento_al_crear(comentario)  # None si se analiza en segundo plano
 
-        nueva_reseña = reseña.objects.create(
-            cita=cita_obj,
-            comentario=comentario,
-            sentimiento=sentimiento,
-        )
+        with transaction.atomic(): #la reseña y su ajuste en resumenReseñas (señal) se guardan juntos
+            nueva_reseña = reseña.objects.create(
+                cita=cita_obj,
+                comentario=comentario,
+                sentimiento=sentimiento,
+            )
         return nueva_reseña
     
 class agendaSerializer(serializers.ModelSerializer):
     class Meta:
         model = agenda
         fields = '__all__'
-        read_only_fields = ['estado', 'paciente', 'cita', 'kinesiologo', 'fecha_creacion']
+        read_only_fields = ['estado', 'paciente', 'cita', 'kinesiologo', 'retenido_hasta', 'fecha_creacion']
     
     def validate(self, data):
         inicio = data.get('inicio')
@@ -176,6 +223,25 @@ class agendaSerializer(serializers.ModelSerializer):
         
         return data
 
+class PlantillaAgendaSerializer(serializers.Serializer):
+    """Plantilla semanal de disponibilidad, ej: lunes a viernes 09:00-13:00 en bloques de 45 min por 8 semanas."""
+    dias = serializers.ListField(child=serializers.IntegerField(min_value=0, max_value=6), allow_empty=False) #0=lunes
+    hora_inicio = serializers.TimeField()
+    hora_fin = serializers.TimeField()
+    duracion_minutos = serializers.IntegerField(min_value=5, max_value=480)
+    semanas = serializers.IntegerField(min_value=1, max_value=26)
+    fecha_inicio = serializers.DateField(required=False)
+
+    def validate(self, data):
+        inicio = data['hora_inicio']
+        fin = data['hora_fin']
+        if inicio >= fin:
+            raise serializers.ValidationError("La hora de inicio debe ser anterior a la hora de fin.")
+        minutos = (fin.hour * 60 + fin.minute) - (inicio.hour * 60 + inicio.minute)
+        if data['duracion_minutos'] > minutos:
+            raise serializers.ValidationError("La duración del bloque no cabe entre la hora de inicio y la de fin.")
+        return data
+
 class metodoPagoSerializer(serializers.ModelSerializer):
     class Meta:
         model = metodoPago
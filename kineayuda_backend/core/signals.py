@@ -0,0 +1,105 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import agenda, cita, kinesiologo, metodoPago, pagoCita, resumenReseñas, reseña
+from .utils import cache_publico
+from .utils.agenda import marcar_agenda_modificada
+from .utils.busqueda import invalidar_indice
+from .utils.metricas import marcar_dias
+from .utils.resenas import AUSENTE, estado_anterior, registrar_cambios
+
+def _dias_afectados(instance, campo_fecha):
+    """Día actual y, si se movió, el día que ocupaba al leerlo de la base (ver from_db)."""
+    actual = (instance.kinesiologo_id, getattr(instance, campo_fecha))
+    return [actual, getattr(instance, '_original', actual)]
+
+@receiver([post_save, post_delete], sender=agenda)
+def agenda_modificada(sender, instance, **kwargs):
+    """Cualquier alta, cambio de estado o baja de un horario invalida el ETag de las horas disponibles y cambia la ocupación del día."""
+    marcar_agenda_modificada([instance.kinesiologo_id])
+    marcar_dias(_dias_afectados(instance, 'inicio'))
+    instance._original = (instance.kinesiologo_id, instance.inicio)
+
+@receiver([post_save, post_delete], sender=cita)
+def cita_modificada(sender, instance, **kwargs):
+    """Las citas salen en el calendario iCal, que usa la misma marca de modificación, y en las métricas diarias."""
+    marcar_agenda_modificada([instance.kinesiologo_id])
+    marcar_dias(_dias_afectados(instance, 'fecha_hora'))
+    if kwargs['signal'] is post_save:
+        _mover_reseñas(instance)
+    instance._original = (instance.kinesiologo_id, instance.fecha_hora)
+
+def _mover_reseñas(instance):
+    """
+    Las reseñas cuentan en metricaReseñaDiaria por el día de su cita: si la cita cambió de día (o de
+    kinesiologo), sus conteos pasan del día anterior al nuevo, en la misma transacción que la cita.
+    """
+    original = getattr(instance, '_original', None)
+    if original is None:
+        return
+    kx_antes, fecha_antes = original
+    if kx_antes == instance.kinesiologo_id and timezone.localdate(fecha_antes) == timezone.localdate(instance.fecha_hora):
+        return
+    cambios = []
+    for sentimiento in reseña.objects.filter(cita=instance).values_list('sentimiento', flat=True):
+        cambios += [(kx_antes, fecha_antes, sentimiento, AUSENTE), (instance.kinesiologo_id, instance.fecha_hora, AUSENTE, sentimiento)]
+    if cambios:
+        registrar_cambios(cambios)
+
+@receiver([post_save, post_delete], sender=pagoCita)
+def pago_cita_modificado(sender, instance, **kwargs):
+    """Los ingresos se cuentan por día de pago, así que solo importan pagos con fecha_pago."""
+    marcar_dias([(instance.kinesiologo_id, instance.fecha_pago)])
+
+@receiver(post_save, sender=kinesiologo)
+def kinesiologo_creado(sender, instance, created, **kwargs):
+    """Todo kinesiologo tiene su fila de resumenReseñas, así el directorio ordena por rating sin LEFT JOIN."""
+    if created:
+        resumenReseñas.objects.bulk_create([resumenReseñas(kinesiologo=instance)], ignore_conflicts=True)
+
+@receiver([post_save, post_delete], sender=kinesiologo)
+def kinesiologo_modificado(sender, instance, **kwargs):
+    """
+    El directorio cacheado se invalida solo si cambió algo que muestra o filtra, y el índice de búsqueda solo si
+    cambió nombre, apellido o especialidad: rotar ical_token o renovar la suscripción no los toca.
+    Sin los valores leídos (alta, baja o instancia con campos diferidos) se invalidan ambos.
+    """
+    actual = instance.valores_directorio()
+    original = getattr(instance, '_directorio_original', None)
+    if kwargs['signal'] is post_delete or kwargs.get('created') or original is None:
+        cambiados = set(kinesiologo.CAMPOS_DIRECTORIO)
+    else:
+        cambiados = {campo for campo, antes, despues in zip(kinesiologo.CAMPOS_DIRECTORIO, original, actual) if antes != despues}
+    if cambiados & set(kinesiologo.CAMPOS_BUSQUEDA):
+        invalidar_indice()
+    if cambiados:
+        cache_publico.invalidar(cache_publico.DIRECTORIO)
+    instance._directorio_original = actual
+
+@receiver(pre_save, sender=reseña)
+def reseña_por_guardar(sender, instance, **kwargs):
+    instance._antes_de_guardar = estado_anterior(instance)
+
+@receiver(post_save, sender=reseña)
+def reseña_guardada(sender, instance, **kwargs):
+    """Ajusta resumenReseñas y metricaReseñaDiaria con el cambio de esta reseña (alta o nuevo sentimiento), en la misma transacción."""
+    antes = instance._antes_de_guardar
+    despues = (instance.cita.kinesiologo_id, instance.cita.fecha_hora, instance.sentimiento)
+    if antes is AUSENTE:
+        registrar_cambios([(*despues[:2], AUSENTE, despues[2])])
+    elif antes != despues:
+        registrar_cambios([(*antes[:2], antes[2], AUSENTE), (*despues[:2], AUSENTE, despues[2])])
+    else:
+        # Solo cambió el texto: registrar_cambios no se llama, pero la reseña pública sí cambió
+        cache_publico.invalidar(cache_publico.RESENAS, [despues[0]])
+    instance._original = (instance.cita_id, instance.sentimiento)
+
+@receiver(post_delete, sender=reseña)
+def reseña_eliminada(sender, instance, **kwargs):
+    sentimiento = getattr(instance, '_original', (None, instance.sentimiento))[1]
+    registrar_cambios([(instance.cita.kinesiologo_id, instance.cita.fecha_hora, sentimiento, AUSENTE)])
+
+@receiver([post_save, post_delete], sender=metodoPago)
+def metodo_pago_modificado(sender, instance, **kwargs):
+    cache_publico.invalidar(cache_publico.METODOS_PAGO)
@@ -1,3 +1,1284 @@
-from django.test import TestCase
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from core import authentication, modulo_ia
+from core.models import agenda, cacheSentimiento, cita, kinesiologo, metodoPago, metricaCitaDiaria, metricaReseñaDiaria, paciente, pagoCita, pagoSuscripcion, resumenReseñas, reseña
+from core.utils import agenda as agenda_utils, barrido, busqueda, cache_publico, ical, metricas, resenas as resenas_utils
+from core.utils.agenda import HorarioSolapado, filtrar_solapados, guardar_sin_solapar, hay_solapamiento
+from core.utils.firebase_keys import AlmacenClavesFirebase, TokenInvalido, verificar_token_local
+from core.utils.resenas import registrar_cambios
+from core.utils.suscripciones import registrar_pago_suscripcion, sincronizar_vencidas
+
+
+def crear_kinesiologo(n=1, **campos):
+    datos = dict(nombre=f'Kine{n}', apellido='Prueba', email=f'kine{n}@kineayuda.local', firebase_ide=f'uid-kine-{n}',
+                 nro_titulo='0', rut=f'kine-{n}', doc_verificacion='', especialidad='general', estado_verificacion='aprobado')
+    datos.update(campos)
+    return kinesiologo.objects.create(**datos)
+
+CACHES_EN_MEMORIA = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+                     for alias in ('default', 'publico', 'sesiones')}
+
+def crear_paciente(n=1):
+    return paciente.objects.create(nombre=f'Paciente{n}', apellido='Prueba', rut=f'pac-{n}', email=f'pac{n}@kineayuda.local',
+                                   telefono='0', fecha_nacimiento=date(1990, 1, 1))
+
+
+class ColaInferenciaTests(SimpleTestCase):
+    def _cola(self, espera_ms, lotes, bloqueo=None):
+        def inferir(textos):
+            lotes.append(list(textos))
+            if bloqueo is not None and len(lotes) == 1:
+                bloqueo.wait(5)
+            return [f'etiqueta-{t}' for t in textos]
+        parche = mock.patch.object(modulo_ia, 'inferir_lote', side_effect=inferir)
+        parche.start()
+        self.addCleanup(parche.stop)
+        return modulo_ia.ColaInferencia(tamano_max=8, espera_ms=espera_ms)
+
+    def test_pedido_aislado_no_espera_la_ventana(self):
+        lotes = []
+        cola = self._cola(espera_ms=2000, lotes=lotes)
+        inicio = time.monotonic()
+        self.assertEqual(cola.analizar('hola'), 'etiqueta-hola')
+        self.assertLess(time.monotonic() - inicio, 1.0)
+        self.assertEqual(lotes, [['hola']])
+
+    def test_pedidos_concurrentes_se_agrupan_mientras_el_hilo_trabaja(self):
+        lotes, bloqueo = [], threading.Event()
+        cola = self._cola(espera_ms=200, lotes=lotes, bloqueo=bloqueo)
+        resultados = {}
+
+        def llamar(texto):
+            resultados[texto] = cola.analizar(texto)
+
+        primero = threading.Thread(target=llamar, args=('a',))
+        primero.start()
+        while not lotes:
+            time.sleep(0.01)
+        # El hilo está ocupado con 'a': los siguientes se juntan en un solo lote
+        hilos = [threading.Thread(target=llamar, args=(t,)) for t in ('b', 'c', 'd')]
+        for h in hilos:
+            h.start()
+        time.sleep(0.05)
+        bloqueo.set()
+        for h in [primero, *hilos]:
+            h.join(5)
+        self.assertEqual(lotes[0], ['a'])
+        self.assertEqual(sorted(lotes[1]), ['b', 'c', 'd'])
+        self.assertEqual(resultados['d'], 'etiqueta-d')
+
+
+class CacheSentimientoTests(TestCase):
+    def test_purgar_borra_otra_firma_y_antiguas(self):
+        cache = modulo_ia.CacheSentimiento(tamano=0, persistente=True)
+        cache.guardar_muchos({cache.clave('vigente'): 'positiva', cache.clave('antigua'): 'negativa'})
+        cacheSentimiento.objects.filter(clave=cache.clave('antigua')).update(fecha_creacion=timezone.now() - timedelta(days=400))
+        with mock.patch.object(modulo_ia, 'MODEL_NAME', 'otro/modelo'):
+            cache.guardar_muchos({cache.clave('otro modelo'): 'neutral'})
+        cacheSentimiento.objects.create(clave='x' * 64, sentimiento='neutral')  # fila anterior a la columna firma
+
+        self.assertEqual(cache.purgar(dias=180), 3)
+        self.assertEqual(list(cacheSentimiento.objects.values_list('clave', flat=True)), [cache.clave('vigente')])
+        self.assertEqual(cache.obtener_muchos([cache.clave('vigente')]), {cache.clave('vigente'): 'positiva'})
+
+    def test_purgar_sin_antiguedad_solo_borra_otra_firma(self):
+        cache = modulo_ia.CacheSentimiento(tamano=0, persistente=True)
+        cache.guardar_muchos({cache.clave('antigua'): 'negativa'})
+        cacheSentimiento.objects.update(fecha_creacion=timezone.now() - timedelta(days=400))
+        self.assertEqual(cache.purgar(dias=0), 0)
+        with override_settings(SENTIMIENTO_BACKEND='int8'):
+            self.assertEqual(cache.purgar(dias=0), 1)
+
+
+class RecalcularSentimientosTests(TestCase):
+    def test_cambio_concurrente_no_se_cuenta_dos_veces(self):
+        kx = crear_kinesiologo()
+        c = cita.objects.create(paciente=crear_paciente(), kinesiologo=kx, estado='completada',
+                                fecha_hora=timezone.now() - timedelta(days=1))
+        r = reseña.objects.create(cita=c, comentario='muy buena atención', sentimiento=None)
+
+        def analizar(textos):
+            # Mientras el comando analiza, procesar_sentimientos clasifica la misma reseña pendiente
+            reseña.objects.filter(id=r.id).update(sentimiento='positiva')
+            registrar_cambios([(kx.id, c.fecha_hora, None, 'positiva')])
+            return ['negativa'] * len(textos)
+
+        with mock.patch('core.management.commands.recalcular_sentimientos.analizar_sentimientos', side_effect=analizar):
+            call_command('recalcular_sentimientos', stdout=mock.MagicMock())
+
+        r.refresh_from_db()
+        self.assertEqual(r.sentimiento, 'negativa')
+        resumen = resumenReseñas.objects.get(kinesiologo=kx)
+        self.assertEqual((resumen.total, resumen.positivas, resumen.negativas, resumen.pendientes), (1, 0, 1, 0))
+
+
+class ProcesarSentimientosTests(TestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        pac = crear_paciente()
+        self.reseñas = []
+        for i, texto in enumerate(['excelente', 'ROMPE', 'regular', 'pésimo']):
+            c = cita.objects.create(paciente=pac, kinesiologo=self.kx, estado='completada',
+                                    fecha_hora=timezone.now() - timedelta(days=i + 1))
+            self.reseñas.append(reseña.objects.create(cita=c, comentario=texto, sentimiento=None))
+
+    def _procesar(self, analizar):
+        with mock.patch('core.management.commands.procesar_sentimientos.analizar_sentimientos', side_effect=analizar):
+            call_command('procesar_sentimientos', una_vez=True, stdout=mock.MagicMock())
+
+    def test_infiere_fuera_de_la_transaccion_con_el_lote_reservado(self):
+        fuera = len(connection.atomic_blocks)
+
+        def analizar(textos):
+            self.assertEqual(len(connection.atomic_blocks), fuera)
+            self.assertFalse(reseña.objects.filter(sentimiento_tomada_en__isnull=True).exists())
+            return ['positiva'] * len(textos)
+
+        self._procesar(analizar)
+        self.assertEqual(reseña.objects.filter(sentimiento='positiva', sentimiento_tomada_en__isnull=True).count(), 4)
+        self.assertEqual(resumenReseñas.objects.get(kinesiologo=self.kx).positivas, 4)
+
+    def test_reseña_clasificada_mientras_se_infiere_no_se_pisa(self):
+        r = self.reseñas[0]
+
+        def analizar(textos):
+            # Mientras el worker analiza, la reseña se clasifica por otro camino
+            reseña.objects.filter(id=r.id).update(sentimiento='negativa')
+            registrar_cambios([(self.kx.id, r.cita.fecha_hora, None, 'negativa')])
+            return ['positiva'] * len(textos)
+
+        self._procesar(analizar)
+        r.refresh_from_db()
+        self.assertEqual(r.sentimiento, 'negativa')
+        resumen = resumenReseñas.objects.get(kinesiologo=self.kx)
+        self.assertEqual((resumen.total, resumen.positivas, resumen.negativas, resumen.pendientes), (4, 3, 1, 0))
+
+    def test_comentario_que_falla_no_traba_el_lote(self):
+        def analizar(textos):
+            if 'ROMPE' in textos:
+                raise RuntimeError('el modelo no pudo con este texto')
+            return ['neutral'] * len(textos)
+
+        with self.assertLogs('core.management.commands.procesar_sentimientos', 'ERROR'):
+            self._procesar(analizar)
+        mala = reseña.objects.get(id=self.reseñas[1].id)
+        self.assertIsNone(mala.sentimiento)
+        self.assertEqual(mala.sentimiento_intentos, 1)
+        self.assertEqual(reseña.objects.filter(sentimiento='neutral').count(), 3)
+
+        # Sigue reservada: la pasada siguiente no la vuelve a tomar hasta que venza la reserva
+        self._procesar(analizar)
+        self.assertEqual(reseña.objects.get(id=mala.id).sentimiento_intentos, 1)
+
+        # Agotados los intentos, no se toma más aunque la reserva venza
+        reseña.objects.filter(id=mala.id).update(sentimiento_intentos=settings.SENTIMIENTO_INTENTOS_MAX, sentimiento_tomada_en=None)
+        self._procesar(analizar)
+        self.assertEqual(reseña.objects.get(id=mala.id).sentimiento_intentos, settings.SENTIMIENTO_INTENTOS_MAX)
+
+
+class ConsultasPorRequestTests(APITestCase):
+    """El kinesiologo autenticado se consulta una sola vez por request (FirebaseUser.kinesiologo), sin N+1."""
+
+    def setUp(self):
+        self.kx = crear_kinesiologo(suscripcion_vence_en=timezone.now() + timedelta(days=30))
+        self.manana = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        pac = crear_paciente()
+        for i in range(5):
+            inicio = self.manana + timedelta(hours=i)
+            agenda.objects.create(kinesiologo=self.kx, inicio=inicio, fin=inicio + timedelta(minutes=45))
+            c = cita.objects.create(paciente=pac, kinesiologo=self.kx, estado='completada', fecha_hora=inicio - timedelta(days=7))
+            reseña.objects.create(cita=c, comentario=f'reseña {i}', sentimiento='positiva')
+        metricas.reconstruir()
+        self.client = APIClient(HTTP_AUTHORIZATION='Bearer token-de-prueba')
+        parche = mock.patch('core.authentication.verificar_id_token', return_value={'uid': self.kx.firebase_ide})
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_agenda_list(self):
+        # kinesiologo + horarios
+        with self.assertNumQueries(2):
+            r = self.client.get('/api/agendas/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.data), 5)
+
+    def test_agenda_create(self):
+        inicio = self.manana + timedelta(days=1)
+        # kinesiologo + chequeo de solapamiento + INSERT entre SAVEPOINT / RELEASE
+        with self.assertNumQueries(5):
+            r = self.client.post('/api/agendas/', {'inicio': inicio.isoformat(),
+                                                   'fin': (inicio + timedelta(minutes=45)).isoformat()}, format='json')
+        self.assertEqual(r.status_code, 201)
+
+    def test_estado_suscripcion(self):
+        with self.assertNumQueries(1):
+            r = self.client.get('/api/pagos/estado/')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.data['activa'])
+
+    def test_metricas_resenas(self):
+        with self.assertNumQueries(2):
+            r = self.client.get('/api/kinesiologos/metricas-resenas/', {'granularidad': 'dia'})
+        self.assertEqual(r.status_code, 200)
+
+    def test_metricas_citas(self):
+        with self.assertNumQueries(2):
+            r = self.client.get('/api/kinesiologos/metricas-citas/', {'granularidad': 'dia'})
+        self.assertEqual(r.status_code, 200)
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, FIREBASE_VERIFICACION_LOCAL=False)
+class RevocacionTokensTests(APITestCase):
+    def setUp(self):
+        authentication._cache_revocaciones().clear()
+        authentication._olvidar_marcas()
+        authentication.obtener_cache_tokens().invalidar()
+        self.kx = crear_kinesiologo()
+        ahora = int(time.time())
+        self.claims = {'uid': self.kx.firebase_ide, 'iat': ahora - 60, 'exp': ahora + 3600}
+        parche = mock.patch.object(authentication.auth, 'verify_id_token', side_effect=lambda t: dict(self.claims))
+        self.verify = parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_revocacion_de_otro_worker_rechaza_el_token_cacheado(self):
+        authentication.verificar_id_token('token-a')
+        # Otro worker revoca: solo escribe la marca en el caché compartido, no toca la CacheTokens de este proceso
+        authentication._cache_revocaciones().set(authentication._clave_revocacion(self.kx.firebase_ide), int(time.time()))
+        # Este worker sigue usando la marca que leyó hasta que vence su copia local
+        authentication.verificar_id_token('token-a')
+        despues = time.monotonic() + settings.FIREBASE_REVOCACION_TTL_LOCAL + 1
+        with mock.patch.object(authentication.time, 'monotonic', return_value=despues), \
+                self.assertRaises(authentication.TokenRevocado):
+            authentication.verificar_id_token('token-a')
+        self.assertEqual(self.verify.call_count, 1)
+
+    def test_marcas_se_leen_del_cache_compartido_una_vez_por_ttl_local(self):
+        with mock.patch.object(authentication, '_cache_revocaciones', wraps=authentication._cache_revocaciones) as compartido:
+            for _ in range(5):
+                authentication.verificar_id_token('token-a')
+        self.assertEqual(compartido.call_count, 1)
+
+    def test_estadisticas_de_hits_y_latencias(self):
+        cache = authentication.CacheTokens(10)
+        with mock.patch.object(authentication, '_cache_tokens', cache):
+            authentication.verificar_id_token('token-a')
+            authentication.verificar_id_token('token-a')
+            authentication.verificar_id_token('token-a')
+            stats = authentication.estadisticas_tokens()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entradas']), (2, 1, 1))
+        self.assertAlmostEqual(stats['tasa_hits'], 2 / 3)
+        self.assertEqual(stats['latencias']['sdk']['llamadas'], 1)
+        self.assertEqual(stats['latencias']['revocacion']['llamadas'], 1)
+        self.assertNotIn('local', stats['latencias'])
+
+    def test_token_emitido_despues_de_revocar_vale(self):
+        authentication.invalidar_tokens(self.kx.firebase_ide)
+        self.claims['iat'] = int(time.time()) + 1
+        self.assertEqual(authentication.verificar_id_token('token-nuevo')['uid'], self.kx.firebase_ide)
+
+    def test_revocar_todos(self):
+        authentication.invalidar_tokens()
+        with self.assertRaises(authentication.TokenRevocado):
+            authentication.verificar_id_token('token-a')
+
+    def test_logout_revoca_en_firebase_y_rechaza_el_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer token-a')
+        with mock.patch.object(authentication.auth, 'revoke_refresh_tokens') as revocar:
+            self.assertEqual(self.client.post('/api/logout/').status_code, 204)
+        revocar.assert_called_once_with(self.kx.firebase_ide)
+        self.assertIn(self.client.get('/api/me/').status_code, (401, 403))
+
+
+def _clave_y_certificado():
+    """Par RSA con un certificado autofirmado en PEM, como los que publica Google para Firebase Auth."""
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken.prueba')])
+    ahora = datetime.now(dt_timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(nombre).issuer_name(nombre).public_key(clave.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(ahora - timedelta(days=1))
+            .not_valid_after(ahora + timedelta(days=1)).sign(clave, hashes.SHA256()))
+    return clave, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class _RespuestaCerts:
+    def __init__(self, certificados):
+        self.headers = {'Cache-Control': 'public, max-age=3600'}
+        self._certificados = certificados
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return dict(self._certificados)
+
+
+class VerificacionLocalTests(SimpleTestCase):
+    PROJECT_ID = 'kineayuda-prueba'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.clave, cls.pem = _clave_y_certificado()
+
+    def setUp(self):
+        self.almacen = AlmacenClavesFirebase(url='https://certs.invalid/', ruta=None)
+        self.almacen.cargar_certificados({'kid-1': self.pem}, time.time() + 3600)
+        # Sin red: un refresco devuelve el mismo set local
+        parche = mock.patch('core.utils.firebase_keys.requests.get', return_value=_RespuestaCerts({'kid-1': self.pem}))
+        self.fetch = parche.start()
+        self.addCleanup(parche.stop)
+        self.addCleanup(lambda: self.almacen._timer and self.almacen._timer.cancel())
+
+    def _token(self, kid='kid-1', algoritmo='RS256', clave=None, **cambios):
+        ahora = int(time.time())
+        claims = {'iss': f'https://securetoken.google.com/{self.PROJECT_ID}', 'aud': self.PROJECT_ID,
+                  'sub': 'uid-123', 'iat': ahora - 10, 'exp': ahora + 3600, 'auth_time': ahora - 10}
+        claims.update(cambios)
+        return jwt.encode(claims, clave if clave is not None else self.clave, algorithm=algoritmo, headers={'kid': kid})
+
+    def _verificar(self, token):
+        return verificar_token_local(token, self.almacen, self.PROJECT_ID)
+
+    def test_token_valido(self):
+        claims = self._verificar(self._token())
+        self.assertEqual(claims['uid'], 'uid-123')
+        self.fetch.assert_not_called()
+
+    def test_token_expirado(self):
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(iat=int(time.time()) - 7200, exp=int(time.time()) - 3600))
+
+    def test_aud_incorrecto(self):
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(aud='otro-proyecto'))
+
+    def test_iss_incorrecto(self):
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(iss='https://securetoken.google.com/otro-proyecto'))
+
+    def test_algoritmo_distinto_de_rs256(self):
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(algoritmo='HS256', clave='secreto-compartido-de-al-menos-32-bytes'))
+
+    @override_settings(CACHES=CACHES_EN_MEMORIA, FIREBASE_VERIFICACION_LOCAL=True)
+    def test_verificar_id_token_mide_el_camino_local(self):
+        cache = authentication.CacheTokens(10)
+        with mock.patch.object(authentication, '_cache_tokens', cache), \
+                mock.patch('core.utils.firebase_keys.obtener_almacen', return_value=self.almacen), \
+                mock.patch('core.utils.firebase_keys.project_id_firebase', return_value=self.PROJECT_ID):
+            authentication.verificar_id_token(self._token())
+            latencias = authentication.estadisticas_tokens()['latencias']
+        self.assertEqual(latencias['local']['llamadas'], 1)
+        self.assertGreater(latencias['local']['promedio_ms'], 0)
+        self.assertNotIn('sdk', latencias)
+
+    def test_kid_desconocido(self):
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(kid='kid-inventado'))
+        # Intenta una vez por si Google rotó las claves; el siguiente kid desconocido no vuelve a descargar
+        self.assertEqual(self.fetch.call_count, 1)
+        with self.assertRaises(TokenInvalido):
+            self._verificar(self._token(kid='otro-kid'))
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_refrescos_concurrentes_no_se_cruzan(self):
+        en_curso, maximo = [0], [0]
+        candado = threading.Lock()
+
+        def descargar(*args, **kwargs):
+            with candado:
+                en_curso[0] += 1
+                maximo[0] = max(maximo[0], en_curso[0])
+            time.sleep(0.02)
+            with candado:
+                en_curso[0] -= 1
+            return _RespuestaCerts({'kid-1': self.pem})
+
+        self.fetch.side_effect = descargar
+        self.almacen._expira = 0  # vencidas: cada request querría refrescar
+        hilos = [threading.Thread(target=self.almacen.clave, args=('kid-1',)) for _ in range(8)]
+        hilos.append(threading.Thread(target=self.almacen.refrescar))
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join(5)
+        self.assertEqual(maximo[0], 1)
+        # Los requests que esperaban el candado encuentran las claves ya vigentes
+        self.assertLessEqual(self.fetch.call_count, 2)
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, CACHE_PUBLICO_TTL=0)
+class HorasDisponiblesTests(APITestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        self.url = f'/api/public/kinesiologos/{self.kx.id}/horas/'
+        self.base = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pasado = self._horario(timezone.now() - timedelta(hours=2))
+            self.horarios = [self._horario(self.base + timedelta(days=d, hours=h)) for d in range(3) for h in range(2)]
+            self._horario(self.base + timedelta(hours=5), estado='reservado')
+
+    def _horario(self, inicio, estado='disponible'):
+        return agenda.objects.create(kinesiologo=self.kx, inicio=inicio, fin=inicio + timedelta(minutes=45), estado=estado)
+
+    def test_solo_futuras_disponibles_en_orden(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([h['id'] for h in r.data], [h.id for h in self.horarios])
+        self.assertNotIn('Link', r)
+
+    def test_ventana_desde_hasta_por_dia(self):
+        dia = timezone.localdate(self.base + timedelta(days=1)).isoformat()
+        r = self.client.get(self.url, {'desde': dia, 'hasta': dia})
+        self.assertEqual([h['id'] for h in r.data], [h.id for h in self.horarios[2:4]])
+
+    def test_cursor_recorre_todas_las_paginas(self):
+        vistos, url, params = [], self.url, {'limite': 4}
+        for _ in range(5):
+            r = self.client.get(url, params)
+            self.assertEqual(r.status_code, 200)
+            vistos += [h['id'] for h in r.data]
+            if 'Link' not in r:
+                break
+            url, params = r['Link'].split(';')[0].strip('<>'), None
+            self.assertIn('cursor=', url)
+        self.assertEqual(vistos, [h.id for h in self.horarios])
+
+    def test_parametros_invalidos_responden_400(self):
+        for params in ({'cursor': 'no-es-un-cursor'}, {'cursor': agenda_utils.codificar_cursor(self.base, 1)[:-3] + '!!'},
+                       {'desde': '2026-13-40'}, {'limite': 'muchos'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+    def test_304_con_etag_o_last_modified_vigentes(self):
+        r = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=r['Last-Modified']).status_code, 304)
+        # Otros parámetros, otro ETag
+        self.assertEqual(self.client.get(self.url, {'limite': 2}, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 200)
+
+    def test_cambio_en_la_agenda_actualiza_la_marca_y_el_etag(self):
+        r = self.client.get(self.url)
+        self.kx.refresh_from_db()
+        antes = self.kx.agenda_actualizada_en
+        self.assertIsNotNone(antes)
+        with self.captureOnCommitCallbacks(execute=True):
+            h = self.horarios[0]
+            h.estado = 'no_disponible'
+            h.save()
+        self.kx.refresh_from_db()
+        self.assertGreater(self.kx.agenda_actualizada_en, antes)
+        r2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 200)
+        self.assertNotEqual(r2['ETag'], r['ETag'])
+        self.assertNotIn(h.id, [x['id'] for x in r2.data])
+
+
+class DisponibilidadPublicaTests(APITestCase):
+    URL = '/api/public/disponibilidad/'
+
+    def setUp(self):
+        self.base = timezone.localtime().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.alfa = crear_kinesiologo(1, apellido='Alfa', especialidad='Deportiva')
+        self.beta = crear_kinesiologo(2, apellido='Beta')
+        pendiente = crear_kinesiologo(3, apellido='Aaa', estado_verificacion='pendiente')
+        # Alfa: cuatro horas pasado mañana (una de 30 minutos) y una fuera de la ventana por defecto
+        self.horas_alfa = [self._horario(self.alfa, 24 + h, minutos=30 if h == 1 else 45) for h in range(4)]
+        self._horario(self.alfa, 24 * 20)
+        # Beta: una hora libre mañana, antes que Alfa, y una reservada todavía antes
+        self._horario(self.beta, 0, estado='reservado')
+        self.hora_beta = self._horario(self.beta, 1)
+        self._horario(pendiente, 1)
+
+    def _horario(self, kx, horas, minutos=45, estado='disponible'):
+        inicio = self.base + timedelta(hours=horas)
+        return agenda.objects.create(kinesiologo=kx, inicio=inicio, fin=inicio + timedelta(minutes=minutos), estado=estado)
+
+    def _buscar(self, **params):
+        r = self.client.get(self.URL, params)
+        self.assertEqual(r.status_code, 200)
+        return [(k['kinesiologo']['id'], [h['id'] for h in k['horas']]) for k in r.data]
+
+    def test_por_defecto_ordena_por_nombre_y_corta_tres_horas(self):
+        self.assertEqual(self._buscar(), [(self.alfa.id, [h.id for h in self.horas_alfa[:3]]),
+                                          (self.beta.id, [self.hora_beta.id])])
+
+    def test_orden_pronto(self):
+        self.assertEqual([kx for kx, _ in self._buscar(orden='pronto')], [self.beta.id, self.alfa.id])
+
+    def test_especialidad_sin_distinguir_mayusculas(self):
+        self.assertEqual([kx for kx, _ in self._buscar(especialidad='deportiva')], [self.alfa.id])
+
+    def test_duracion_minima(self):
+        horas = dict(self._buscar(duracion_min=40, por_kinesiologo=10))[self.alfa.id]
+        self.assertEqual(horas, [self.horas_alfa[0].id, self.horas_alfa[2].id, self.horas_alfa[3].id])
+
+    def test_ventana(self):
+        dia = timezone.localdate(self.base).isoformat()
+        self.assertEqual(self._buscar(desde=dia, hasta=dia), [(self.beta.id, [self.hora_beta.id])])
+
+    def test_limite_y_por_kinesiologo(self):
+        self.assertEqual(self._buscar(limite=1, por_kinesiologo=1), [(self.alfa.id, [self.horas_alfa[0].id])])
+
+    def test_parametros_invalidos(self):
+        for params in ({'orden': 'precio'}, {'duracion_min': 'x'},
+                       {'desde': timezone.localdate(self.base).isoformat(),
+                        'hasta': (timezone.localdate(self.base) + timedelta(days=40)).isoformat()}):
+            self.assertEqual(self.client.get(self.URL, params).status_code, 400, params)
+
+
+class NormalizarTests(SimpleTestCase):
+    def test_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(busqueda.normalizar('  Kinesiología DEPORTIVA '), 'kinesiologia deportiva')
+        self.assertEqual(busqueda.normalizar('Muñoz Ñúñez'), 'munoz nunez')
+        self.assertEqual(busqueda.normalizar(None), '')
+
+
+class IndiceTrigramasTests(SimpleTestCase):
+    def setUp(self):
+        self.indice = busqueda.IndiceTrigramas([
+            (1, 'María', 'González', 'Deportiva'),
+            (2, 'José', 'Muñoz', 'Respiratoria'),
+            (3, 'Mario', 'Gonzalo', 'Neurológica'),
+            (4, 'Ana', 'Rojas', 'Deportiva'),
+        ])
+
+    def _ids(self, consulta, umbral=0.4):
+        return [id_ for id_, _ in self.indice.buscar(consulta, umbral)]
+
+    def test_tildes_y_mayusculas_no_importan(self):
+        self.assertEqual(self._ids('MUNOZ'), [2])
+        self.assertEqual(self._ids('neurologica'), [3])
+
+    def test_errores_de_tipeo(self):
+        self.assertEqual(self._ids('gonzales')[0], 1)
+        self.assertEqual(self._ids('deportiba'), [1, 4])
+
+    def test_ordena_por_relevancia(self):
+        resultados = self.indice.buscar('maria gonzalez', 0.3)
+        self.assertEqual(resultados[0][0], 1)
+        self.assertAlmostEqual(resultados[0][1], 1.0)
+        self.assertIn(3, [id_ for id_, _ in resultados[1:]])
+        self.assertEqual([p for _, p in resultados], sorted((p for _, p in resultados), reverse=True))
+
+    def test_umbral_y_consulta_vacia(self):
+        self.assertEqual(self._ids('zzzz'), [])
+        self.assertEqual(self._ids('   '), [])
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, CACHE_PUBLICO_TTL=0, DIRECTORIO_BUSQUEDA_UMBRAL=0.4)
+class BusquedaDirectorioTests(APITestCase):
+    URL = '/api/public/kinesiologos/'
+
+    def setUp(self):
+        caches['publico'].clear()
+        busqueda._indice = None
+        self.munoz = crear_kinesiologo(1, nombre='José', apellido='Muñoz')
+        self.muniz = crear_kinesiologo(2, nombre='Pedro', apellido='Muñiz')
+        self.munoz_rojas = crear_kinesiologo(3, nombre='Ana', apellido='Muñoz Rojas')
+        self.perez = crear_kinesiologo(4, nombre='Luis', apellido='Pérez')
+        self.pendiente = crear_kinesiologo(5, nombre='Jose', apellido='Munoz', estado_verificacion='pendiente')
+
+    def _recorrer(self, **params):
+        ids, url = [], self.URL
+        while url:
+            r = self.client.get(url, params)
+            self.assertEqual(r.status_code, 200)
+            ids += [k['id'] for k in r.data['results']]
+            url, params = r.data['next'], None
+        return ids
+
+    def test_q_ordena_por_relevancia_y_pagina(self):
+        # José Muñoz calza las dos palabras; Muñoz Rojas solo una; el pendiente no sale en el directorio
+        self.assertEqual(self._recorrer(q='jose munoz', limite=1), [self.munoz.id, self.munoz_rojas.id])
+        self.assertEqual(self._recorrer(q='MUÑOS', limite=1), [self.munoz.id, self.munoz_rojas.id])
+
+    def test_guardar_sin_cambiar_el_nombre_no_invalida(self):
+        with mock.patch('core.signals.invalidar_indice') as indice, \
+                mock.patch('core.signals.cache_publico.invalidar') as directorio:
+            kx = kinesiologo.objects.get(id=self.munoz.id)
+            kx.ical_token = 'token-nuevo'
+            kx.save()
+            indice.assert_not_called()
+            directorio.assert_not_called()
+            kx.estado_verificacion = 'rechazado'
+            kx.save()
+            indice.assert_not_called()
+            directorio.assert_called_once()
+            kx.apellido = 'Muñoz Soto'
+            kx.save()
+            indice.assert_called_once()
+
+    def test_cambio_en_otro_worker_rearma_el_indice(self):
+        self.assertEqual(self._recorrer(q='perez'), [self.perez.id])
+        # Otro worker renombra: este proceso no recibe la señal, solo ve la versión compartida
+        kinesiologo.objects.filter(id=self.perez.id).update(apellido='Sepúlveda')
+        self.assertEqual(self._recorrer(q='sepulveda'), [])
+        caches['publico'].set(busqueda._CLAVE_VERSION, 'otra-version')
+        self.assertEqual(self._recorrer(q='sepulveda'), [self.perez.id])
+
+    def test_la_version_compartida_cambia_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            kx = kinesiologo.objects.get(id=self.perez.id)
+            kx.apellido = 'Sepúlveda'
+            kx.save()
+            self.assertIsNone(caches['publico'].get(busqueda._CLAVE_VERSION))
+        self.assertIsNotNone(caches['publico'].get(busqueda._CLAVE_VERSION))
+        self.assertEqual(self._recorrer(q='sepulveda'), [self.perez.id])
+
+
+class FormatoIcalTests(SimpleTestCase):
+    def test_escapa_caracteres_especiales(self):
+        self.assertEqual(ical.escapar('a\\b; c, d\r\ne\nf'), 'a\\\\b\\; c\\, d\\ne\\nf')
+
+    def test_linea_corta_no_se_pliega(self):
+        self.assertEqual(ical.plegar('SUMMARY:hola'), 'SUMMARY:hola\r\n')
+
+    def test_plegado_a_75_octetos_sin_partir_caracteres(self):
+        linea = 'DESCRIPTION:' + 'Kinesiología ñandú ' * 20
+        plegada = ical.plegar(linea)
+        self.assertTrue(plegada.endswith('\r\n'))
+        fisicas = plegada[:-2].split('\r\n')
+        self.assertGreater(len(fisicas), 1)
+        for fisica in fisicas:
+            self.assertLessEqual(len(fisica.encode('utf-8')), 75)
+        self.assertTrue(all(f.startswith(' ') for f in fisicas[1:]))
+        # Desplegar (RFC 5545 3.1): quitar CRLF + espacio devuelve la línea original
+        self.assertEqual(plegada[:-2].replace('\r\n ', ''), linea)
+
+
+class CalendarioIcalTests(APITestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo(ical_token='token-ical')
+        self.url = reverse('calendario-ical', args=['token-ical'])
+        self.pac = crear_paciente()
+        self.manana = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def _contenido(self, respuesta):
+        return b''.join(respuesta.streaming_content).decode('utf-8')
+
+    def test_eventos_incluidos(self):
+        activa = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.manana, nota='Traer, exámenes; gracias')
+        agenda.objects.create(kinesiologo=self.kx, inicio=self.manana, fin=self.manana + timedelta(minutes=30),
+                              estado='reservado', cita=activa)
+        cancelada = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, estado='cancelada',
+                                        fecha_hora=self.manana + timedelta(hours=2))
+        antigua = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=timezone.now() - timedelta(days=60))
+        libre = agenda.objects.create(kinesiologo=self.kx, inicio=self.manana + timedelta(hours=3),
+                                      fin=self.manana + timedelta(hours=4))
+        expirado = agenda.objects.create(kinesiologo=self.kx, estado='expirado', inicio=self.manana + timedelta(hours=5),
+                                         fin=self.manana + timedelta(hours=6))
+        lejano = agenda.objects.create(kinesiologo=self.kx, inicio=self.manana + timedelta(days=400),
+                                       fin=self.manana + timedelta(days=400, hours=1))
+        otro = agenda.objects.create(kinesiologo=crear_kinesiologo(2), inicio=self.manana, fin=self.manana + timedelta(hours=1))
+
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r['Content-Type'], 'text/calendar; charset=utf-8')
+        texto = self._contenido(r)
+        desplegado = texto.replace('\r\n ', '')
+        self.assertTrue(texto.startswith('BEGIN:VCALENDAR\r\n') and texto.endswith('END:VCALENDAR\r\n'))
+        self.assertIn(f'UID:cita-{activa.id}@kineayuda', texto)
+        self.assertIn(f'DTEND:{ical.fecha_utc(self.manana + timedelta(minutes=30))}', texto)  # fin del horario de la cita
+        self.assertIn('Traer\\, exámenes\\; gracias', desplegado)
+        self.assertIn(f'UID:agenda-{libre.id}@kineayuda', texto)
+        for ausente in (f'cita-{cancelada.id}@', f'cita-{antigua.id}@', f'agenda-{expirado.id}@', f'agenda-{lejano.id}@',
+                        f'agenda-{otro.id}@'):
+            self.assertNotIn(ausente, texto)
+        self.assertEqual(texto.count('BEGIN:VEVENT'), 2)
+
+    def test_token_desconocido_404(self):
+        self.assertEqual(self.client.get(reverse('calendario-ical', args=['otro'])).status_code, 404)
+
+    def test_304_con_etag_vigente(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            agenda.objects.create(kinesiologo=self.kx, inicio=self.manana, fin=self.manana + timedelta(hours=1))
+        r = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.manana + timedelta(days=1))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 200)
+
+    def test_url_privada_y_rotacion(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer token-de-prueba')
+        with mock.patch('core.authentication.verificar_id_token', return_value={'uid': self.kx.firebase_ide}):
+            url = self.client.get('/api/kinesiologos/calendario/').data['url']
+            self.assertEqual(url, 'http://testserver' + self.url)
+            nueva = self.client.post('/api/kinesiologos/calendario/').data['url']
+        self.assertNotEqual(nueva, url)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(nueva).status_code, 200)
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, CACHE_PUBLICO_TTL=0)
+class DirectorioPublicoTests(APITestCase):
+    URL = '/api/public/kinesiologos/'
+
+    def setUp(self):
+        self.kxs = [crear_kinesiologo(n, apellido=f'Apellido{n}', doc_verificacion=f'doc-{n}.pdf') for n in range(1, 6)]
+        crear_kinesiologo(9, estado_verificacion='pendiente')
+        kinesiologo.objects.filter(id=self.kxs[0].id).update(foto_perfil='kinesiologos/1/pefil.jpg')
+
+    def test_forma_de_la_pagina_y_limite(self):
+        r = self.client.get(self.URL, {'limite': 2})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(set(r.data), {'next', 'previous', 'results'})
+        self.assertIsNone(r.data['previous'])
+        self.assertEqual([k['id'] for k in r.data['results']], [k.id for k in self.kxs[:2]])
+        siguiente = self.client.get(r.data['next'])
+        self.assertEqual([k['id'] for k in siguiente.data['results']], [k.id for k in self.kxs[2:4]])
+        self.assertIsNotNone(siguiente.data['previous'])
+        self.assertEqual(len(self.client.get(self.URL, {'limite': 1000}).data['results']), 5)  # tope max_page_size
+        self.assertEqual(len(self.client.get(self.URL).data['results']), 5)
+
+    def test_no_expone_datos_internos(self):
+        kx = self.client.get(self.URL).data['results'][0]
+        self.assertEqual(set(kx), {'id', 'nombre', 'apellido', 'especialidad', 'foto_url', 'score_promedio', 'total_resenas'})
+        contenido = self.client.get(self.URL).content.decode()
+        for secreto in ('uid-kine-1', 'doc-1.pdf', 'kine-1', 'kine1@kineayuda.local'):
+            self.assertNotIn(secreto, contenido)
+
+    def test_foto_url_absoluta(self):
+        resultados = self.client.get(self.URL).data['results']
+        self.assertEqual(resultados[0]['foto_url'], f'http://testserver{settings.MEDIA_URL}kinesiologos/1/pefil.jpg')
+        self.assertIsNone(resultados[1]['foto_url'])
+
+
+class PlantillaAgendaTests(TestCase):
+    def test_expansion_mantiene_la_hora_local_al_cambiar_de_horario(self):
+        tz = ZoneInfo('America/Santiago')
+        # Chile pasa a horario de verano el domingo 2026-09-06: lunes 31/8 es UTC-4 y lunes 7/9 es UTC-3
+        bloques = agenda_utils.expandir_plantilla([0], dt_time(9), dt_time(10), 30, 2, date(2026, 8, 31), tz)
+        self.assertEqual([b[0].astimezone(tz).strftime('%d %H:%M') for b in bloques], ['31 09:00', '31 09:30', '07 09:00', '07 09:30'])
+        self.assertEqual([b[0].astimezone(dt_timezone.utc).hour for b in bloques], [13, 13, 12, 12])
+        self.assertTrue(all(fin - inicio == timedelta(minutes=30) for inicio, fin in bloques))
+
+    def test_semanas_desde_media_semana_y_bloques_completos(self):
+        tz = ZoneInfo('America/Santiago')
+        # Desde un miércoles, una semana cubre miércoles a martes: el lunes que entra es el de la semana siguiente
+        bloques = agenda_utils.expandir_plantilla([0, 2], dt_time(9), dt_time(10, 15), 30, 1, date(2026, 5, 6), tz)
+        self.assertEqual([b[0].astimezone(tz).strftime('%a %d %H:%M') for b in bloques],
+                         ['Wed 06 09:00', 'Wed 06 09:30', 'Mon 11 09:00', 'Mon 11 09:30'])
+
+    def test_separar_solapados(self):
+        t = lambda h, m=0: datetime(2026, 5, 4, h, m, tzinfo=dt_timezone.utc)
+        candidatos = [(t(9), t(10)), (t(10), t(11)), (t(11), t(12)), (t(12), t(13)), (t(13), t(14))]
+        existentes = [(t(10, 30), t(12, 30)), (t(8), t(9)), (t(13, 59), t(15))]
+        libres, solapados = agenda_utils.separar_solapados(candidatos, existentes)
+        self.assertEqual(libres, [(t(9), t(10))])  # tocarse en el borde no es solaparse
+        self.assertEqual(solapados, candidatos[1:])
+
+    def test_publicar_omite_pasados_y_solapados(self):
+        kx = crear_kinesiologo()
+        lunes = lambda dia, h, m=0: timezone.make_aware(datetime(2030, 1, dia, h, m))
+        agenda.objects.create(kinesiologo=kx, inicio=lunes(14, 9, 30), fin=lunes(14, 10))
+        agenda.objects.create(kinesiologo=kx, estado='expirado', inicio=lunes(21, 9), fin=lunes(21, 9, 30))
+
+        # Miércoles 9 de enero: el lunes 7 ya pasó
+        with mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime(2030, 1, 9, 12))):
+            resultado = agenda_utils.publicar_plantilla(kx, [0], dt_time(9), dt_time(10), 30, 3, fecha_inicio=date(2030, 1, 7))
+
+        self.assertEqual(sorted(h.inicio for h in resultado['creados']), [lunes(14, 9), lunes(21, 9), lunes(21, 9, 30)])
+        self.assertEqual(sorted((o['motivo'], o['inicio']) for o in resultado['omitidos']),
+                         [('pasado', lunes(7, 9)), ('pasado', lunes(7, 9, 30)), ('solapa', lunes(14, 9, 30))])
+
+
+class KinesiologoSaveTests(TestCase):
+    def test_save_del_perfil_no_pisa_campos_escritos_con_update(self):
+        kx = crear_kinesiologo(suscripcion_vence_en=timezone.now() + timedelta(days=1))
+        perfil = kinesiologo.objects.get(id=kx.id)  # instancia cargada antes del pago, como la del request
+        nuevo_vencimiento = timezone.now() + timedelta(days=31)
+        registrar_pago_suscripcion(kx.id, nuevo_vencimiento)
+        kinesiologo.objects.filter(id=kx.id).update(agenda_actualizada_en=timezone.now())
+
+        perfil.especialidad = 'deportiva'
+        perfil.save()
+
+        kx.refresh_from_db()
+        self.assertEqual(kx.especialidad, 'deportiva')
+        self.assertEqual(kx.suscripcion_vence_en, nuevo_vencimiento)
+        self.assertIsNotNone(kx.agenda_actualizada_en)
+
+
+class SincronizarVencidasTests(TestCase):
+    def _pago(self, kx, fecha_expiracion, estado='pagado'):
+        return pagoSuscripcion.objects.create(kinesiologo=kx, monto=Decimal('9990'), estado=estado, fecha_expiracion=fecha_expiracion)
+
+    def test_repara_vencidas_y_sin_vencimiento(self):
+        ahora = timezone.now()
+        vencida = crear_kinesiologo(1, suscripcion_vence_en=ahora - timedelta(days=1))
+        sin_vencimiento = crear_kinesiologo(2)
+        sin_pago = crear_kinesiologo(3)
+        vigente = crear_kinesiologo(4, suscripcion_vence_en=ahora + timedelta(days=5))
+        self._pago(vencida, ahora + timedelta(days=30))
+        self._pago(sin_vencimiento, ahora + timedelta(days=20))
+        self._pago(sin_vencimiento, ahora + timedelta(days=60), estado='fallido')
+        self._pago(vigente, ahora + timedelta(days=40))
+
+        self.assertEqual(sincronizar_vencidas(ahora), 2)
+        vencimientos = dict(kinesiologo.objects.values_list('id', 'suscripcion_vence_en'))
+        self.assertEqual(vencimientos[vencida.id], ahora + timedelta(days=30))
+        self.assertEqual(vencimientos[sin_vencimiento.id], ahora + timedelta(days=20))
+        self.assertIsNone(vencimientos[sin_pago.id])
+        self.assertEqual(vencimientos[vigente.id], ahora + timedelta(days=5))
+        self.assertEqual(sincronizar_vencidas(ahora), 0)
+
+
+class SolapamientoAgendaTests(APITestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo(suscripcion_vence_en=timezone.now() + timedelta(days=30))
+        self.t0 = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def _horario(self, desde_min, hasta_min, estado='disponible'):
+        return agenda.objects.create(kinesiologo=self.kx, estado=estado, inicio=self.t0 + timedelta(minutes=desde_min),
+                                     fin=self.t0 + timedelta(minutes=hasta_min))
+
+    def _choca(self, desde_min, hasta_min, **kwargs):
+        return hay_solapamiento(self.kx.id, self.t0 + timedelta(minutes=desde_min), self.t0 + timedelta(minutes=hasta_min), **kwargs)
+
+    def test_hay_solapamiento_con_rangos_semiabiertos(self):
+        h = self._horario(0, 45)
+        self.assertTrue(self._choca(30, 75))
+        self.assertTrue(self._choca(-10, 5))
+        self.assertFalse(self._choca(45, 90))  # termina justo donde empieza el otro
+        self.assertFalse(self._choca(-45, 0))
+        self.assertFalse(self._choca(0, 45, excluir_id=h.id))
+
+    def test_horarios_inactivos_no_cuentan(self):
+        self._horario(0, 45, estado='expirado')
+        self.assertFalse(self._choca(0, 45))
+
+    def test_filtro_en_postgres_usa_la_columna_rango(self):
+        with mock.patch('core.utils.agenda.usa_rango_gist', return_value=True):
+            sql = str(filtrar_solapados(agenda.objects.all(), self.t0, self.t0 + timedelta(hours=1)).query)
+        self.assertIn('"rango" && tstzrange(', sql)
+
+    def test_guardar_sin_solapar_traduce_la_violacion_de_la_restriccion(self):
+        def violar():
+            raise IntegrityError('conflicting key value violates exclusion constraint "agenda_sin_solapamiento"')
+        with self.assertRaises(HorarioSolapado):
+            guardar_sin_solapar(violar)
+
+    def test_guardar_sin_solapar_deja_pasar_otros_errores(self):
+        def otro():
+            raise IntegrityError('UNIQUE constraint failed: core_agenda.cita_id')
+        with self.assertRaises(IntegrityError):
+            guardar_sin_solapar(otro)
+        self.assertEqual(guardar_sin_solapar(lambda: 'ok'), 'ok')
+
+    def test_api_rechaza_un_horario_que_solapa(self):
+        self._horario(0, 45)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer token-de-prueba')
+        with mock.patch('core.authentication.verificar_id_token', return_value={'uid': self.kx.firebase_ide}):
+            r = self.client.post('/api/agendas/', {'inicio': (self.t0 + timedelta(minutes=30)).isoformat(),
+                                                   'fin': (self.t0 + timedelta(minutes=75)).isoformat()}, format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(agenda.objects.filter(kinesiologo=self.kx).count(), 1)
+
+
+class MigracionSolapamientoTests(TestCase):
+    migracion = importlib.import_module('core.migrations.0011_agenda_rango_sin_solapamiento')
+
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        self.t0 = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def _horario(self, desde_min, hasta_min, estado='disponible', kx=None):
+        return agenda.objects.create(kinesiologo=kx or self.kx, estado=estado, inicio=self.t0 + timedelta(minutes=desde_min),
+                                     fin=self.t0 + timedelta(minutes=hasta_min))
+
+    def test_migracion_lista_los_choques_sin_tocar_datos(self):
+        libre = self._horario(0, 45)
+        bloqueo = self._horario(30, 75, estado='no_disponible')
+        self._horario(0, 45, estado='expirado')
+        self._horario(0, 45, kx=crear_kinesiologo(2))
+        self.assertEqual(list(self.migracion.buscar_solapados(agenda)), [(libre.id, bloqueo.id)])
+
+        editor = mock.MagicMock(connection=mock.MagicMock(vendor='postgresql'))
+        apps = mock.MagicMock(get_model=lambda app, modelo: agenda)
+        with self.assertRaisesMessage(self.migracion.HorariosSolapados, f'({libre.id}, {bloqueo.id})'):
+            self.migracion._verificar_sin_solapados(apps, editor)
+        self.assertEqual(agenda.objects.filter(estado__in=['disponible', 'no_disponible']).count(), 3)
+
+    def test_sin_choques_la_migracion_sigue(self):
+        self._horario(0, 45)
+        self._horario(45, 90)
+        self.assertEqual(list(self.migracion.buscar_solapados(agenda)), [])
+
+    def test_comando_marca_expirado_el_de_menor_prioridad(self):
+        reservado = self._horario(30, 75, estado='reservado')
+        libre_que_choca = self._horario(0, 45)
+        bloqueo = self._horario(60, 120, estado='no_disponible')
+        libre_despues = self._horario(120, 165)
+
+        call_command('resolver_solapamientos', stdout=mock.MagicMock())
+        self.assertFalse(agenda.objects.filter(estado='expirado').exists())
+
+        call_command('resolver_solapamientos', aplicar=True, stdout=mock.MagicMock())
+        estados = dict(agenda.objects.values_list('id', 'estado'))
+        self.assertEqual(estados, {reservado.id: 'reservado', libre_que_choca.id: 'expirado',
+                                   bloqueo.id: 'expirado', libre_despues.id: 'disponible'})
+        self.assertEqual(list(self.migracion.buscar_solapados(agenda)), [])
+
+    def test_comando_no_decide_dobles_reservas(self):
+        a = self._horario(0, 45, estado='reservado')
+        b = self._horario(30, 75, estado='reservado')
+        salida = mock.MagicMock()
+        with self.assertRaises(CommandError):
+            call_command('resolver_solapamientos', aplicar=True, stdout=salida)
+        self.assertIn(f'{b.id} y {a.id}', ''.join(str(c) for c in salida.write.call_args_list))
+        self.assertEqual(agenda.objects.filter(estado='reservado').count(), 2)
+
+
+class BarridoTests(TestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        self.pac = crear_paciente()
+        self.ahora = timezone.now()
+        self.pagos = []
+        for i in range(3):
+            c = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.ahora + timedelta(days=1, hours=i),
+                                    estado_pago='pendiente')
+            self.pagos.append(pagoCita.objects.create(cita=c, kinesiologo=self.kx, paciente=self.pac, monto=Decimal('25000')))
+        pagoCita.objects.update(fecha_creacion=self.ahora - timedelta(hours=3))
+
+    def test_cuenta_solo_las_filas_que_cambio_el_update(self):
+        pagado = self.pagos[0]
+        atomic = transaction.atomic
+
+        @contextmanager
+        def retorno_de_webpay_en_medio(*args, **kwargs):
+            # Entre el SELECT de candidatos y el UPDATE, webpay_retorno_pago_cita confirma un pago
+            pagoCita.objects.filter(id=pagado.id).update(estado='pagado', fecha_pago=self.ahora)
+            cita.objects.filter(id=pagado.cita_id).update(estado_pago='pagado')
+            with atomic(*args, **kwargs):
+                yield
+
+        with mock.patch.object(barrido.transaction, 'atomic', retorno_de_webpay_en_medio):
+            pagos, citas = barrido.expirar_pagos_cita(self.ahora, lote=10)
+
+        self.assertEqual((pagos, citas), (2, 2))
+        self.assertEqual(pagoCita.objects.get(id=pagado.id).estado, 'pagado')
+        self.assertEqual(cita.objects.get(id=pagado.cita_id).estado, 'pendiente')
+
+    def test_tandas(self):
+        self.assertEqual(barrido.expirar_pagos_cita(self.ahora, lote=2), (3, 3))
+        self.assertEqual(barrido.expirar_pagos_cita(self.ahora, lote=2), (0, 0))
+
+
+class RetornoPagoCitaTests(APITestCase):
+    URL = '/api/pagos/citas/webpay/retorno/'
+
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        self.pac = crear_paciente()
+        inicio = timezone.now().replace(microsecond=0) + timedelta(days=2)
+        self.cita = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=inicio)
+        self.slot = agenda.objects.create(kinesiologo=self.kx, inicio=inicio, fin=inicio + timedelta(minutes=45), estado='retenido',
+                                          retenido_hasta=timezone.now() + timedelta(minutes=5), cita=self.cita, paciente=self.pac)
+        self.pago = pagoCita.objects.create(cita=self.cita, kinesiologo=self.kx, paciente=self.pac, monto=Decimal('25000'),
+                                            token_ws='tok-1')
+        self.refund = self._parchar('core.views.refund_transaction')
+
+    def _parchar(self, objetivo, **kwargs):
+        parche = mock.patch(objetivo, **kwargs)
+        simulado = parche.start()
+        self.addCleanup(parche.stop)
+        return simulado
+
+    def _commit(self, efecto=None, status_tx='AUTHORIZED', codigo=0):
+        bloques_del_test = len(connection.atomic_blocks)
+
+        def commit(token_ws):
+            # La llamada HTTPS a Transbank no debe ocurrir dentro de una transacción del request
+            self.assertEqual(len(connection.atomic_blocks), bloques_del_test)
+            if efecto:
+                efecto()
+            return {'status': status_tx, 'response_code': codigo}
+        return self._parchar('core.views.commit_transaction', side_effect=commit)
+
+    def test_pago_autorizado_reserva_el_horario(self):
+        commit = self._commit()
+        r = self.client.get(self.URL, {'token_ws': 'tok-1'})
+        self.assertEqual(r.status_code, 200)
+        commit.assert_called_once_with('tok-1')
+        self.slot.refresh_from_db()
+        self.pago.refresh_from_db()
+        self.assertEqual((self.slot.estado, self.slot.cita_id), ('reservado', self.cita.id))
+        self.assertEqual(self.pago.estado, 'pagado')
+        self.refund.assert_not_called()
+
+    def test_horario_tomado_durante_el_commit_anula_el_cobro(self):
+        otra = cita.objects.create(paciente=crear_paciente(2), kinesiologo=self.kx, fecha_hora=self.cita.fecha_hora)
+
+        def otro_paciente_lo_toma():
+            agenda.objects.filter(id=self.slot.id).update(estado='reservado', cita=otra, retenido_hasta=None)
+
+        self._commit(efecto=otro_paciente_lo_toma)
+        r = self.client.get(self.URL, {'token_ws': 'tok-1'})
+        self.assertEqual(r.status_code, 409)
+        self.refund.assert_called_once_with('tok-1', 25000.0)
+        self.pago.refresh_from_db()
+        self.cita.refresh_from_db()
+        self.assertEqual((self.pago.estado, self.cita.estado), ('fallido', 'cancelada'))
+        self.assertEqual(agenda.objects.get(id=self.slot.id).cita_id, otra.id)
+
+    def test_horario_ya_tomado_antes_del_commit_no_confirma(self):
+        otra = cita.objects.create(paciente=crear_paciente(2), kinesiologo=self.kx, fecha_hora=self.cita.fecha_hora)
+        agenda.objects.filter(id=self.slot.id).update(estado='reservado', cita=otra, retenido_hasta=None)
+        commit = self._commit()
+        r = self.client.get(self.URL, {'token_ws': 'tok-1'})
+        self.assertEqual(r.status_code, 409)
+        commit.assert_not_called()
+        self.refund.assert_not_called()
+
+    def test_pago_rechazado_libera_el_horario(self):
+        self._commit(status_tx='FAILED', codigo=-1)
+        r = self.client.get(self.URL, {'token_ws': 'tok-1'})
+        self.assertEqual(r.status_code, 400)
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.estado, self.slot.cita_id), ('disponible', None))
+
+
+class ResumenReseñasTests(TestCase):
+    CAMPOS = ('total', 'positivas', 'neutrales', 'negativas', 'pendientes')
+
+    def _foto(self):
+        resumen = {r.kinesiologo_id: (*(getattr(r, c) for c in self.CAMPOS), r.score_promedio)
+                   for r in resumenReseñas.objects.all()}
+        dias = {(m.kinesiologo_id, m.dia): tuple(getattr(m, c) for c in self.CAMPOS)
+                for m in metricaReseñaDiaria.objects.all() if m.total}
+        return resumen, dias
+
+    def test_conteos_incrementales_igual_a_reconstruir(self):
+        kx1, kx2 = crear_kinesiologo(1), crear_kinesiologo(2)
+        pac = crear_paciente()
+        reseñas = []
+        for i, (kx, sentimiento) in enumerate([(kx1, 'positiva'), (kx1, 'positiva'), (kx1, 'negativa'), (kx1, None),
+                                               (kx2, 'neutral'), (kx2, 'negativa')]):
+            c = cita.objects.create(paciente=pac, kinesiologo=kx, estado='completada',
+                                    fecha_hora=timezone.now() - timedelta(days=i % 3 + 1))
+            reseñas.append(reseña.objects.create(cita=c, comentario=f'reseña {i}', sentimiento=sentimiento))
+        # Reclasificación (p. ej. el worker asíncrono o recalcular_sentimientos) y bajas
+        reseñas[3].sentimiento = 'neutral'
+        reseñas[3].save()
+        reseñas[0].sentimiento = 'negativa'
+        reseñas[0].save()
+        reseñas[1].delete()
+        reseñas[5].delete()
+
+        incremental = self._foto()
+        self.assertEqual(incremental[0][kx1.id], (3, 0, 1, 2, 0, -2 / 3))
+        self.assertEqual(incremental[0][kx2.id], (1, 0, 1, 0, 0, 0.0))
+        resenas_utils.reconstruir()
+        self.assertEqual(self._foto(), incremental)
+
+    def test_sin_reseñas_analizadas_no_hay_score(self):
+        kx = crear_kinesiologo()
+        c = cita.objects.create(paciente=crear_paciente(), kinesiologo=kx, estado='completada',
+                                fecha_hora=timezone.now() - timedelta(days=1))
+        reseña.objects.create(cita=c, comentario='pendiente', sentimiento=None)
+        resumen = resumenReseñas.objects.get(kinesiologo=kx)
+        self.assertEqual((resumen.total, resumen.pendientes, resumen.score_promedio), (1, 1, None))
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, CACHE_PUBLICO_TTL=0)
+class DirectorioPorRatingTests(APITestCase):
+    URL = '/api/public/kinesiologos/'
+
+    def setUp(self):
+        self.scores = {}
+        for n, score in enumerate([0.5, None, -1.0, None, 1.0, None, None, 0.5, None, None], start=1):
+            kx = crear_kinesiologo(n, apellido=f'Apellido{20 - n}')
+            resumenReseñas.objects.filter(kinesiologo=kx).update(score_promedio=score, total=0 if score is None else 2)
+            self.scores[kx.id] = resumenReseñas.SIN_SCORE if score is None else score
+
+    def _recorrer(self, **params):
+        ids, url = [], self.URL
+        for _ in range(20):
+            r = self.client.get(url, params)
+            self.assertEqual(r.status_code, 200)
+            ids += [k['id'] for k in r.data['results']]
+            url, params = r.data['next'], None
+            if not url:
+                return ids
+        self.fail('El cursor no terminó')
+
+    def test_orden_rating_pagina_sin_repetir_entre_empates(self):
+        ids = self._recorrer(orden='rating', limite=2)
+        self.assertEqual(ids, sorted(self.scores, key=lambda id_: (-self.scores[id_], id_)))
+
+    def test_rating_min(self):
+        ids = self._recorrer(rating_min='0.5', limite=2)
+        self.assertEqual(sorted(ids), sorted(id_ for id_, score in self.scores.items() if score >= 0.5))
+        self.assertEqual(self.client.get(self.URL, {'rating_min': 'alto'}).status_code, 400)
+
+
+class MetricaCitasDiariaTests(TestCase):
+    def setUp(self):
+        self.kx = crear_kinesiologo()
+        self.pac = crear_paciente()
+        self.manana = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def assertIgualAAgregar(self):
+        guardadas = {(m.kinesiologo_id, m.dia): {campo: getattr(m, campo) for campo in metricas.CAMPOS}
+                     for m in metricaCitaDiaria.objects.all()}
+        self.assertEqual(guardadas, dict(metricas.agregar()))
+
+    def test_mover_cancelar_y_pagar_citas_deja_el_resumen_igual_a_agregar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            c1 = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.manana)
+            c2 = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.manana + timedelta(hours=1))
+            agenda.objects.create(kinesiologo=self.kx, inicio=self.manana, fin=self.manana + timedelta(minutes=45), estado='reservado')
+        self.assertIgualAAgregar()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            c1.fecha_hora = self.manana + timedelta(days=3)  # reagendada: sale del día anterior
+            c1.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            c2.estado = 'cancelada'
+            c2.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            pago = pagoCita.objects.create(cita=c1, kinesiologo=self.kx, paciente=self.pac, monto=Decimal('25000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            pago.estado, pago.fecha_pago = 'pagado', timezone.now()
+            pago.save()
+        self.assertIgualAAgregar()
+        hoy = metricaCitaDiaria.objects.get(kinesiologo=self.kx, dia=timezone.localdate())
+        self.assertEqual((hoy.pagos, hoy.ingresos), (1, Decimal('25000')))
+        dia = metricaCitaDiaria.objects.get(kinesiologo=self.kx, dia=timezone.localdate(self.manana))
+        self.assertEqual((dia.citas, dia.canceladas, dia.horarios_reservados), (1, 1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            c1.delete()
+        self.assertIgualAAgregar()
+
+    def test_error_al_recalcular_no_tumba_la_escritura_ya_confirmada(self):
+        with mock.patch.object(metricas, 'recalcular_dias', side_effect=RuntimeError('sin conexión')), \
+                self.assertLogs(level='ERROR'), self.captureOnCommitCallbacks(execute=True):
+            c = cita.objects.create(paciente=self.pac, kinesiologo=self.kx, fecha_hora=self.manana)
+        self.assertTrue(cita.objects.filter(id=c.id).exists())
+
+
+class MetricaReseñasAlMoverCitaTests(TestCase):
+    def _dias(self, kx):
+        return {(fila.dia, fila.total, fila.positivas) for fila in metricaReseñaDiaria.objects.filter(kinesiologo=kx, total__gt=0)}
+
+    def test_reagendar_una_cita_reseñada_mueve_sus_conteos_de_dia(self):
+        kx = crear_kinesiologo()
+        antes = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        c = cita.objects.create(paciente=crear_paciente(), kinesiologo=kx, estado='completada', fecha_hora=antes)
+        reseña.objects.create(cita=c, comentario='excelente', sentimiento='positiva')
+        self.assertEqual(self._dias(kx), {(timezone.localdate(antes), 1, 1)})
+
+        c = cita.objects.get(id=c.id)
+        c.fecha_hora = antes + timedelta(days=3)
+        c.save()
+
+        self.assertEqual(self._dias(kx), {(timezone.localdate(c.fecha_hora), 1, 1)})
+        resumen = resumenReseñas.objects.get(kinesiologo=kx)
+        self.assertEqual((resumen.total, resumen.positivas), (1, 1))
+
+    def test_mover_la_cita_a_otro_kinesiologo_mueve_el_resumen(self):
+        kx, otro = crear_kinesiologo(), crear_kinesiologo(2)
+        c = cita.objects.create(paciente=crear_paciente(), kinesiologo=kx, estado='completada',
+                                fecha_hora=timezone.now() - timedelta(days=1))
+        reseña.objects.create(cita=c, comentario='regular', sentimiento='neutral')
+        c = cita.objects.get(id=c.id)
+        c.kinesiologo = otro
+        c.save()
+        self.assertEqual(resumenReseñas.objects.get(kinesiologo=kx).total, 0)
+        self.assertEqual(resumenReseñas.objects.get(kinesiologo=otro).neutrales, 1)
+        self.assertEqual(self._dias(kx), set())
+
+
+@override_settings(CACHES=CACHES_EN_MEMORIA, CACHE_PUBLICO_TTL=60, CACHE_PUBLICO_STALE=600)
+class CachePublicoTests(TestCase):
+    def setUp(self):
+        cache_publico._cache().clear()
+        self.kx = crear_kinesiologo()
+
+    def _version(self, ambito, kx_id=None):
+        return cache_publico._cache().get(cache_publico._clave_version(ambito, kx_id))
+
+    def test_escrituras_cambian_la_version_de_su_ambito(self):
+        otro = crear_kinesiologo(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            metodoPago.objects.create(nombre='Webpay', codigo_interno='webpay')
+        self.assertIsNotNone(self._version(cache_publico.METODOS_PAGO))
+
+        inicio = timezone.now() + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            agenda.objects.create(kinesiologo=self.kx, inicio=inicio, fin=inicio + timedelta(minutes=45))
+        self.assertIsNotNone(self._version(cache_publico.HORAS, self.kx.id))
+        self.assertIsNone(self._version(cache_publico.HORAS, otro.id))
+
+        directorio = self._version(cache_publico.DIRECTORIO)
+        c = cita.objects.create(paciente=crear_paciente(), kinesiologo=self.kx, estado='completada',
+                                fecha_hora=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            reseña.objects.create(cita=c, comentario='muy bien', sentimiento='positiva')
+        self.assertIsNotNone(self._version(cache_publico.RESENAS, self.kx.id))
+        self.assertNotEqual(self._version(cache_publico.DIRECTORIO), directorio)
+
+    def test_la_version_cambia_solo_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            metodoPago.objects.create(nombre='Webpay', codigo_interno='webpay')
+            self.assertIsNone(self._version(cache_publico.METODOS_PAGO))
+        self.assertTrue(callbacks)
+
+    def test_hit_no_consulta_la_base_y_responde_304(self):
+        self.client.get('/api/pagos/metodos/')
+        with self.assertNumQueries(0):
+            r = self.client.get('/api/pagos/metodos/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.client.get('/api/pagos/metodos/', HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+
+    def test_entrada_desactualizada_se_sirve_al_tiro_y_se_rearma_en_segundo_plano(self):
+        llamadas, liberar = [], threading.Event()
+
+        def vista(request, kinesiologo_id):
+            llamadas.append(kinesiologo_id)
+            if len(llamadas) > 1:
+                liberar.wait(5)  # la reconstrucción es lenta
+            return JsonResponse({'version': len(llamadas)})
+
+        envuelta = cache_publico.cache_publico(cache_publico.HORAS)(vista)
+        pedir = lambda: envuelta(RequestFactory().get('/horas/'), kinesiologo_id=self.kx.id)
+        self.assertEqual(pedir().content, b'{"version": 1}')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cache_publico.invalidar(cache_publico.HORAS, [self.kx.id])
+        inicio = time.monotonic()
+        r = pedir()
+        self.assertLess(time.monotonic() - inicio, 1.0)
+        self.assertEqual(r.content, b'{"version": 1}')  # stale, sin esperar la reconstrucción
+        self.assertEqual(pedir().content, b'{"version": 1}')  # el candado evita una segunda reconstrucción
+
+        liberar.set()
+        limite = time.monotonic() + 5
+        while pedir().content != b'{"version": 2}' and time.monotonic() < limite:
+            time.sleep(0.01)
+        self.assertEqual(pedir().content, b'{"version": 2}')
+        self.assertEqual(len(llamadas), 2)
@@ -1,9 +1,11 @@
 from rest_framework import routers
 from django.urls import path, include
-from .views import (kinesiologoViewSet, pacienteViewSet, citaViewSet, reseñaViewSet, verificar_firebase_token, me, AgendaViewSet, 
+from .views import (kinesiologoViewSet, pacienteViewSet, citaViewSet, reseñaViewSet, verificar_firebase_token, me, cerrar_sesion, AgendaViewSet, 
                     AgendarCitaView, HorasDisponiblesView, KinesiologosPublicosView, ReseñasPublicasView, lista_metodos_pago,
                     estado_suscripcion, webpay_iniciar_suscripcion, webpay_retorno, DocumentoVerificacionViewSet, webpay_iniciar_pago_cita,
-                    webpay_retorno_pago_cita, CitasPorRutView, CrearReseñaPorCitaView)
+                    webpay_retorno_pago_cita, CitasPorRutView, CrearReseñaPorCitaView, DisponibilidadPublicaView,
+                    calendario_ical)
+from .utils.cache_publico import cache_publico, DIRECTORIO, RESENAS, HORAS, METODOS_PAGO
 
 router = routers.DefaultRouter()
 router.register(r'kinesiologos', kinesiologoViewSet, basename='kinesiologo')
@@ -16,14 +18,17 @@ router.register(r'documentos', DocumentoVerificacionViewSet, basename='documento
 urlpatterns = [
     path('', include(router.urls)),
     path('login/verify', verificar_firebase_token, name='verificar_token'),
+    path('logout/', cerrar_sesion, name='cerrar_sesion'),
     path('me/', me, name='me'),
-    path('public/kinesiologos/', KinesiologosPublicosView.as_view()),
-    path('public/kinesiologos/<int:kinesiologo_id>/resenas/', ReseñasPublicasView.as_view()),
-    path('public/kinesiologos/<int:kinesiologo_id>/horas/', HorasDisponiblesView.as_view()),
+    path('public/kinesiologos/', cache_publico(DIRECTORIO)(KinesiologosPublicosView.as_view())),
+    path('public/kinesiologos/<int:kinesiologo_id>/resenas/', cache_publico(RESENAS)(ReseñasPublicasView.as_view())),
+    path('public/kinesiologos/<int:kinesiologo_id>/horas/', cache_publico(HORAS)(HorasDisponiblesView.as_view())),
+    path('public/disponibilidad/', DisponibilidadPublicaView.as_view()),
     path('public/agendar/', AgendarCitaView.as_view()),
+    path('public/calendario/<str:token>.ics', calendario_ical, name='calendario-ical'),
     path('public/paciente/<str:rut>/citas/', CitasPorRutView.as_view()),
     path('public/citas/<int:cita_id>/resena/', CrearReseñaPorCitaView.as_view(), name='crear-resena-por-cita'),
-    path('pagos/metodos/', lista_metodos_pago),
+    path('pagos/metodos/', cache_publico(METODOS_PAGO)(lista_metodos_pago)),
     #path('pagos/webhook/<str:proveedor>/', webhook_pago),
     path('pagos/estado/', estado_suscripcion),
     path('pagos/webpay/iniciar/', webpay_iniciar_suscripcion),
@@ -0,0 +1,316 @@
+import base64
+import bisect
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import BooleanField, F, Min, OuterRef, Q, Subquery, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from core.models import agenda, kinesiologo
+from core.utils import cache_publico
+from core.utils.metricas import marcar_dias
+
+# Nombre de la restricción de exclusión creada en la migración 0011 (solo PostgreSQL)
+RESTRICCION_SOLAPAMIENTO = 'agenda_sin_solapamiento'
+
+class HorarioSolapado(Exception):
+    pass
+
+class HorarioNoDisponible(Exception):
+    pass
+
+def usa_rango_gist(qs):
+    return connections[qs.db].vendor == 'postgresql'
+
+def filtrar_solapados(qs, inicio, fin):
+    """
+    Filtra los horarios de `qs` que se solapan con [inicio, fin). En PostgreSQL usa la columna `rango`
+    (índice GiST de la restricción de exclusión); en otros motores, la comparación equivalente.
+    """
+    if usa_rango_gist(qs):
+        # `rango` es una columna generada que no está en el modelo: se referencia con RawSQL
+        quote = connections[qs.db].ops.quote_name
+        columna = f"{quote(agenda._meta.db_table)}.{quote('rango')}"
+        return qs.filter(RawSQL(f"{columna} && tstzrange(%s, %s, '[)')", [inicio, fin], output_field=BooleanField()))
+    return qs.filter(inicio__lt=fin, fin__gt=inicio)
+
+def hay_solapamiento(kinesiologo_id, inicio, fin, excluir_id=None):
+    """True si [inicio, fin) choca con algún horario activo del kinesiologo."""
+    qs = agenda.objects.filter(kinesiologo_id=kinesiologo_id, estado__in=agenda.ESTADOS_ACTIVOS)
+    if excluir_id:
+        qs = qs.exclude(id=excluir_id)
+    return filtrar_solapados(qs, inicio, fin).exists()
+
+def es_error_solapamiento(error):
+    """True si el IntegrityError viene de la restricción de exclusión (SQLSTATE 23P01)."""
+    causa = error.__cause__
+    return getattr(causa, 'pgcode', None) == '23P01' or RESTRICCION_SOLAPAMIENTO in str(error)
+
+def guardar_sin_solapar(guardar):
+    """
+    Ejecuta `guardar()` en un savepoint y traduce la violación de la restricción de exclusión a
+    HorarioSolapado: cubre la carrera entre la validación previa y el INSERT/UPDATE.
+    """
+    try:
+        with transaction.atomic():
+            return guardar()
+    except IntegrityError as e:
+        if es_error_solapamiento(e):
+            raise HorarioSolapado() from e
+        raise
+
+def expandir_plantilla(dias, hora_inicio, hora_fin, duracion_minutos, semanas, fecha_inicio, tz=None):
+    """
+    Expande una plantilla semanal en bloques (inicio, fin) ordenados.
+    dias: 0=lunes ... 6=domingo. Cada día se divide en bloques de `duracion_minutos` entre hora_inicio y hora_fin.
+    """
+    tz = tz or timezone.get_current_timezone()
+    duracion = timedelta(minutes=duracion_minutos)
+    dias = set(dias)
+    bloques = []
+    for offset in range(semanas * 7):
+        fecha = fecha_inicio + timedelta(days=offset)
+        if fecha.weekday() not in dias:
+            continue
+        inicio = timezone.make_aware(datetime.combine(fecha, hora_inicio), tz)
+        limite = timezone.make_aware(datetime.combine(fecha, hora_fin), tz)
+        while inicio + duracion <= limite:
+            bloques.append((inicio, inicio + duracion))
+            inicio += duracion
+    return bloques
+
+def separar_solapados(candidatos, existentes):
+    """
+    Separa los candidatos en (libres, solapados) contra los bloques existentes, sin más consultas.
+    Ordena los existentes por inicio y usa el máximo acumulado de sus fines: un candidato solapa si
+    algún existente que empieza antes de su fin termina después de su inicio.
+    """
+    existentes = sorted(existentes)
+    inicios = [inicio for inicio, _ in existentes]
+    max_fin = []
+    for _, fin in existentes:
+        max_fin.append(max(fin, max_fin[-1]) if max_fin else fin)
+
+    libres, solapados = [], []
+    for inicio, fin in candidatos:
+        i = bisect.bisect_left(inicios, fin)  # existentes con inicio < fin del candidato
+        if i and max_fin[i - 1] > inicio:
+            solapados.append((inicio, fin))
+        else:
+            libres.append((inicio, fin))
+    return libres, solapados
+
+def publicar_plantilla(kx, dias, hora_inicio, hora_fin, duracion_minutos, semanas, fecha_inicio=None):
+    """
+    Publica todos los bloques de una plantilla en una transacción: una consulta de rango para los
+    solapamientos y un solo bulk_create. Retorna el detalle de creados y omitidos.
+    Lanza HorarioSolapado si otro request publicó un horario que choca mientras tanto (PostgreSQL).
+    """
+    ahora = timezone.now()
+    fecha_inicio = fecha_inicio or timezone.localdate()
+    candidatos = expandir_plantilla(dias, hora_inicio, hora_fin, duracion_minutos, semanas, fecha_inicio)
+
+    pasados = [b for b in candidatos if b[0] < ahora]
+    candidatos = [b for b in candidatos if b[0] >= ahora]
+    if not candidatos:
+        return {'creados': [], 'omitidos': [{'inicio': i, 'fin': f, 'motivo': 'pasado'} for i, f in pasados]}
+
+    with transaction.atomic():
+        existentes = filtrar_solapados(
+            agenda.objects.filter(kinesiologo=kx, estado__in=agenda.ESTADOS_ACTIVOS),
+            candidatos[0][0], candidatos[-1][1],
+        ).values_list('inicio', 'fin')
+        libres, solapados = separar_solapados(candidatos, list(existentes))
+        creados = guardar_sin_solapar(lambda: agenda.objects.bulk_create(
+            [agenda(kinesiologo=kx, inicio=inicio, fin=fin, estado='disponible') for inicio, fin in libres]
+        ))
+        if creados:
+            marcar_agenda_modificada([kx.id])  # bulk_create no emite post_save
+            marcar_dias((kx.id, h.inicio) for h in creados)
+
+    omitidos = ([{'inicio': i, 'fin': f, 'motivo': 'pasado'} for i, f in pasados] +
+                [{'inicio': i, 'fin': f, 'motivo': 'solapa'} for i, f in solapados])
+    return {'creados': creados, 'omitidos': omitidos}
+
+def marcar_agenda_modificada(kinesiologo_ids):
+    """
+    Registra que la agenda de estos kinesiologos cambió, lo que invalida el ETag y el caché de sus horas disponibles.
+    Lo llaman las señales de agenda y las rutas que escriben en bloque (bulk_create / update).
+    Se escribe al confirmar la transacción para que nadie lea el timestamp nuevo junto a datos viejos.
+    """
+    ids = set(kinesiologo_ids)
+    if ids:
+        cache_publico.invalidar(cache_publico.HORAS, ids)
+        transaction.on_commit(
+            lambda: kinesiologo.objects.filter(id__in=ids).update(agenda_actualizada_en=timezone.now())
+        )
+
+def parsear_fecha_hora(valor, fin_de_dia=False):
+    """
+    Parámetro de fecha de la API: ISO 8601 con hora, o YYYY-MM-DD (inicio del día local; con
+    fin_de_dia=True, inicio del día siguiente, para usar `hasta` como límite exclusivo). None si viene vacío.
+    """
+    if not valor:
+        return None
+    try:
+        fecha = parse_date(valor)
+        fecha_hora = None if fecha else parse_datetime(valor)
+    except ValueError:  # bien formada pero fuera de rango (mes 13, etc.)
+        fecha = fecha_hora = None
+    if fecha_hora is None:
+        if fecha is None:
+            raise ValueError(f"Fecha inválida: {valor}")
+        if fin_de_dia:
+            fecha += timedelta(days=1)
+        fecha_hora = datetime.combine(fecha, time.min)
+    if timezone.is_naive(fecha_hora):
+        fecha_hora = timezone.make_aware(fecha_hora)
+    return fecha_hora
+
+def codificar_cursor(inicio, id_):
+    return base64.urlsafe_b64encode(f"{inicio.isoformat()}|{id_}".encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """(inicio, id) del último horario de la página anterior. Lanza ValueError si el cursor no es válido."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        inicio, id_ = texto.split('|')
+        inicio = parse_datetime(inicio)
+        if inicio is None:
+            raise ValueError
+        return inicio, int(id_)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Cursor inválido.")
+
+def horas_disponibles(kinesiologo_id, desde, hasta=None, despues_de=None, limite=100):
+    """
+    Página de horas disponibles [(id, inicio, fin)] con inicio en [desde, hasta), ordenada por (inicio, id).
+    `despues_de` es el cursor (inicio, id) del último horario ya entregado. Usa el índice agenda_kx_estado_inicio.
+    """
+    qs = agenda.objects.filter(kinesiologo_id=kinesiologo_id, estado='disponible', inicio__gte=desde)
+    if hasta:
+        qs = qs.filter(inicio__lt=hasta)
+    if despues_de:
+        inicio, id_ = despues_de
+        qs = qs.filter(Q(inicio__gt=inicio) | Q(inicio=inicio, id__gt=id_))
+    return list(qs.order_by('inicio', 'id').values_list('id', 'inicio', 'fin')[:limite])
+
+def version_horas_disponibles(kinesiologo_id, ahora):
+    """
+    Momento del último cambio visible en las horas disponibles del kinesiologo, en una consulta: su
+    agenda_actualizada_en o el inicio del último horario disponible que ya pasó (la lista también cambia
+    sola con el tiempo). Retorna (existe, version); version es None si nunca hubo cambios.
+    """
+    ultimo_pasado = (agenda.objects
+                     .filter(kinesiologo=OuterRef('pk'), estado='disponible', inicio__lt=ahora)
+                     .order_by('-inicio').values('inicio')[:1])
+    fila = (kinesiologo.objects.filter(id=kinesiologo_id)
+            .annotate(ultimo_pasado=Subquery(ultimo_pasado))
+            .values_list('agenda_actualizada_en', 'ultimo_pasado').first())
+    if fila is None:
+        return False, None
+    marcas = [m for m in fila if m]
+    return True, max(marcas) if marcas else None
+
+def buscar_disponibilidad(desde, hasta, especialidad=None, duracion_min=0, por_kinesiologo=3, limite=20, orden='nombre'):
+    """
+    Kinesiologos aprobados con horas disponibles que empiezan en [desde, hasta) y duran al menos `duracion_min`
+    minutos, cada uno con sus primeras `por_kinesiologo` horas. orden: 'nombre' (apellido, nombre) o
+    'pronto' (primera hora libre). Retorna [{'kinesiologo': {...}, 'primera_hora': inicio, 'horas': [...]}].
+
+    Es una sola consulta: la subconsulta elige los `limite` kinesiologos (su primera hora sale de una búsqueda
+    en el índice (kinesiologo, estado, inicio)) y ROW_NUMBER() particionado por kinesiologo corta sus horas.
+    """
+    def disponibles(qs):
+        qs = qs.filter(estado='disponible', inicio__gte=desde, inicio__lt=hasta)
+        if duracion_min:
+            qs = qs.filter(fin__gte=F('inicio') + timedelta(minutes=duracion_min))
+        return qs
+
+    kinesiologos = kinesiologo.objects.filter(estado_verificacion='aprobado')
+    if especialidad:
+        kinesiologos = kinesiologos.filter(especialidad__iexact=especialidad)
+    primera = disponibles(agenda.objects.filter(kinesiologo=OuterRef('pk'))).order_by('inicio').values('inicio')[:1]
+    kinesiologos = kinesiologos.annotate(primera_hora=Subquery(primera)).filter(primera_hora__isnull=False)
+    if orden == 'pronto':
+        kinesiologos = kinesiologos.order_by('primera_hora', 'id')
+    else:
+        kinesiologos = kinesiologos.order_by('apellido', 'nombre', 'id')
+
+    qs = disponibles(agenda.objects.filter(kinesiologo_id__in=kinesiologos.values('id')[:limite])).annotate(
+        n=Window(RowNumber(), partition_by=F('kinesiologo_id'), order_by=[F('inicio').asc(), F('id').asc()]),
+        primera_hora=Window(Min('inicio'), partition_by=F('kinesiologo_id')),
+    ).filter(n__lte=por_kinesiologo)
+    if orden == 'pronto':
+        qs = qs.order_by('primera_hora', 'kinesiologo_id', 'n')
+    else:
+        qs = qs.order_by('kinesiologo__apellido', 'kinesiologo__nombre', 'kinesiologo_id', 'n')
+    filas = qs.values_list(
+        'kinesiologo_id', 'kinesiologo__nombre', 'kinesiologo__apellido', 'kinesiologo__especialidad',
+        'primera_hora', 'id', 'inicio', 'fin',
+    )
+
+    resultados = []
+    for kx_id, nombre, apellido, esp, primera_hora, id_, inicio, fin in filas:
+        if not resultados or resultados[-1]['kinesiologo']['id'] != kx_id:
+            resultados.append({
+                'kinesiologo': {'id': kx_id, 'nombre': nombre, 'apellido': apellido, 'especialidad': esp},
+                'primera_hora': primera_hora,
+                'horas': [],
+            })
+        resultados[-1]['horas'].append({'id': id_, 'inicio': inicio, 'fin': fin})
+    return resultados
+
+def _libre(ahora):
+    """Horarios que se pueden tomar: disponibles, o retenidos cuya retención ya venció."""
+    return Q(estado='disponible') | Q(estado='retenido', retenido_hasta__lt=ahora)
+
+def tomar_horario(slot_id, ahora=None):
+    """
+    Bloquea un horario libre y futuro con SELECT ... FOR UPDATE SKIP LOCKED: si otro request ya lo tiene
+    bloqueado, falla de inmediato en vez de hacer fila detrás del lock. Debe llamarse en transaction.atomic().
+    Lanza agenda.DoesNotExist si no existe y HorarioNoDisponible si está tomado o ya pasó.
+    """
+    ahora = ahora or timezone.now()
+    slot = agenda.objects.select_for_update(skip_locked=True).filter(_libre(ahora), id=slot_id).first()
+    if slot is None:
+        if not agenda.objects.filter(id=slot_id).exists():
+            raise agenda.DoesNotExist()
+        raise HorarioNoDisponible("El horario ya no está disponible.")
+    if slot.inicio <= ahora:
+        raise HorarioNoDisponible("No se puede agendar un horario pasado.")
+    return slot
+
+def retener_horario(slot, cita_obj, ahora=None):
+    """Deja el horario ya bloqueado (ver tomar_horario) 'retenido' para la cita por AGENDA_RETENCION_MINUTOS."""
+    ahora = ahora or timezone.now()
+    slot.estado = 'retenido'
+    slot.retenido_hasta = ahora + timedelta(minutes=getattr(settings, 'AGENDA_RETENCION_MINUTOS', 15))
+    slot.cita = cita_obj
+    slot.paciente = cita_obj.paciente
+    slot.save(update_fields=['estado', 'retenido_hasta', 'cita', 'paciente'])
+    return slot
+
+def confirmar_retencion(cita_obj, ahora=None, saltar_bloqueados=True):
+    """
+    Al volver de Webpay: bloquea el horario de la cita si sigue siendo suyo, o si su retención venció y nadie
+    más lo tomó. Retorna el horario bloqueado o None si ya es de otro paciente. Debe llamarse en transaction.atomic().
+    Con saltar_bloqueados=False espera el lock en vez de tratar el horario como tomado (cuando ya se cobró).
+    """
+    ahora = ahora or timezone.now()
+    return (agenda.objects.select_for_update(skip_locked=saltar_bloqueados)
+            .filter(kinesiologo_id=cita_obj.kinesiologo_id, inicio=cita_obj.fecha_hora)
+            .filter(Q(cita=cita_obj) | _libre(ahora))
+            .first())
+
+def liberar_retencion(cita_obj):
+    """Devuelve a 'disponible' el horario retenido para esta cita (pago fallido o abandonado)."""
+    liberados = agenda.objects.filter(cita=cita_obj, estado='retenido').update(
+        estado='disponible', retenido_hasta=None, cita=None, paciente=None
+    )
+    if liberados:
+        marcar_agenda_modificada([cita_obj.kinesiologo_id])
+        marcar_dias([(cita_obj.kinesiologo_id, cita_obj.fecha_hora)])
+    return liberados
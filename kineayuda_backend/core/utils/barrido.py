@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import agenda, cita, pagoCita, pagoSuscripcion
+from core.utils.agenda import marcar_agenda_modificada
+from core.utils.metricas import marcar_dias
+from core.utils.suscripciones import sincronizar_vencidas
+
+def _actualizar_en_lotes(qs, lote, **campos):
+    """
+    UPDATE de `qs` en tandas de hasta `lote` filas (por id), cada una en su propia transacción corta,
+    para no tomar locks sobre toda la tabla. El filtro original se repite al bloquear cada tanda, así una
+    fila que cambió entre el SELECT y el UPDATE no se pisa. Retorna [(ids actualizados, filas actualizadas)]
+    por tanda, con los ids y el conteo de lo que realmente cambió el UPDATE.
+    """
+    tandas = []
+    while True:
+        candidatos = list(qs.order_by('id').values_list('id', flat=True)[:lote])
+        if not candidatos:
+            break
+        with transaction.atomic():
+            # Las que siguen cumpliendo el filtro quedan bloqueadas: el UPDATE toca exactamente estas
+            ids = list(qs.filter(id__in=candidatos).select_for_update().values_list('id', flat=True))
+            actualizadas = qs.filter(id__in=ids).update(**campos) if ids else 0
+        tandas.append((ids, actualizadas))
+        if len(candidatos) < lote:
+            break
+    return tandas
+
+def expirar_horarios(ahora, lote):
+    """Horarios 'disponible' cuyo inicio ya pasó -> 'expirado' (ya no se pueden reservar)."""
+    qs = agenda.objects.filter(estado='disponible', inicio__lt=ahora)
+    total = 0
+    for ids, actualizadas in _actualizar_en_lotes(qs, lote, estado='expirado'):
+        total += actualizadas
+        marcar_agenda_modificada(agenda.objects.filter(id__in=ids).values_list('kinesiologo_id', flat=True))
+    return total
+
+def expirar_retenciones(ahora, lote):
+    """Retenciones de Webpay vencidas -> el horario vuelve a 'disponible' (si ya pasó, expirar_horarios lo expira)."""
+    qs = agenda.objects.filter(estado='retenido', retenido_hasta__lt=ahora)
+    total = 0
+    for ids, actualizadas in _actualizar_en_lotes(qs, lote, estado='disponible', retenido_hasta=None, cita=None, paciente=None):
+        total += actualizadas
+        marcar_agenda_modificada(agenda.objects.filter(id__in=ids).values_list('kinesiologo_id', flat=True))
+    return total
+
+def expirar_pagos_cita(ahora, lote):
+    """
+    Pagos de cita que quedaron 'pendiente' más de PAGO_PENDIENTE_TTL_MINUTOS (el paciente abandonó Webpay)
+    -> 'expirado', y su cita -> cancelada / pago fallido. Retorna (pagos, citas).
+    """
+    limite = ahora - timedelta(minutes=getattr(settings, 'PAGO_PENDIENTE_TTL_MINUTOS', 60))
+    qs = pagoCita.objects.filter(estado='pendiente', fecha_creacion__lt=limite)
+    pagos = citas = 0
+    for ids, actualizadas in _actualizar_en_lotes(qs, lote, estado='expirado'):
+        pagos += actualizadas
+        canceladas = cita.objects.filter(pago_cita__id__in=ids, estado_pago='pendiente')
+        afectadas = list(canceladas.values_list('kinesiologo_id', 'fecha_hora'))
+        citas += canceladas.update(estado='cancelada', estado_pago='fallido')
+        marcar_dias(afectadas)
+    return pagos, citas
+
+def expirar_pagos_suscripcion(ahora, lote):
+    """Pagos de suscripción 'pendiente' más antiguos que PAGO_PENDIENTE_TTL_MINUTOS -> 'expirado'."""
+    limite = ahora - timedelta(minutes=getattr(settings, 'PAGO_PENDIENTE_TTL_MINUTOS', 60))
+    qs = pagoSuscripcion.objects.filter(estado='pendiente', fecha_pago__lt=limite)
+    return sum(actualizadas for _, actualizadas in _actualizar_en_lotes(qs, lote, estado='expirado'))
+
+def _medir(funcion):
+    t = time.perf_counter()
+    resultado = funcion()
+    return resultado, (time.perf_counter() - t) * 1000
+
+def barrer(ahora=None, lote=1000):
+    """
+    Una pasada completa del barrido de expiración. Retorna métricas por tarea:
+    filas actualizadas y duración en ms.
+    """
+    ahora = ahora or timezone.now()
+    retenciones, ms_retenciones = _medir(lambda: expirar_retenciones(ahora, lote))
+    horarios, ms_horarios = _medir(lambda: expirar_horarios(ahora, lote))
+    (pagos_cita, citas), ms_pagos_cita = _medir(lambda: expirar_pagos_cita(ahora, lote))
+    pagos_suscripcion, ms_pagos_suscripcion = _medir(lambda: expirar_pagos_suscripcion(ahora, lote))
+    suscripciones, ms_suscripciones = _medir(lambda: sincronizar_vencidas(ahora))
+    return {
+        'retenciones': {'filas': retenciones, 'duracion_ms': ms_retenciones},
+        'horarios': {'filas': horarios, 'duracion_ms': ms_horarios},
+        'pagos_cita': {'filas': pagos_cita, 'citas_canceladas': citas, 'duracion_ms': ms_pagos_cita},
+        'pagos_suscripcion': {'filas': pagos_suscripcion, 'duracion_ms': ms_pagos_suscripcion},
+        'suscripciones': {'filas': suscripciones, 'duracion_ms': ms_suscripciones},
+    }
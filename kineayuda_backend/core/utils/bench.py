@@ -0,0 +1,50 @@
+import json
+import os
+import resource
+import sys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+def cargar_datos(nombre):
+    """Carga un archivo JSON de core/data (corpus y conjuntos de referencia)."""
+    with open(os.path.join(DATA_DIR, nombre), encoding='utf-8') as f:
+        return json.load(f)
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal, sin depender de numpy."""
+    if not valores:
+        return None
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p / 100.0
+    i = int(k)
+    if i + 1 >= len(orden):
+        return orden[-1]
+    return orden[i] + (orden[i + 1] - orden[i]) * (k - i)
+
+def resumen_latencias(segundos):
+    """p50/p95/p99 y promedio en milisegundos."""
+    ms = [s * 1000 for s in segundos]
+    return {
+        'n': len(ms),
+        'p50_ms': percentil(ms, 50),
+        'p95_ms': percentil(ms, 95),
+        'p99_ms': percentil(ms, 99),
+        'promedio_ms': sum(ms) / len(ms) if ms else None,
+    }
+
+def rss_actual_mb():
+    """RSS actual del proceso (Linux: /proc/self/status; en otros sistemas, el pico)."""
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss_pico_mb()
+
+def rss_pico_mb():
+    """RSS máximo alcanzado por el proceso."""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
@@ -0,0 +1,114 @@
+import threading
+import unicodedata
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BooleanField, F, FloatField, Func, TextField, Value
+
+from core.models import kinesiologo
+
+# Búsqueda difusa del directorio (?q=): nombre, apellido y especialidad sin distinguir tildes ni mayúsculas.
+# En PostgreSQL usa pg_trgm + unaccent con un índice GIN sobre la misma expresión (migración 0020);
+# en otros motores (SQLite en desarrollo y pruebas), un índice de trigramas en memoria por proceso.
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'Kinesiología Deportiva' -> 'kinesiologia deportiva'."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower().strip()
+
+def umbral():
+    return getattr(settings, 'DIRECTORIO_BUSQUEDA_UMBRAL', 0.4)
+
+class DocumentoBusqueda(Func):
+    """f_unaccent(lower(nombre || ' ' || apellido || ' ' || especialidad)): idéntica a la del índice kx_busqueda_trgm."""
+    template = 'f_unaccent(lower(%(expressions)s))'
+    arg_joiner = " || ' ' || "
+    output_field = TextField()
+
+    def __init__(self):
+        super().__init__(F('nombre'), F('apellido'), F('especialidad'))
+
+class SimilitudPalabra(Func):
+    """word_similarity(consulta, documento) de pg_trgm, entre 0 y 1."""
+    function = 'word_similarity'
+    output_field = FloatField()
+
+class PalabraSimilar(Func):
+    """documento %> consulta: el operador de pg_trgm que usa el índice GIN (umbral pg_trgm.word_similarity_threshold)."""
+    template = '%(expressions)s'
+    arg_joiner = ' %%> '
+    output_field = BooleanField()
+
+def filtrar_postgres(qs, consulta):
+    """Filtra y anota `relevancia` en PostgreSQL. El umbral se fija con set_config en la misma transacción (ver la vista)."""
+    documento = DocumentoBusqueda()
+    return qs.filter(PalabraSimilar(documento, Value(consulta))).annotate(
+        relevancia=SimilitudPalabra(Value(consulta), documento)
+    )
+
+def trigramas(palabra):
+    """Trigramas de una palabra como los arma pg_trgm: con dos espacios al inicio y uno al final."""
+    relleno = f'  {palabra} '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+class IndiceTrigramas:
+    """
+    Índice invertido trigrama -> palabras -> ids, para motores sin pg_trgm. La relevancia de un documento es el
+    promedio, sobre las palabras de la consulta, de la mejor similitud (Jaccard de trigramas) con alguna de sus palabras.
+    """
+
+    def __init__(self, filas):
+        self.palabras = defaultdict(set)    # palabra -> ids que la contienen
+        self.por_trigrama = defaultdict(set)  # trigrama -> palabras
+        for id_, *campos in filas:
+            for palabra in normalizar(' '.join(campos)).split():
+                self.palabras[palabra].add(id_)
+        for palabra in self.palabras:
+            for t in trigramas(palabra):
+                self.por_trigrama[t].add(palabra)
+
+    def buscar(self, consulta, umbral):
+        """[(id, relevancia)] con relevancia >= umbral, de mayor a menor."""
+        terminos = normalizar(consulta).split()
+        if not terminos:
+            return []
+        puntajes = defaultdict(float)
+        for termino in terminos:
+            propios = trigramas(termino)
+            mejor = {}
+            for palabra in set().union(*(self.por_trigrama.get(t, ()) for t in propios)):
+                ajenos = trigramas(palabra)
+                similitud = len(propios & ajenos) / len(propios | ajenos)
+                for id_ in self.palabras[palabra]:
+                    if similitud > mejor.get(id_, 0.0):
+                        mejor[id_] = similitud
+            for id_, similitud in mejor.items():
+                puntajes[id_] += similitud / len(terminos)
+        return sorted(((i, p) for i, p in puntajes.items() if p >= umbral), key=lambda x: (-x[1], x[0]))
+
+_indice = None  # (versión, IndiceTrigramas) de este proceso
+_candado = threading.Lock()
+
+# Versión del índice en el caché compartido entre workers (alias 'publico'): al cambiar, cada proceso
+# reconstruye el suyo en su próximo ?q=, no solo el que guardó el kinesiologo.
+_CLAVE_VERSION = 'busqueda:version'
+
+def _cache():
+    return caches['publico']
+
+def invalidar_indice():
+    """Lo llaman las señales de kinesiologo; la versión cambia al confirmar, para no reconstruir con datos de antes."""
+    transaction.on_commit(lambda: _cache().set(_CLAVE_VERSION, uuid.uuid4().hex, timeout=None))
+
+def buscar_en_memoria(consulta):
+    """Búsqueda con el índice en memoria (motores sin pg_trgm). Retorna [(id, relevancia)]."""
+    global _indice
+    version = _cache().get(_CLAVE_VERSION)
+    with _candado:
+        if _indice is None or _indice[0] != version:
+            _indice = (version, IndiceTrigramas(kinesiologo.objects.values_list('id', 'nombre', 'apellido', 'especialidad')))
+        indice = _indice[1]
+    return indice.buscar(consulta, umbral())
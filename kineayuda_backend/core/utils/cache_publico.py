@@ -0,0 +1,128 @@
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+# Caché de respuestas de las vistas públicas (GET anónimos): guarda el JSON ya renderizado por ámbito
+# (un kinesiologo o todo el directorio) y query string. Cada ámbito tiene una versión en el caché que las
+# señales cambian al confirmar la transacción; una entrada de otra versión o más vieja que CACHE_PUBLICO_TTL
+# se sigue sirviendo mientras un thread la reconstruye (stale-while-revalidate), hasta CACHE_PUBLICO_STALE.
+
+DIRECTORIO = 'directorio'
+RESENAS = 'resenas'
+HORAS = 'horas'
+METODOS_PAGO = 'metodos_pago'
+
+def _cache():
+    """Alias 'publico' de CACHES: compartido entre workers y separado del caché por defecto."""
+    return caches['publico']
+
+# Cabeceras que dependen del cliente y no se guardan con la respuesta
+_CONDICIONALES = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+def ttl():
+    return getattr(settings, 'CACHE_PUBLICO_TTL', 60)
+
+def ventana_stale():
+    return getattr(settings, 'CACHE_PUBLICO_STALE', 600)
+
+def _clave_version(ambito, kinesiologo_id=None):
+    return f'publico:v:{ambito}' if kinesiologo_id is None else f'publico:v:{ambito}:{kinesiologo_id}'
+
+def invalidar(ambito, kinesiologo_ids=(None,)):
+    """
+    Marca como desactualizadas las respuestas cacheadas del ámbito (de esos kinesiologos, o global con None).
+    Se aplica al confirmar la transacción, para que ninguna reconstrucción lea los datos de antes.
+    """
+    claves = [_clave_version(ambito, kx_id) for kx_id in set(kinesiologo_ids)]
+    if claves:
+        transaction.on_commit(lambda: _cache().set_many({c: uuid.uuid4().hex for c in claves}, timeout=None))
+
+def _clave(ambito, request, kinesiologo_id):
+    parametros = urlencode(sorted(request.GET.lists()), doseq=True)
+    firma = hashlib.md5(f'{request.get_host()}|{request.path}|{parametros}'.encode()).hexdigest()
+    return f'publico:{ambito}:{kinesiologo_id or "-"}:{firma}'
+
+def _cacheable(request):
+    # El navegador pide text/html y DRF le responde la API navegable: esa no se cachea
+    return request.method == 'GET' and 'text/html' not in request.META.get('HTTP_ACCEPT', '')
+
+def _construir(vista, request, args, kwargs, clave, version):
+    """Ejecuta la vista sin cabeceras condicionales y, si responde 200 en JSON, guarda la entrada. Retorna (response, entrada)."""
+    copia = copy.copy(request)
+    copia.META = {k: v for k, v in request.META.items() if k not in _CONDICIONALES}
+    response = vista(copia, *args, **kwargs)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    if response.status_code != 200 or not response.get('Content-Type', '').startswith('application/json'):
+        return response, None
+    if not response.has_header('ETag'):
+        response['ETag'] = '"%s"' % hashlib.md5(response.content).hexdigest()
+    entrada = {
+        'version': version,
+        'creada': time.time(),
+        'contenido': response.content,
+        'cabeceras': [(k, v) for k, v in response.items() if k.lower() != 'set-cookie'],
+    }
+    _cache().set(clave, entrada, timeout=ttl() + ventana_stale())
+    return response, entrada
+
+def _revalidar(vista, request, args, kwargs, clave, version):
+    """Reconstrucción en segundo plano; el candado evita que varios procesos rearmen la misma entrada."""
+    candado = f'{clave}:renovando'
+    if not _cache().add(candado, 1, timeout=30):
+        return
+
+    def trabajo():
+        try:
+            _construir(vista, request, args, kwargs, clave, version)
+        finally:
+            _cache().delete(candado)
+            connections.close_all()
+
+    threading.Thread(target=trabajo, daemon=True).start()
+
+def _responder(request, entrada):
+    cabeceras = dict(entrada['cabeceras'])
+    no_modificado = get_conditional_response(
+        request, etag=cabeceras.get('ETag'), last_modified=parse_http_date_safe(cabeceras.get('Last-Modified', '')),
+    )
+    response = no_modificado if no_modificado is not None else HttpResponse(entrada['contenido'])
+    for nombre, valor in entrada['cabeceras']:
+        if no_modificado is None or nombre.lower() not in ('content-type', 'content-length'):
+            response[nombre] = valor
+    return response
+
+def cache_publico(ambito):
+    """
+    Decorador para la vista (la de Django, p. ej. View.as_view()), como cache_page. El ámbito por kinesiologo
+    sale del kwarg `kinesiologo_id` de la URL. Con CACHE_PUBLICO_TTL = 0 la vista se llama siempre.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envuelta(request, *args, **kwargs):
+            if not ttl() or not _cacheable(request):
+                return vista(request, *args, **kwargs)
+            kinesiologo_id = kwargs.get('kinesiologo_id')
+            clave = _clave(ambito, request, kinesiologo_id)
+            version = _cache().get(_clave_version(ambito, kinesiologo_id))
+            entrada = _cache().get(clave)
+            if entrada is None:
+                response, entrada = _construir(vista, request, args, kwargs, clave, version)
+                if entrada is None:
+                    return response
+            elif entrada['version'] != version or time.time() - entrada['creada'] > ttl():
+                _revalidar(vista, request, args, kwargs, clave, version)
+            return _responder(request, entrada)
+        return envuelta
+    return decorador
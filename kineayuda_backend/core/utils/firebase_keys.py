@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import jwt
+import requests
+from cryptography.x509 import load_pem_x509_certificate
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Certificados públicos con los que Firebase Auth firma los ID tokens
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+class TokenInvalido(Exception):
+    pass
+
+class AlmacenClavesFirebase:
+    """
+    Guarda las claves públicas de firma de Firebase (kid -> clave), las refresca en segundo plano
+    antes de que venzan y las persiste en disco, así un worker recién iniciado verifica tokens sin
+    esperar un fetch HTTPS.
+    """
+
+    def __init__(self, url=CERTS_URL, ruta=None, margen_refresco=300):
+        self.url = url
+        self.ruta = ruta
+        self.margen_refresco = margen_refresco
+        self._claves = {}
+        self._certificados = {}
+        self._expira = 0.0
+        self._ultimo_refresco = 0.0
+        self._lock = threading.Lock()
+        # Un solo refresco a la vez (requests y timer): sin fetches duplicados ni escrituras en disco cruzadas
+        self._lock_refresco = threading.Lock()
+        self._timer = None
+        self._pid = None
+
+    def cargar_certificados(self, certificados, expira):
+        """Carga {kid: certificado PEM} válidos hasta `expira` (epoch). También sirve para usar un set local."""
+        claves = {kid: load_pem_x509_certificate(pem.encode('utf-8')).public_key()
+                  for kid, pem in certificados.items()}
+        with self._lock:
+            self._certificados = dict(certificados)
+            self._claves = claves
+            self._expira = float(expira)
+
+    def vigente(self):
+        return bool(self._claves) and time.time() < self._expira
+
+    def cargar_desde_disco(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return False
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            self.cargar_certificados(datos['certificados'], datos['expira'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No se pudieron leer las claves de Firebase desde %s: %s", self.ruta, e)
+            return False
+        return self.vigente()
+
+    def _guardar_en_disco(self):
+        if not self.ruta:
+            return
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'certificados': self._certificados, 'expira': self._expira}, f)
+        os.replace(temporal, self.ruta)  # atómico: otro worker nunca lee un archivo a medias
+
+    def refrescar(self):
+        """Descarga los certificados, respeta el max-age de Google y los deja en memoria y en disco."""
+        with self._lock_refresco:
+            self._refrescar()
+
+    def _refrescar(self):
+        self._ultimo_refresco = time.time()
+        resp = requests.get(self.url, timeout=10)
+        resp.raise_for_status()
+        max_age = re.search(r'max-age=(\d+)', resp.headers.get('Cache-Control', ''))
+        expira = time.time() + (int(max_age.group(1)) if max_age else 3600)
+        self.cargar_certificados(resp.json(), expira)
+        try:
+            self._guardar_en_disco()
+        except OSError as e:
+            logger.warning("No se pudieron guardar las claves de Firebase en %s: %s", self.ruta, e)
+        self._programar_refresco()
+
+    def _refrescar_en_fondo(self):
+        try:
+            self.refrescar()
+        except Exception:
+            logger.exception("Error refrescando las claves de Firebase; se reintenta en 60s")
+            self._programar_refresco(60)
+
+    def _programar_refresco(self, segundos=None):
+        if segundos is None:
+            segundos = max(30, self._expira - time.time() - self.margen_refresco)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._pid = os.getpid()
+        self._timer = threading.Timer(segundos, self._refrescar_en_fondo)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def iniciar(self):
+        """Carga desde disco si hay claves vigentes; si no, las descarga. Deja programado el refresco."""
+        with self._lock_refresco:
+            if self.cargar_desde_disco():
+                self._programar_refresco()
+            else:
+                self._refrescar()
+
+    def _necesita_refresco(self, kid):
+        if not self.vigente():
+            return True
+        # Google rotó las claves antes de tiempo. Se limita a un intento por minuto para que
+        # tokens con kid inventado no disparen un fetch por request.
+        return kid not in self._claves and time.time() - self._ultimo_refresco > 60
+
+    def clave(self, kid):
+        if self._pid != os.getpid() or self._necesita_refresco(kid):
+            with self._lock_refresco:
+                # Tras un fork el timer del proceso padre no corre en el hijo
+                if self._pid != os.getpid():
+                    self._programar_refresco()
+                # Otro thread pudo haber refrescado mientras se esperaba el candado
+                if self._necesita_refresco(kid):
+                    self._refrescar()
+        try:
+            return self._claves[kid]
+        except KeyError:
+            raise TokenInvalido(f"El token está firmado con una clave desconocida (kid={kid}).")
+
+def verificar_token_local(token, almacen, project_id, leeway=0):
+    """
+    Verifica un ID token de Firebase con PyJWT contra las claves del almacén, con las mismas reglas
+    que firebase_admin.auth.verify_id_token. Retorna los claims con 'uid' = 'sub'.
+    """
+    try:
+        cabecera = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as e:
+        raise TokenInvalido(f"Token mal formado: {e}")
+    if cabecera.get('alg') != 'RS256':
+        raise TokenInvalido("El token debe estar firmado con RS256.")
+
+    clave = almacen.clave(cabecera.get('kid'))
+    try:
+        claims = jwt.decode(
+            token,
+            clave,
+            algorithms=['RS256'],
+            audience=project_id,
+            issuer=f"https://securetoken.google.com/{project_id}",
+            leeway=leeway,
+            options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']},
+        )
+    except jwt.PyJWTError as e:
+        raise TokenInvalido(str(e))
+
+    sub = claims.get('sub')
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise TokenInvalido("El claim 'sub' del token es inválido.")
+    if claims.get('auth_time', 0) > time.time() + leeway:
+        raise TokenInvalido("El claim 'auth_time' del token está en el futuro.")
+    claims['uid'] = sub
+    return claims
+
+_almacen = None
+_lock_almacen = threading.Lock()
+
+def obtener_almacen():
+    """Almacén de claves del proceso, iniciado la primera vez que se necesita."""
+    global _almacen
+    if _almacen is None:
+        with _lock_almacen:
+            if _almacen is None:
+                almacen = AlmacenClavesFirebase(ruta=getattr(settings, 'FIREBASE_CLAVES_PATH', None))
+                almacen.iniciar()
+                _almacen = almacen
+    return _almacen
+
+def project_id_firebase():
+    project_id = getattr(settings, 'FIREBASE_PROJECT_ID', None)
+    if not project_id:
+        import firebase_admin
+        project_id = firebase_admin.get_app().project_id
+    return project_id
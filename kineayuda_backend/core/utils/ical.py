@@ -0,0 +1,92 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from core.models import agenda, cita
+
+# Formato iCalendar (RFC 5545): líneas CRLF de hasta 75 octetos, texto escapado y fechas en UTC
+PRODID = "-//Kineayuda//Agenda//ES"
+DIAS_ATRAS = 30
+DIAS_ADELANTE = 365
+TITULOS_HORARIO = {
+    'disponible': 'Hora disponible',
+    'no_disponible': 'No disponible',
+    'retenido': 'Hora en proceso de pago',
+}
+
+def escapar(texto):
+    return (str(texto).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def plegar(linea):
+    """Corta la línea en trozos de 75 octetos sin partir caracteres UTF-8; las continuaciones empiezan con espacio."""
+    datos = linea.encode('utf-8')
+    if len(datos) <= 75:
+        return linea + "\r\n"
+    partes, actual, limite = [], b"", 75
+    for caracter in linea:
+        c = caracter.encode('utf-8')
+        if len(actual) + len(c) > limite:
+            partes.append(actual.decode('utf-8'))
+            actual, limite = b"", 74  # el espacio inicial ocupa un octeto
+        actual += c
+    partes.append(actual.decode('utf-8'))
+    return "\r\n ".join(partes) + "\r\n"
+
+def fecha_utc(valor):
+    return valor.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def evento(uid, inicio, fin, titulo, creado, descripcion=None, transparente=False):
+    lineas = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{fecha_utc(creado)}",
+        f"DTSTART:{fecha_utc(inicio)}",
+        f"DTEND:{fecha_utc(fin)}",
+        f"SUMMARY:{escapar(titulo)}",
+    ]
+    if descripcion:
+        lineas.append(f"DESCRIPTION:{escapar(descripcion)}")
+    if transparente:
+        lineas.append("TRANSP:TRANSPARENT")
+    lineas.append("END:VEVENT")
+    return "".join(plegar(l) for l in lineas)
+
+def generar_calendario(kx, ahora=None, tamano_bloque=500):
+    """
+    Generador del calendario del kinesiologo: sus citas y los horarios de su agenda sin cita, desde
+    DIAS_ATRAS días atrás hasta DIAS_ADELANTE días adelante. Lee la base con .iterator() por bloques,
+    así la memoria no crece con el tamaño de la agenda.
+    """
+    ahora = ahora or timezone.now()
+    desde, hasta = ahora - timedelta(days=DIAS_ATRAS), ahora + timedelta(days=DIAS_ADELANTE)
+
+    yield "".join(plegar(l) for l in [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escapar(f'Kineayuda - {kx.nombre} {kx.apellido}')}",
+    ])
+
+    citas = (cita.objects.filter(kinesiologo=kx, fecha_hora__gte=desde, fecha_hora__lt=hasta)
+             .exclude(estado='cancelada')
+             .values_list('id', 'fecha_hora', 'estado', 'estado_pago', 'nota', 'fecha_creacion',
+                          'paciente__nombre', 'paciente__apellido', 'paciente__telefono', 'cupo_agenda__fin')
+             .order_by('fecha_hora'))
+    for id_, inicio, estado, estado_pago, nota, creado, nombre, apellido, telefono, fin in citas.iterator(chunk_size=tamano_bloque):
+        descripcion = f"Estado: {estado} - Pago: {estado_pago}\nTeléfono: {telefono}"
+        if nota:
+            descripcion += f"\n{nota}"
+        yield evento(f"cita-{id_}@kineayuda", inicio, fin or inicio + timedelta(minutes=45),
+                     f"Cita con {nombre} {apellido}", creado, descripcion)
+
+    horarios = (agenda.objects.filter(kinesiologo=kx, inicio__gte=desde, inicio__lt=hasta,
+                                      estado__in=list(TITULOS_HORARIO), cita__isnull=True)
+                .values_list('id', 'inicio', 'fin', 'estado', 'fecha_creacion')
+                .order_by('inicio'))
+    for id_, inicio, fin, estado, creado in horarios.iterator(chunk_size=tamano_bloque):
+        yield evento(f"agenda-{id_}@kineayuda", inicio, fin, TITULOS_HORARIO[estado], creado, transparente=True)
+
+    yield plegar("END:VCALENDAR")
@@ -0,0 +1,126 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import agenda, cita, kinesiologo, metricaCitaDiaria, pagoCita
+
+CAMPOS = ['citas', 'pendientes', 'completadas', 'canceladas', 'horarios_ofrecidos', 'horarios_reservados', 'pagos', 'ingresos']
+
+# Días marcados en la transacción en curso de este thread; se recalculan una sola vez al confirmar
+_pendientes = threading.local()
+
+def inicio_del_dia(dia):
+    """Medianoche local (TIME_ZONE) del día, como datetime aware."""
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+def marcar_dias(pares):
+    """
+    Registra que cambiaron citas, horarios o pagos de estos [(kinesiologo_id, fecha_hora)]: los días locales
+    correspondientes de metricaCitaDiaria se recalculan al confirmar la transacción. Lo llaman las señales y
+    las rutas que escriben en bloque (bulk_create / update).
+    """
+    dias = {(kx_id, timezone.localdate(fecha)) for kx_id, fecha in pares if kx_id and fecha}
+    if not dias:
+        return
+    if not hasattr(_pendientes, 'dias'):
+        _pendientes.dias = set()
+    _pendientes.dias |= dias
+    # robust: la cita o el pago ya se confirmaron; si el recálculo falla se registra en el log (se repara con
+    # `manage.py reconstruir_metricas_citas`) en vez de responder 500, p. ej. en el retorno de Webpay
+    transaction.on_commit(_recalcular_pendientes, robust=True)
+
+def _recalcular_pendientes():
+    # Varias marcas en la misma transacción dejan varios callbacks: el primero hace todo el trabajo
+    dias, _pendientes.dias = getattr(_pendientes, 'dias', set()), set()
+    if dias:
+        recalcular_dias(dias)
+
+def agregar(kinesiologo_ids=None, desde=None, hasta=None):
+    """
+    Métricas por (kinesiologo_id, día) calculadas desde cita, agenda y pagoCita, con días en [desde, hasta).
+    Tres consultas agrupadas por día local, cada una sobre su índice (kinesiologo, fecha).
+    """
+    def rango(qs, campo):
+        if kinesiologo_ids is not None:
+            qs = qs.filter(kinesiologo_id__in=kinesiologo_ids)
+        if desde:
+            qs = qs.filter(**{f'{campo}__gte': inicio_del_dia(desde)})
+        if hasta:
+            qs = qs.filter(**{f'{campo}__lt': inicio_del_dia(hasta)})
+        return qs.annotate(dia=TruncDate(campo)).values('kinesiologo_id', 'dia')
+
+    filas = defaultdict(lambda: dict.fromkeys(CAMPOS, 0))
+    consultas = [
+        rango(cita.objects.all(), 'fecha_hora').annotate(
+            citas=Count('id'),
+            pendientes=Count('id', filter=Q(estado='pendiente')),
+            completadas=Count('id', filter=Q(estado='completada')),
+            canceladas=Count('id', filter=Q(estado='cancelada')),
+        ),
+        rango(agenda.objects.exclude(estado='no_disponible'), 'inicio').annotate(
+            horarios_ofrecidos=Count('id'),
+            horarios_reservados=Count('id', filter=Q(estado='reservado')),
+        ),
+        rango(pagoCita.objects.filter(estado='pagado', fecha_pago__isnull=False), 'fecha_pago').annotate(
+            pagos=Count('id'),
+            ingresos=Sum('monto'),
+        ),
+    ]
+    for consulta in consultas:
+        for fila in consulta:
+            filas[(fila.pop('kinesiologo_id'), fila.pop('dia'))].update(fila)
+    return filas
+
+def recalcular_dias(dias):
+    """
+    Recalcula y guarda (upsert) las filas de metricaCitaDiaria de estos [(kinesiologo_id, día)]; borra las que quedan vacías.
+    Cada kinesiologo se recalcula en una transacción con su fila bloqueada (FOR UPDATE) antes de leer: dos recálculos
+    de los mismos días quedan en fila y el último lee todo lo confirmado, así uno más viejo nunca escribe al final.
+    """
+    por_kx = defaultdict(set)
+    for kx_id, dia in dias:
+        por_kx[kx_id].add(dia)
+    for kx_id, dias_kx in sorted(por_kx.items()):
+        with transaction.atomic():
+            list(kinesiologo.objects.select_for_update().filter(id=kx_id).values_list('id'))  # serializa por kinesiologo
+            calculadas = agregar([kx_id], min(dias_kx), max(dias_kx) + timedelta(days=1))
+            filas, vacios = [], []
+            for dia in dias_kx:
+                valores = calculadas.get((kx_id, dia))
+                if valores:
+                    filas.append(metricaCitaDiaria(kinesiologo_id=kx_id, dia=dia, **valores))
+                else:
+                    vacios.append(dia)
+            if filas:
+                metricaCitaDiaria.objects.bulk_create(
+                    filas, update_conflicts=True, unique_fields=['kinesiologo', 'dia'], update_fields=CAMPOS,
+                )
+            if vacios:
+                metricaCitaDiaria.objects.filter(kinesiologo_id=kx_id, dia__in=vacios).delete()
+
+def reconstruir(kinesiologo_ids=None, tamano_bloque=200):
+    """
+    Recalcula metricaCitaDiaria desde cero (todos los kinesiologos o los de `kinesiologo_ids`),
+    de a `tamano_bloque` kinesiologos por transacción. Retorna cuántas filas escribió.
+    """
+    kxs = kinesiologo.objects.order_by('id')
+    if kinesiologo_ids is not None:
+        kxs = kxs.filter(id__in=kinesiologo_ids)
+    ids = list(kxs.values_list('id', flat=True))
+    escritas = 0
+    for i in range(0, len(ids), tamano_bloque):
+        bloque = ids[i:i + tamano_bloque]
+        filas = [
+            metricaCitaDiaria(kinesiologo_id=kx_id, dia=dia, **valores)
+            for (kx_id, dia), valores in agregar(bloque).items()
+        ]
+        with transaction.atomic():
+            metricaCitaDiaria.objects.filter(kinesiologo_id__in=bloque).delete()
+            metricaCitaDiaria.objects.bulk_create(filas, batch_size=1000)
+        escritas += len(filas)
+    return escritas
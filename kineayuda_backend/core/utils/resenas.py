@@ -0,0 +1,126 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from core.models import kinesiologo, metricaReseñaDiaria, resumenReseñas, reseña
+from core.utils import cache_publico
+
+# Lado de un cambio en que la reseña no existe (alta o baja). None es una reseña pendiente de analizar.
+AUSENTE = object()
+
+CAMPO_SENTIMIENTO = {
+    'positiva': 'positivas',
+    'neutral': 'neutrales',
+    'negativa': 'negativas',
+    None: 'pendientes',
+}
+
+def _score():
+    """(positivas - negativas) / analizadas sobre las columnas de la fila; NULL si no hay analizadas."""
+    analizadas = F('positivas') + F('neutrales') + F('negativas')
+    return Case(
+        When(Q(positivas__gt=0) | Q(neutrales__gt=0) | Q(negativas__gt=0),
+             then=Cast(F('positivas') - F('negativas'), FloatField()) / Cast(analizadas, FloatField())),
+        default=Value(None),
+        output_field=FloatField(),
+    )
+
+def _aplicar_deltas(modelo, deltas, campos_clave):
+    """UPDATE con F() de cada fila de `modelo` cuya llave (valores de `campos_clave`) tiene delta. Retorna las llaves tocadas."""
+    tocadas = []
+    for llave, delta in deltas.items():
+        campos = {campo: F(campo) + valor for campo, valor in delta.items() if valor}
+        if campos:
+            modelo.objects.filter(**dict(zip(campos_clave, llave))).update(**campos)
+            tocadas.append(llave)
+    return tocadas
+
+def registrar_cambios(cambios):
+    """
+    Aplica a resumenReseñas y metricaReseñaDiaria una lista de cambios [(kinesiologo_id, fecha_cita, antes, despues)],
+    donde antes/despues es el sentimiento de la reseña o AUSENTE. Suma los deltas por kinesiologo (y por día) y hace
+    un UPDATE con F() por fila, así escrituras concurrentes no se pisan. Se debe llamar dentro de la transacción
+    que escribe las reseñas; también invalida el caché de las vistas públicas que las muestran.
+    """
+    por_dia = defaultdict(Counter)
+    for kx_id, fecha_cita, antes, despues in cambios:
+        delta = por_dia[(kx_id, timezone.localdate(fecha_cita))]
+        if antes is not AUSENTE:
+            delta[CAMPO_SENTIMIENTO[antes]] -= 1
+            delta['total'] -= 1
+        if despues is not AUSENTE:
+            delta[CAMPO_SENTIMIENTO[despues]] += 1
+            delta['total'] += 1
+    por_kx = defaultdict(Counter)
+    for (kx_id, _), delta in por_dia.items():
+        por_kx[(kx_id,)].update(delta)
+
+    # Solo las altas crean filas: una baja en cascada del kinesiologo no debe volver a insertarlas
+    nuevos = [kx_id for (kx_id,), delta in por_kx.items() if delta['total'] > 0]
+    if nuevos:
+        resumenReseñas.objects.bulk_create([resumenReseñas(kinesiologo_id=k) for k in nuevos], ignore_conflicts=True)
+    dias_nuevos = [llave for llave, delta in por_dia.items() if delta['total'] > 0]
+    if dias_nuevos:
+        metricaReseñaDiaria.objects.bulk_create(
+            [metricaReseñaDiaria(kinesiologo_id=k, dia=d) for k, d in dias_nuevos], ignore_conflicts=True
+        )
+
+    _aplicar_deltas(metricaReseñaDiaria, por_dia, ('kinesiologo_id', 'dia'))
+    tocados = [kx_id for (kx_id,) in _aplicar_deltas(resumenReseñas, por_kx, ('kinesiologo_id',))]
+    if tocados:
+        # El score se calcula aparte porque en un mismo UPDATE las columnas tienen el valor previo
+        resumenReseñas.objects.filter(kinesiologo_id__in=tocados).update(score_promedio=_score())
+
+    # Cambiaron las reseñas públicas de estos kinesiologos y su score en el directorio
+    if por_kx:
+        cache_publico.invalidar(cache_publico.RESENAS, [kx_id for (kx_id,) in por_kx])
+        cache_publico.invalidar(cache_publico.DIRECTORIO)
+
+def estado_anterior(instancia):
+    """(kinesiologo_id, fecha de la cita, sentimiento) de la reseña tal como está en la base, o AUSENTE si es nueva."""
+    if instancia._state.adding:
+        return AUSENTE
+    original = getattr(instancia, '_original', None)
+    if original is not None and original[0] == instancia.cita_id:
+        return instancia.cita.kinesiologo_id, instancia.cita.fecha_hora, original[1]
+    # Instancia armada a mano o con campos diferidos: se lee de la base
+    fila = (reseña.objects.filter(pk=instancia.pk)
+            .values_list('cita__kinesiologo_id', 'cita__fecha_hora', 'sentimiento').first())
+    return fila if fila is not None else AUSENTE
+
+def _conteos(qs):
+    return qs.annotate(
+        total=Count('id'),
+        positivas=Count('id', filter=Q(sentimiento='positiva')),
+        neutrales=Count('id', filter=Q(sentimiento='neutral')),
+        negativas=Count('id', filter=Q(sentimiento='negativa')),
+        pendientes=Count('id', filter=Q(sentimiento__isnull=True)),
+    )
+
+def reconstruir(kinesiologo_ids=None):
+    """
+    Recalcula desde cero resumenReseñas y metricaReseñaDiaria agregando las reseñas (todas o las de
+    `kinesiologo_ids`). Deja una fila de resumen por kinesiologo, aunque no tenga reseñas.
+    Retorna (resúmenes, días) escritos.
+    """
+    kxs = kinesiologo.objects.all()
+    if kinesiologo_ids is not None:
+        kxs = kxs.filter(id__in=kinesiologo_ids)
+    reseñas = reseña.objects.filter(cita__kinesiologo__in=kxs)
+
+    por_kx = {fila.pop('cita__kinesiologo_id'): fila for fila in _conteos(reseñas.values('cita__kinesiologo_id'))}
+    filas = [resumenReseñas(kinesiologo_id=kx_id, **por_kx.get(kx_id, {})) for kx_id in kxs.values_list('id', flat=True)]
+    dias = [
+        metricaReseñaDiaria(kinesiologo_id=fila.pop('cita__kinesiologo_id'), **fila)
+        for fila in _conteos(reseñas.annotate(dia=TruncDate('cita__fecha_hora')).values('cita__kinesiologo_id', 'dia'))
+    ]
+    with transaction.atomic():
+        resumenReseñas.objects.filter(kinesiologo__in=kxs).delete()
+        resumenReseñas.objects.bulk_create(filas, batch_size=1000)
+        resumenReseñas.objects.filter(kinesiologo__in=kxs).update(score_promedio=_score())
+        metricaReseñaDiaria.objects.filter(kinesiologo__in=kxs).delete()
+        metricaReseñaDiaria.objects.bulk_create(dias, batch_size=1000)
+    return len(filas), len(dias)
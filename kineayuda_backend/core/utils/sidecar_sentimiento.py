@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Protocolo: una línea JSON por mensaje.
+#   cliente -> {"textos": ["...", ...]}
+#   sidecar -> {"sentimientos": ["positiva", ...]}  o  {"error": "..."}
+MAX_LINEA = 4 * 1024 * 1024
+
+class SidecarNoDisponible(Exception):
+    pass
+
+def ruta_socket():
+    return getattr(settings, 'SENTIMIENTO_SIDECAR_SOCKET', None)
+
+# Si el sidecar no responde, no se reintenta durante unos segundos para no pagar un connect fallido por reseña
+_no_disponible_hasta = 0.0
+_lock_estado = threading.Lock()
+
+def inferir_remoto(textos):
+    """Envía los textos al sidecar y retorna sus etiquetas. Lanza SidecarNoDisponible si no hay sidecar."""
+    global _no_disponible_hasta
+    ruta = ruta_socket()
+    if not ruta or time.monotonic() < _no_disponible_hasta:
+        raise SidecarNoDisponible()
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(getattr(settings, 'SENTIMIENTO_SIDECAR_TIMEOUT', 30))
+            sock.connect(ruta)
+            with sock.makefile('rwb') as canal:
+                canal.write(json.dumps({"textos": list(textos)}).encode('utf-8') + b"\n")
+                canal.flush()
+                respuesta = json.loads(canal.readline(MAX_LINEA) or b"{}")
+    except (OSError, ValueError) as e:
+        with _lock_estado:
+            _no_disponible_hasta = time.monotonic() + getattr(settings, 'SENTIMIENTO_SIDECAR_REINTENTO_S', 5)
+        logger.info("Sidecar de sentimiento no disponible en %s (%s); se usa inferencia local.", ruta, e)
+        raise SidecarNoDisponible() from e
+
+    sentimientos = respuesta.get("sentimientos")
+    if not isinstance(sentimientos, list) or len(sentimientos) != len(textos):
+        logger.warning("Respuesta inválida del sidecar de sentimiento: %s", respuesta.get("error", respuesta))
+        raise SidecarNoDisponible()
+    return sentimientos
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        from core.modulo_ia import inferir_local
+
+        while True:
+            linea = self.rfile.readline(MAX_LINEA)
+            if not linea:
+                return
+            try:
+                textos = json.loads(linea)["textos"]
+                if not isinstance(textos, list) or not all(isinstance(t, str) for t in textos):
+                    raise ValueError("'textos' debe ser una lista de strings")
+                respuesta = {"sentimientos": inferir_local(textos)}
+            except Exception as e:
+                logger.exception("Error en el sidecar de sentimiento")
+                respuesta = {"error": str(e)}
+            self.wfile.write(json.dumps(respuesta).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+class ServidorSentimiento(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Un hilo por conexión; las llamadas individuales se juntan en la cola de micro-batching del proceso."""
+    daemon_threads = True
+
+    def __init__(self, ruta):
+        if os.path.exists(ruta):
+            os.unlink(ruta)  # socket de una ejecución anterior
+        super().__init__(ruta, _Handler)
+        os.chmod(ruta, 0o660)
@@ -0,0 +1,49 @@
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from core.models import kinesiologo, pagoSuscripcion
+
+def _ultimo_vencimiento_pagado():
+    """Subquery con el vencimiento más lejano entre los pagos 'pagado' del kinesiologo externo."""
+    return (pagoSuscripcion.objects
+            .filter(kinesiologo=OuterRef('pk'), estado='pagado', fecha_expiracion__isnull=False)
+            .order_by('-fecha_expiracion')
+            .values('fecha_expiracion')[:1])
+
+def registrar_pago_suscripcion(kinesiologo_id, fecha_expiracion):
+    """
+    Extiende kinesiologo.suscripcion_vence_en con un pago aprobado. Es un solo UPDATE atómico que nunca
+    acorta el vencimiento, aunque lleguen dos retornos de Webpay al mismo tiempo.
+    """
+    return kinesiologo.objects.filter(id=kinesiologo_id).update(
+        suscripcion_vence_en=Greatest(Coalesce('suscripcion_vence_en', fecha_expiracion), fecha_expiracion)
+    )
+
+def sincronizar_vencidas(ahora=None):
+    """
+    Barrido de expiración: a los kinesiologos con la suscripción vencida (o sin vencimiento registrado) que
+    tienen un pago posterior que no alcanzó a reflejarse se les recalcula el vencimiento desde el historial.
+    Los vencidos sin pago nuevo no se tocan (suscripcion_activa ya es False). Retorna cuántos corrigió.
+    """
+    ahora = ahora or timezone.now()
+    # Con suscripcion_vence_en NULL la comparación fecha_expiracion > NULL nunca es verdadera: cualquier pago cuenta
+    pago_posterior = pagoSuscripcion.objects.filter(
+        Q(fecha_expiracion__gt=OuterRef('suscripcion_vence_en')) | Q(kinesiologo__suscripcion_vence_en__isnull=True),
+        kinesiologo=OuterRef('pk'), estado='pagado', fecha_expiracion__isnull=False,
+    )
+    vencidas = Q(suscripcion_vence_en__lte=ahora) | Q(suscripcion_vence_en__isnull=True)
+    return kinesiologo.objects.filter(vencidas).filter(Exists(pago_posterior)).update(
+        suscripcion_vence_en=Subquery(_ultimo_vencimiento_pagado())
+    )
+
+def inconsistencias():
+    """Kinesiologos cuyo suscripcion_vence_en no coincide con su historial de pagos."""
+    return [
+        kx for kx in kinesiologo.objects.annotate(esperado=Subquery(_ultimo_vencimiento_pagado()))
+                                        .only('id', 'suscripcion_vence_en')
+        if kx.suscripcion_vence_en != kx.esperado
+    ]
+
+def reconstruir_vencimientos():
+    """Recalcula suscripcion_vence_en de todos los kinesiologos desde los pagos."""
+    return kinesiologo.objects.update(suscripcion_vence_en=Subquery(_ultimo_vencimiento_pagado()))
@@ -1,33 +1,76 @@
+import hashlib
+import logging
+import secrets
 import uuid
+from collections import defaultdict
+from urllib.parse import urlencode
 from django.shortcuts import render
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import Q, Count, Case, When, FloatField, Avg
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from django.db import connection, transaction
+from django.db.models import Case, When, FloatField, Value, F, Sum
+from django.db.models.functions import TruncWeek, TruncMonth, Coalesce
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.shortcuts import redirect, get_object_or_404
+from django.http import Http404, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets, status, mixins
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import kinesiologo, paciente, cita, reseña, agenda, metodoPago, pagoSuscripcion, documentoVerificacion, pagoCita
-from firebase_admin import auth
+from .models import (kinesiologo, paciente, cita, reseña, agenda, metodoPago, pagoSuscripcion, documentoVerificacion, pagoCita,
+                     resumenReseñas, metricaReseñaDiaria, metricaCitaDiaria)
 from .serializer import (kinesiologoSerializer, pacienteSerializer, citaSerializer, reseñaSerializer, agendaSerializer, metodoPagoSerializer, 
-                         documentoVerificacionSerializer, kinesiologoFotoSerializer, KinesiologoRegistroSerializer, CitaPublicaSerializer, ReseñaPublicaSerializer)
+                         documentoVerificacionSerializer, kinesiologoFotoSerializer, KinesiologoRegistroSerializer, CitaPublicaSerializer, ReseñaPublicaSerializer,
+                         PlantillaAgendaSerializer, KinesiologoDirectorioSerializer)
+from .authentication import verificar_id_token, revocar_sesiones
 from .utils.auth_helpers import get_kinesiologo_from_request, kinesio_tiene_suscripcion_activa
 from .utils.rut import normalizar_rut
-from .payments.webpay import create_transaction, commit_transaction
+from .utils.suscripciones import registrar_pago_suscripcion
+from .utils.ical import generar_calendario
+from .utils.metricas import CAMPOS as METRICAS_CITA
+from .utils.busqueda import normalizar, filtrar_postgres, buscar_en_memoria, umbral as umbral_busqueda
+from .utils.agenda import (publicar_plantilla, hay_solapamiento, guardar_sin_solapar, HorarioSolapado,
+                           parsear_fecha_hora, codificar_cursor, decodificar_cursor, horas_disponibles, version_horas_disponibles,
+                           buscar_disponibilidad, tomar_horario, retener_horario, confirmar_retencion, liberar_retencion,
+                           HorarioNoDisponible)
+from .payments.webpay import create_transaction, commit_transaction, refund_transaction
 from .permissions import TieneSuscripcionActiva, EsKinesiologoVerificado
+from .pagination import DirectorioPagination
 from dateutil.relativedelta import relativedelta
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
+def _agrupar_por_periodo(qs, granularidad):
+    """Anota `periodo` sobre una tabla de métricas diarias (columna `dia`): semana y mes se derivan de los días."""
+    if granularidad == 'dia':
+        return qs.annotate(periodo=F('dia'))
+    if granularidad == 'semana':
+        return qs.annotate(periodo=TruncWeek('dia'))
+    return qs.annotate(periodo=TruncMonth('dia'))  # 'mes' por defecto
+
+def _ocupacion(valores):
+    """Horarios reservados / ofrecidos, o None si no se ofrecieron horarios."""
+    ofrecidos = valores["horarios_ofrecidos"]
+    return valores["horarios_reservados"] / ofrecidos if ofrecidos else None
+
+def _periodo_iso(periodo, granularidad):
+    """Fechas a string (ISO) para que el front pinte fácil: 'dia' como fecha, semana y mes como datetime local."""
+    if granularidad == 'dia':
+        return periodo.isoformat()
+    return timezone.make_aware(datetime.combine(periodo, time.min)).isoformat()
+
 class kinesiologoViewSet(viewsets.ModelViewSet):
     serializer_class = kinesiologoSerializer
     permission_classes = [IsAuthenticated]
@@ -61,6 +104,21 @@ class kinesiologoViewSet(viewsets.ModelViewSet):
         ser.save()
         return Response(ser.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get', 'post'], url_path='calendario')
+    def calendario(self, request):
+        """
+        GET: URL privada del calendario iCal del kinesiologo (se crea la primera vez).
+        POST: genera una URL nueva; la anterior deja de funcionar.
+        """
+        kx = get_kinesiologo_from_request(request)
+        if not kx:
+            return Response({'error': 'Kinesiologo no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+        if request.method == 'POST' or not kx.ical_token:
+            kx.ical_token = secrets.token_urlsafe(32)
+            kx.save(update_fields=['ical_token'])
+        url = request.build_absolute_uri(reverse('calendario-ical', args=[kx.ical_token]))
+        return Response({'url': url}, status=status.HTTP_200_OK)
+
     @action(
         detail=False,
         methods=['post'],
@@ -103,71 +161,112 @@ class kinesiologoViewSet(viewsets.ModelViewSet):
         fecha_desde = request.query_params.get('desde')
         fecha_hasta = request.query_params.get('hasta')
 
-        # Base: todas las reseñas de este kinesiólogo
-        qs = reseña.objects.filter(cita__kinesiologo=kx)
+        # Base: métricas diarias de este kinesiólogo (una fila por día con reseñas, ver core/utils/resenas.py)
+        qs = metricaReseñaDiaria.objects.filter(kinesiologo=kx, total__gt=0)
 
-        # Filtrar por rango de fechas (según fecha de la cita)
+        # Filtrar por rango de fechas (día de la cita)
         if fecha_desde:
-            qs = qs.filter(cita__fecha_hora__date__gte=fecha_desde)
+            qs = qs.filter(dia__gte=fecha_desde)
         if fecha_hasta:
-            qs = qs.filter(cita__fecha_hora__date__lte=fecha_hasta)
+            qs = qs.filter(dia__lte=fecha_hasta)
 
         # Elegir cómo agrupar (día, semana o mes)
-        if granularidad == 'dia':
-            qs = qs.annotate(periodo=TruncDay('cita__fecha_hora'))
-        elif granularidad == 'semana':
-            qs = qs.annotate(periodo=TruncWeek('cita__fecha_hora'))
-        else:  # 'mes' por defecto
-            qs = qs.annotate(periodo=TruncMonth('cita__fecha_hora'))
-
-        # Score de satisfacción: positiva = +1, neutral = 0, negativa = -1
-        qs = qs.annotate(
-            score_val=Case(
-                When(sentimiento='positiva', then=1.0),
-                When(sentimiento='neutral', then=0.0),
-                When(sentimiento='negativa', then=-1.0),
-                output_field=FloatField(),
-            )
-        )
+        qs = _agrupar_por_periodo(qs, granularidad)
 
-        # Agregación por período
+        # Agregación por período; el resumen global se suma de las mismas filas (una sola consulta)
         agg = (
             qs.values('periodo')
               .annotate(
-                  total=Count('id'),
-                  positivas=Count('id', filter=Q(sentimiento='positiva')),
-                  neutrales=Count('id', filter=Q(sentimiento='neutral')),
-                  negativas=Count('id', filter=Q(sentimiento='negativa')),
-                  score_promedio=Avg('score_val'),
+                  n_total=Sum('total'),
+                  n_positivas=Sum('positivas'),
+                  n_neutrales=Sum('neutrales'),
+                  n_negativas=Sum('negativas'),
+                  n_pendientes=Sum('pendientes'),
               )
               .order_by('periodo')
         )
 
-        # Resumen global
-        total = qs.count()
-        positivas_total = qs.filter(sentimiento='positiva').count()
-        neutrales_total = qs.filter(sentimiento='neutral').count()
-        negativas_total = qs.filter(sentimiento='negativa').count()
-
         resumen = {
-            "total_reseñas": total,
-            "positivas": positivas_total,
-            "neutrales": neutrales_total,
-            "negativas": negativas_total,
+            "total_reseñas": 0,
+            "positivas": 0,
+            "neutrales": 0,
+            "negativas": 0,
+            "pendientes": 0, # Reseñas aún sin analizar (modo asíncrono): cuentan en el total pero no en el score
         }
+        series = []
+        for item in agg:
+            positivas, neutrales, negativas = item["n_positivas"], item["n_neutrales"], item["n_negativas"]
+            analizadas = positivas + neutrales + negativas
+            series.append({
+                "periodo": _periodo_iso(item["periodo"], granularidad),
+                "total": item["n_total"],
+                "positivas": positivas,
+                "neutrales": neutrales,
+                "negativas": negativas,
+                "pendientes": item["n_pendientes"],
+                # Score de satisfacción: positiva = +1, neutral = 0, negativa = -1
+                "score_promedio": (positivas - negativas) / analizadas if analizadas else None,
+            })
+            resumen["total_reseñas"] += item["n_total"]
+            resumen["positivas"] += positivas
+            resumen["neutrales"] += neutrales
+            resumen["negativas"] += negativas
+            resumen["pendientes"] += item["n_pendientes"]
 
-        # Serializar fechas a string (ISO) para que el front pinte fácil
-        series = [
+        return Response(
             {
-                "periodo": item["periodo"].date().isoformat() if granularidad == "dia" else item["periodo"].isoformat(),
-                "total": item["total"],
-                "positivas": item["positivas"],
-                "neutrales": item["neutrales"],
-                "negativas": item["negativas"],
-                "score_promedio": item["score_promedio"],
-            }
-            for item in agg
-        ]
+                "granularidad": granularidad,
+                "resumen": resumen,
+                "series": series,
+            },
+            status=200,
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='metricas-citas',
+        permission_classes=[IsAuthenticated],
+    )
+    def metricas_citas(self, request):
+        """
+        GET /api/kinesiologos/metricas-citas/?granularidad=semana&desde=2025-01-01&hasta=2025-12-31
+
+        Citas por estado, ocupación de la agenda (horarios reservados / ofrecidos) e ingresos de pagos de cita.
+        granularidad: 'dia' | 'semana' | 'mes' (por defecto: 'mes')
+        desde / hasta: YYYY-MM-DD (opcionales)
+        """
+        kx = get_kinesiologo_from_request(request)
+        if not kx:
+            return Response({"detail": "Kinesiólogo no encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        granularidad = request.query_params.get('granularidad', 'mes')
+        fecha_desde = request.query_params.get('desde')
+        fecha_hasta = request.query_params.get('hasta')
+
+        # Métricas diarias ya agregadas (core/utils/metricas.py): una fila por día con actividad
+        qs = metricaCitaDiaria.objects.filter(kinesiologo=kx)
+        if fecha_desde:
+            qs = qs.filter(dia__gte=fecha_desde)
+        if fecha_hasta:
+            qs = qs.filter(dia__lte=fecha_hasta)
+
+        agg = (
+            _agrupar_por_periodo(qs, granularidad)
+            .values('periodo')
+            .annotate(**{f'n_{campo}': Sum(campo) for campo in METRICAS_CITA})
+            .order_by('periodo')
+        )
+
+        resumen = dict.fromkeys(METRICAS_CITA, 0)
+        series = []
+        for item in agg:
+            valores = {campo: item[f'n_{campo}'] for campo in METRICAS_CITA}
+            for campo, valor in valores.items():
+                resumen[campo] += valor
+            series.append({"periodo": _periodo_iso(item["periodo"], granularidad), **valores,
+                           "ocupacion": _ocupacion(valores)})
+        resumen["ocupacion"] = _ocupacion(resumen)
 
         return Response(
             {
@@ -225,23 +324,71 @@ class CrearReseñaPorCitaView(APIView):
             "mensaje": "Reseña creada exitosamente.",
             "reseña_id": reseña_obj.id,
             "sentimiento": reseña_obj.sentimiento,
+            "sentimiento_pendiente": reseña_obj.sentimiento is None,
         },
         status=status.HTTP_201_CREATED)
 
 class KinesiologosPublicosView(ListAPIView):
-    """Vista pública para listar todos los kinesiologos aprobados."""
-    serializer_class = kinesiologoSerializer
+    """
+    Directorio público de kinesiologos aprobados, paginado por cursor (?cursor=..., ?limite=...).
+    ?q= busca en nombre, apellido y especialidad tolerando errores de tipeo y tildes; ordena por relevancia.
+    ?orden=rating ordena por score de reseñas (sin reseñas analizadas al final); ?rating_min= filtra por score (-1 a 1).
+    """
+    serializer_class = KinesiologoDirectorioSerializer
+    pagination_class = DirectorioPagination
     permission_classes = [AllowAny]
+    max_resultados_en_memoria = 500 #Tope de resultados de ?q= sin PostgreSQL
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('q') and connection.vendor == 'postgresql':
+            # El umbral del operador %> de pg_trgm es un parámetro de sesión: se fija solo para esta transacción
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(umbral_busqueda())])
+                return super().list(request, *args, **kwargs)
+        return super().list(request, *args, **kwargs)
+
+    def _buscar(self, qset, q):
+        consulta = normalizar(q)
+        if connection.vendor == 'postgresql':
+            return filtrar_postgres(qset, consulta)
+        #Sin pg_trgm: índice de trigramas en memoria, mejores resultados primero
+        encontrados = buscar_en_memoria(consulta)[:self.max_resultados_en_memoria]
+        if not encontrados:
+            return qset.none().annotate(relevancia=Value(0.0, output_field=FloatField()))
+        #Un When por puntaje distinto (son pocos), no uno por kinesiologo
+        por_puntaje = defaultdict(list)
+        for id_, puntaje in encontrados:
+            por_puntaje[puntaje].append(id_)
+        return qset.filter(id__in=[id_ for id_, _ in encontrados]).annotate(relevancia=Case(
+            *[When(id__in=ids, then=Value(puntaje)) for puntaje, ids in por_puntaje.items()], output_field=FloatField(),
+        ))
 
     def get_queryset(self):
-        especialidad = self.request.query_params.get('especialidad')
-        qset = kinesiologo.objects.filter(estado_verificacion='aprobado')
+        params = self.request.query_params
+        especialidad = params.get('especialidad')
+        qset = (kinesiologo.objects.filter(estado_verificacion='aprobado')
+                .select_related('resumen_resenas')
+                .only('id', 'nombre', 'apellido', 'especialidad', 'foto_perfil',
+                      'resumen_resenas__score_promedio', 'resumen_resenas__total'))
         if especialidad:
             qset = qset.filter(especialidad__iexact=especialidad)
+        q = params.get('q', '').strip()
+        if q:
+            qset = self._buscar(qset, q)
+        rating_min = params.get('rating_min')
+        if params.get('orden') == 'rating' or rating_min:
+            #Misma expresión que el índice resumen_resenas_rating
+            qset = qset.annotate(rating=Coalesce('resumen_resenas__score_promedio', Value(resumenReseñas.SIN_SCORE)))
+        if rating_min:
+            try:
+                qset = qset.filter(rating__gte=float(rating_min))
+            except ValueError:
+                raise ValidationError({'rating_min': 'Debe ser un número entre -1 y 1.'})
         return qset
 
 class ReseñasPublicasView(ListAPIView):
-    """Vista pública para listar todas las reseñas."""
+    """Vista pública para listar todas las reseñas. Las aún no analizadas vienen con sentimiento null y sentimiento_pendiente=True."""
     permission_classes = [AllowAny]
 
     def get(self, request, kinesiologo_id):
@@ -251,16 +398,92 @@ class ReseñasPublicasView(ListAPIView):
 
 class HorasDisponiblesView(APIView):
     permission_classes = [AllowAny]
-    
+    limite_por_defecto = 100
+    limite_maximo = 500
+
     def get(self, request, kinesiologo_id):
-        """Devuelve las horas disponibles para reserva de un kinesiologo específico."""
+        """
+        Devuelve las horas disponibles para reserva de un kinesiologo específico, ordenadas por inicio.
+
+        desde / hasta: ventana sobre el inicio (ISO 8601 o YYYY-MM-DD, opcionales)
+        limite: horarios por página (por defecto 100, máximo 500)
+        cursor: página siguiente, viene en el header Link rel="next"
+        Responde 304 si el ETag / Last-Modified del cliente sigue vigente.
+        """
         ahora = timezone.now()
-        slots = agenda.objects.filter(kinesiologo_id=kinesiologo_id, estado='disponible', inicio__gte=ahora).order_by('inicio')
-        data = [{
-            'id': slot.id,
-            'inicio': slot.inicio,
-            'fin': slot.fin
-        } for slot in slots]
+        try:
+            desde = parsear_fecha_hora(request.query_params.get('desde'))
+            hasta = parsear_fecha_hora(request.query_params.get('hasta'), fin_de_dia=True)
+            limite = int(request.query_params.get('limite', self.limite_por_defecto))
+            cursor = request.query_params.get('cursor')
+            despues_de = decodificar_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return Response({'error': str(e) or 'Parámetros inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+        limite = max(1, min(limite, self.limite_maximo))
+
+        existe, version = version_horas_disponibles(kinesiologo_id, ahora)
+        if not existe:
+            return Response([], status=status.HTTP_200_OK)
+
+        parametros = urlencode(sorted(request.query_params.items()))
+        marca = version.isoformat() if version else ''
+        etag = '"%s"' % hashlib.md5(f"{kinesiologo_id}|{marca}|{parametros}".encode()).hexdigest()
+        last_modified = int(version.timestamp()) if version else None
+        no_modificado = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if no_modificado is not None:
+            return self._cabeceras_cache(no_modificado, etag, last_modified)
+
+        filas = horas_disponibles(kinesiologo_id, max(desde or ahora, ahora), hasta, despues_de, limite + 1)
+        data = [{'id': id_, 'inicio': inicio, 'fin': fin} for id_, inicio, fin in filas[:limite]]
+        response = Response(data, status=status.HTTP_200_OK)
+        if len(filas) > limite:
+            ultimo_id, ultimo_inicio, _ = filas[limite - 1]
+            siguiente = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                            codificar_cursor(ultimo_inicio, ultimo_id))
+            response['Link'] = f'<{siguiente}>; rel="next"'
+        return self._cabeceras_cache(response, etag, last_modified)
+
+    def _cabeceras_cache(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # El navegador / CDN puede guardarla, pero debe revalidar en cada uso
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+class DisponibilidadPublicaView(APIView):
+    permission_classes = [AllowAny]
+    ventana_maxima = timedelta(days=31)
+
+    def get(self, request):
+        """
+        Busca kinesiologos con horas disponibles, con sus primeras horas libres.
+
+        especialidad: filtro exacto, sin distinguir mayúsculas (opcional)
+        desde / hasta: ventana sobre el inicio (ISO 8601 o YYYY-MM-DD; por defecto, los próximos 7 días, máximo 31)
+        duracion_min: duración mínima de la hora en minutos
+        por_kinesiologo: horas por kinesiologo (por defecto 3, máximo 10)
+        limite: kinesiologos (por defecto 20, máximo 50)
+        orden: 'nombre' (por defecto) | 'pronto' (primera hora libre)
+        """
+        ahora = timezone.now()
+        params = request.query_params
+        try:
+            desde = max(parsear_fecha_hora(params.get('desde')) or ahora, ahora)
+            hasta = parsear_fecha_hora(params.get('hasta'), fin_de_dia=True) or desde + timedelta(days=7)
+            duracion_min = max(0, int(params.get('duracion_min', 0)))
+            por_kinesiologo = max(1, min(int(params.get('por_kinesiologo', 3)), 10))
+            limite = max(1, min(int(params.get('limite', 20)), 50))
+        except ValueError as e:
+            return Response({'error': str(e) or 'Parámetros inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+        orden = params.get('orden', 'nombre')
+        if orden not in ('nombre', 'pronto'):
+            return Response({'error': "orden debe ser 'nombre' o 'pronto'."}, status=status.HTTP_400_BAD_REQUEST)
+        if hasta - desde > self.ventana_maxima:
+            return Response({'error': 'La ventana de búsqueda no puede superar 31 días.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = buscar_disponibilidad(desde, hasta, params.get('especialidad'), duracion_min,
+                                     por_kinesiologo, limite, orden)
         return Response(data, status=status.HTTP_200_OK)
 
 class AgendaViewSet(viewsets.ModelViewSet):
@@ -272,7 +495,7 @@ class AgendaViewSet(viewsets.ModelViewSet):
         Lectura (list/retrieve): solo autenticación.
         Mutaciones (create/update/partial_update/destroy): requiere suscripción activa.
         """
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'plantilla']:
             return [IsAuthenticated(), EsKinesiologoVerificado(),TieneSuscripcionActiva()]
         return [IsAuthenticated(), EsKinesiologoVerificado()]
 
@@ -295,22 +518,59 @@ class AgendaViewSet(viewsets.ModelViewSet):
         inicio = serializer.validated_data['inicio']
         fin = serializer.validated_data['fin']
 
-        # Validar solapamiento
-        solapa = agenda.objects.filter(
-            kinesiologo=kx,
-            estado__in=['disponible', 'reservado', 'no_disponible'],
-        ).filter(
-            Q(inicio__lt=fin) & Q(fin__gt=inicio)
-        ).exists()
+        # Validar solapamiento (en PostgreSQL además lo garantiza la restricción de exclusión)
+        if hay_solapamiento(kx.id, inicio, fin):
+            raise ValidationError("El horario solapa con otro existente.")
 
-        if solapa:
+        try:
+            guardar_sin_solapar(lambda: serializer.save(kinesiologo=kx, estado='disponible'))
+        except HorarioSolapado:
             raise ValidationError("El horario solapa con otro existente.")
 
-        serializer.save(kinesiologo=kx, estado='disponible')
+    def perform_update(self, serializer):
+        instancia = serializer.instance
+        inicio = serializer.validated_data.get('inicio', instancia.inicio)
+        fin = serializer.validated_data.get('fin', instancia.fin)
+        if instancia.estado in agenda.ESTADOS_ACTIVOS and hay_solapamiento(instancia.kinesiologo_id, inicio, fin, excluir_id=instancia.id):
+            raise ValidationError("El horario solapa con otro existente.")
+        try:
+            guardar_sin_solapar(serializer.save)
+        except HorarioSolapado:
+            raise ValidationError("El horario solapa con otro existente.")
+
+    @action(detail=False, methods=['post'], url_path='plantilla')
+    def plantilla(self, request):
+        """
+        POST /api/agendas/plantilla/
+        { "dias": [0,1,2,3,4], "hora_inicio": "09:00", "hora_fin": "13:00", "duracion_minutos": 45, "semanas": 8 }
+
+        Publica todos los bloques de una vez. Los que solapan con horarios existentes o ya pasaron se omiten.
+        """
+        kx = get_kinesiologo_from_request(request)
+        if not kx:
+            raise PermissionDenied("Kinesiólogo no autenticado.")
+        if not kinesio_tiene_suscripcion_activa(kx):
+            raise PermissionDenied("Necesitas una suscripción activa para publicar disponibilidad.")
+
+        ser = PlantillaAgendaSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        try:
+            resultado = publicar_plantilla(kx, **ser.validated_data)
+        except HorarioSolapado:
+            return Response({"error": "Otro horario se publicó al mismo tiempo. Intenta nuevamente."},
+                            status=status.HTTP_409_CONFLICT)
+
+        return Response({
+            "creados": len(resultado['creados']),
+            "omitidos": len(resultado['omitidos']),
+            "detalle_omitidos": resultado['omitidos'],
+        }, status=status.HTTP_201_CREATED)
 
     def perform_destroy(self, instance):
         if instance.estado == 'reservado':
             raise ValidationError("No se puede eliminar un horario reservado. Cancele la cita primero.")
+        if instance.estado == 'retenido' and instance.retenido_hasta and instance.retenido_hasta > timezone.now():
+            raise ValidationError("No se puede eliminar un horario mientras un paciente lo está pagando.")
         instance.delete()
 
 class AgendarCitaView(APIView):
@@ -323,14 +583,13 @@ class AgendarCitaView(APIView):
         slot_id = request.data.get('id')
         if not slot_id:
             return Response({'error': 'slot_id es requerido.'}, status=status.HTTP_400_BAD_REQUEST)
+        #Bloquear el cupo: si otro paciente lo está tomando en este momento, falla de inmediato
         try:
-            slot = agenda.objects.select_for_update().get(id=slot_id)
+            slot = tomar_horario(slot_id)
         except agenda.DoesNotExist:
             return Response({'error': 'Cupo no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        #Validar que el cupo esta disponible
-        if slot.estado != 'disponible' or slot.inicio < timezone.now():
-            return Response({'error': 'Cupo no disponible para reserva.'}, status=status.HTTP_400_BAD_REQUEST)
+        except HorarioNoDisponible:
+            return Response({'error': 'Cupo no disponible para reserva.'}, status=status.HTTP_409_CONFLICT)
         
         #Crear o reutilizar paciente según el RUT
         rut = request.data.get('rut')
@@ -353,10 +612,35 @@ class AgendarCitaView(APIView):
         slot.estado = 'reservado'
         slot.paciente = paciente_obj
         slot.cita = nueva_cita
+        slot.retenido_hasta = None
         slot.save()
 
         return Response({'mensaje': 'Cita agendada exitosamente.', 'cita': citaSerializer(nueva_cita).data}, status=status.HTTP_201_CREATED)
 
+@require_GET
+def calendario_ical(request, token):
+    """
+    Calendario iCal del kinesiologo dueño del token (Google Calendar, Outlook, etc.). Se genera en streaming
+    y responde 304 si no cambió nada desde la última consulta del cliente.
+    """
+    kx = (kinesiologo.objects.filter(ical_token=token)
+          .only('id', 'nombre', 'apellido', 'agenda_actualizada_en').first())
+    if not kx:
+        raise Http404()
+
+    version = kx.agenda_actualizada_en
+    etag = '"%s"' % hashlib.md5(f"{token}|{version.isoformat() if version else ''}".encode()).hexdigest()
+    last_modified = int(version.timestamp()) if version else None
+    respuesta = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if respuesta is None:
+        respuesta = StreamingHttpResponse(generar_calendario(kx), content_type='text/calendar; charset=utf-8')
+        respuesta['Content-Disposition'] = 'inline; filename="kineayuda.ics"'
+    respuesta['ETag'] = etag
+    if last_modified is not None:
+        respuesta['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def verificar_firebase_token(request):
@@ -365,12 +649,19 @@ def verificar_firebase_token(request):
     if not token:
         return Response({'error': 'Token no proporcionado.'}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        decoded = auth.verify_id_token(token)
+        decoded = verificar_id_token(token)
         return Response({'uid': decoded['uid'], 
                          'email': decoded.get('email')}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cerrar_sesion(request):
+    #Revoca las sesiones del usuario en Firebase; sus ID tokens ya emitidos dejan de valer en todos los workers.
+    revocar_sesiones(request.user.uid)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def me(request):
@@ -425,14 +716,10 @@ def estado_suscripcion(request):
     if not kx:
         return Response({"error": "Perfil no encontrado"}, status=404)
 
-    ultimo_pago = pagoSuscripcion.objects.filter(kinesiologo=kx).order_by('-fecha_pago').first()
-
-    activa = kinesio_tiene_suscripcion_activa(kx)
-    vence = ultimo_pago.fecha_expiracion if ultimo_pago else None
-
+    # Ambos datos salen del kinesiologo ya cargado (suscripcion_vence_en se mantiene en webpay_retorno)
     return Response({
-        "activa": activa,
-        "vence": vence,
+        "activa": kinesio_tiene_suscripcion_activa(kx),
+        "vence": kx.suscripcion_vence_en,
     }, status=200)
 
 #1 INICIAR SUSCRIPCION
@@ -523,22 +810,27 @@ def webpay_retorno(request):
     buy_order = commit.get("buy_order")
     response_code = commit.get("response_code")  # 0 = aprobado
 
-    try:
-        pago = pagoSuscripcion.objects.get(orden_comercio=buy_order)
-    except pagoSuscripcion.DoesNotExist:
-        return Response({"error": "Orden no encontrada"}, status=404)
-
-    # Guardamos payload bruto (útil para auditoría)
-    pago.raw_payload = commit
-    pago.transa_id_externo = token_ws
+    with transaction.atomic():
+        try:
+            pago = pagoSuscripcion.objects.select_for_update().get(orden_comercio=buy_order)
+        except pagoSuscripcion.DoesNotExist:
+            return Response({"error": "Orden no encontrada"}, status=404)
+
+        # Guardamos payload bruto (útil para auditoría)
+        pago.raw_payload = commit
+        pago.transa_id_externo = token_ws
+
+        if response_code == 0:
+            pago.estado = 'pagado'
+            pago.fecha_expiracion = timezone.now() + relativedelta(months=1)
+        else:
+            pago.estado = 'fallido'
 
-    if response_code == 0:
-        pago.estado = 'pagado'
-        pago.fecha_expiracion = timezone.now() + relativedelta(months=1)
-    else:
-        pago.estado = 'fallido'
+        pago.save()
 
-    pago.save()
+        # Mismo commit que el pago: el vencimiento del kinesiologo nunca queda desfasado
+        if pago.estado == 'pagado':
+            registrar_pago_suscripcion(pago.kinesiologo_id, pago.fecha_expiracion)
 
     # Aquí puedes redirigir al frontend para mostrar pantalla de éxito/fracaso
     # Ejemplo: return redirect(f"http://localhost:3000/pago-resultado?orden={buy_order}&estado={pago.estado}")
@@ -596,18 +888,7 @@ def webpay_iniciar_pago_cita(request):
     except ValueError:
         return Response({"error": "Monto inválido."}, status=400)
 
-    # 1) Obtener el slot de agenda y validar disponibilidad
-    slot = get_object_or_404(agenda, id=agenda_id)
-
-    if slot.estado != 'disponible':
-        return Response({"error": "El horario ya no está disponible."}, status=400)
-
-    if slot.inicio <= timezone.now():
-        return Response({"error": "No se puede agendar un horario pasado."}, status=400)
-
-    kx = slot.kinesiologo
-
-    # 2) Crear (o buscar) paciente por email
+    # 1) Validar datos del paciente antes de tomar el horario
     email = data.get('email')
     if not email:
         return Response({"error": "El email del paciente es obligatorio."}, status=400)
@@ -619,58 +900,71 @@ def webpay_iniciar_pago_cita(request):
         rut = normalizar_rut(rut_raw)
     except Exception as e:
         return Response({"error": f"RUT inválido: {str(e)}"}, status=400)
-    
-    paciente_obj, _ = paciente.objects.get_or_create(
-        email=email,
-        defaults={
-            "nombre": data.get("nombre", ""),
-            "apellido": data.get("apellido", ""),
-            "telefono": data.get("telefono", ""),
-            "fecha_nacimiento": data.get("fecha_nacimiento", "2000-01-01"),
-            "rut": rut,
-        }
-    )
-
-    # 3) Crear cita en estado pendiente / no pagada aún
-    nueva_cita = cita.objects.create(
-        paciente=paciente_obj,
-        kinesiologo=kx,
-        fecha_hora=slot.inicio,
-        estado='pendiente',
-        estado_pago='pendiente',
-    )
 
-    # 4) Crear pagoCita pendiente
-    pago = pagoCita.objects.create(
-        cita=nueva_cita,
-        kinesiologo=kx,
-        paciente=paciente_obj,
-        monto=monto,
-        estado='pendiente',
-    )
+    with transaction.atomic():
+        # 2) Tomar el slot con SKIP LOCKED: si otro paciente lo está reservando, 409 inmediato
+        try:
+            slot = tomar_horario(agenda_id)
+        except agenda.DoesNotExist:
+            return Response({"error": "Horario no encontrado."}, status=404)
+        except HorarioNoDisponible as e:
+            return Response({"error": str(e)}, status=409)
+
+        kx = slot.kinesiologo
+
+        # 3) Crear (o buscar) paciente por email
+        paciente_obj, _ = paciente.objects.get_or_create(
+            email=email,
+            defaults={
+                "nombre": data.get("nombre", ""),
+                "apellido": data.get("apellido", ""),
+                "telefono": data.get("telefono", ""),
+                "fecha_nacimiento": data.get("fecha_nacimiento", "2000-01-01"),
+                "rut": rut,
+            }
+        )
 
-    # 5) Generar buy_order y session_id
-    buy_order = f"CITA-{pago.id}"
-    session_id = f"PAC-{paciente_obj.id}"
+        # 4) Crear cita en estado pendiente / no pagada aún, pagoCita pendiente y retener el slot para ella
+        nueva_cita = cita.objects.create(
+            paciente=paciente_obj,
+            kinesiologo=kx,
+            fecha_hora=slot.inicio,
+            estado='pendiente',
+            estado_pago='pendiente',
+        )
+        pago = pagoCita.objects.create(
+            cita=nueva_cita,
+            kinesiologo=kx,
+            paciente=paciente_obj,
+            monto=monto,
+            estado='pendiente',
+        )
+        retener_horario(slot, nueva_cita)
 
-    pago.buy_order = buy_order
-    pago.session_id = session_id
-    pago.save()
+        # 5) Generar buy_order y session_id
+        pago.buy_order = f"CITA-{pago.id}"
+        pago.session_id = f"PAC-{paciente_obj.id}"
+        pago.save()
 
-    # 6) Llamar a Webpay
+    # 6) Llamar a Webpay (fuera de la transacción: el slot ya quedó retenido)
     return_url = request.build_absolute_uri('/api/pagos/citas/webpay/retorno/')
-    resp = create_transaction(
-        buy_order=buy_order,
-        session_id=session_id,
-        amount=monto,
-        return_url=return_url
-    )
+    try:
+        resp = create_transaction(
+            buy_order=pago.buy_order,
+            session_id=pago.session_id,
+            amount=monto,
+            return_url=return_url
+        )
+    except Exception:
+        _cancelar_pago_cita(pago, nueva_cita)
+        raise
 
     # resp tiene .token y .url (según SDK)
     token = getattr(resp, 'token', None) or resp.get('token')
     url = getattr(resp, 'url', None) or resp.get('url')
 
     if not token or not url:
+        _cancelar_pago_cita(pago, nueva_cita)
         return Response({"error": "Error al iniciar transacción con Webpay."}, status=500)
 
     pago.token_ws = token
@@ -682,78 +976,111 @@ def webpay_iniciar_pago_cita(request):
         "cita_id": nueva_cita.id
     }, status=200)
 
+def _cancelar_pago_cita(pago, cita_obj):
+    """Pago fallido o abandonado: cita cancelada y el horario retenido vuelve a 'disponible'."""
+    pago.estado = 'fallido'
+    pago.save()
+    cita_obj.estado_pago = 'fallido'
+    cita_obj.estado = 'cancelada'
+    cita_obj.save()
+    liberar_retencion(cita_obj)
+
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])
 def webpay_retorno_pago_cita(request):
     """
     Webpay redirige aquí con token_ws.
-    Confirma el pago y actualiza cita + agenda.
+    Confirma el pago y actualiza cita + agenda. El commit con Transbank (HTTPS) se hace fuera de toda transacción,
+    sin locks tomados: antes, una transacción corta comprueba y renueva la retención del horario; después, otra
+    vuelve a bloquearlo y lo marca reservado. Si la retención ya es de otro paciente antes del commit, no se
+    confirma (Transbank reversa la autorización) y se responde 409; si se lo quitaron durante el commit, se
+    anula el cobro con refund y también se responde 409.
     """
     token_ws = request.GET.get('token_ws') or request.POST.get('token_ws')
     if not token_ws:
         return Response({"error": "Falta token_ws."}, status=400)
 
-    # 1) Confirmar con Webpay
-    resp = commit_transaction(token_ws)
-
-    # Dependiendo del SDK, resp puede ser objeto o dict
-    status_tx = getattr(resp, 'status', None) or resp.get('status')
-    buy_order = getattr(resp, 'buy_order', None) or resp.get('buy_order')
-    response_code = getattr(resp, 'response_code', None) or resp.get('response_code')
-
-    # 2) Buscar pagoCita por buy_order
+    # 1) Buscar pagoCita por token_ws, antes de confirmar con Webpay
     try:
-        pago = pagoCita.objects.select_related('cita', 'cita__kinesiologo').get(buy_order=buy_order)
+        pago = pagoCita.objects.select_related('cita').get(token_ws=token_ws)
     except pagoCita.DoesNotExist:
         return Response({"error": "Pago no encontrado."}, status=404)
 
-    pago.raw_payload = getattr(resp, 'json', None) if hasattr(resp, 'json') else None
-    pago.token_ws = token_ws
-
     cita_obj = pago.cita
-    slot_qs = agenda.objects.filter(
-        kinesiologo=cita_obj.kinesiologo,
-        inicio=cita_obj.fecha_hora
-    )
-
-    # 3) Evaluar resultado
-    if status_tx == "AUTHORIZED" and response_code == 0:
-        pago.estado = 'pagado'
-        pago.fecha_pago = timezone.now()
-
-        cita_obj.estado_pago = 'pagado'
-        cita_obj.estado = 'pendiente'  # o 'confirmada' si agregas ese estado
-        cita_obj.save()
+    if pago.estado == 'pagado':  # retorno repetido (recarga del navegador)
+        return _pago_cita_exitoso(cita_obj)
+
+    # 2) Comprobar el horario y renovar su retención mientras se habla con Transbank (lock solo en este bloque)
+    with transaction.atomic():
+        slot = confirmar_retencion(cita_obj)
+        if slot is None:
+            _cancelar_pago_cita(pago, cita_obj)
+            return Response({"error": "El horario fue tomado por otro paciente mientras se procesaba el pago."},
+                            status=409)
+        retener_horario(slot, cita_obj)
+
+    # 3) Confirmar con Webpay, sin transacción ni locks abiertos
+    resp = commit_transaction(token_ws)
 
-        # marcar slot como reservado
-        slot = slot_qs.first()
-        slot.estado = 'reservado'
-        slot.cita = cita_obj
-        slot.paciente = pago.paciente
-        slot.save()
+    # Dependiendo del SDK, resp puede ser objeto o dict
+    status_tx = getattr(resp, 'status', None) or resp.get('status')
+    response_code = getattr(resp, 'response_code', None) or resp.get('response_code')
+    autorizado = status_tx == "AUTHORIZED" and response_code == 0
+
+    # 4) Lock corto: volver a comprobar el horario y registrar el resultado
+    with transaction.atomic():
+        pago = pagoCita.objects.select_for_update().select_related('cita').get(id=pago.id)
+        cita_obj = pago.cita
+        if pago.estado == 'pagado':  # otro retorno concurrente ya lo registró
+            return _pago_cita_exitoso(cita_obj)
+        pago.raw_payload = getattr(resp, 'json', None) if hasattr(resp, 'json') else None
+
+        if not autorizado:
+            _cancelar_pago_cita(pago, cita_obj)
+            return Response({
+                "mensaje": "Pago rechazado o fallido.",
+                "detalle": status_tx,
+                "codigo_respuesta": response_code
+            }, status=400)
+
+        # Ya se cobró: se espera el lock en vez de dar el horario por perdido si otro request lo tiene un instante
+        slot = confirmar_retencion(cita_obj, saltar_bloqueados=False)
+        if slot is not None:
+            pago.estado = 'pagado'
+            pago.fecha_pago = timezone.now()
+            pago.save()
 
-        pago.save()
+            cita_obj.estado_pago = 'pagado'
+            cita_obj.estado = 'pendiente'  # o 'confirmada' si agregas ese estado
+            cita_obj.save()
 
-        # Aquí podrías redirigir con HTML si fuera flujo web, pero como es API:
-        return Response({
-            "mensaje": "Pago de cita exitoso.",
-            "cita_id": cita_obj.id,
-            "estado_pago": cita_obj.estado_pago
-        }, status=200)
+            # marcar slot como reservado
+            slot.estado = 'reservado'
+            slot.cita = cita_obj
+            slot.paciente = pago.paciente
+            slot.retenido_hasta = None
+            slot.save()
+            return _pago_cita_exitoso(cita_obj)
 
-    else:
-        pago.estado = 'fallido'
-        cita_obj.estado_pago = 'fallido'
-        cita_obj.estado = 'cancelada'
-        cita_obj.save()
-        slot_qs.update(estado='disponible')
-        pago.save()
+        # El horario se lo quedó otro paciente durante el commit (p. ej. la retención venció en medio)
+        _cancelar_pago_cita(pago, cita_obj)
 
-        return Response({
-            "mensaje": "Pago rechazado o fallido.",
-            "detalle": status_tx,
-            "codigo_respuesta": response_code
-        }, status=400)
+    try:
+        refund_transaction(token_ws, float(pago.monto))
+    except Exception:
+        logger.exception("No se pudo anular el cobro del pago de cita %s (token %s); requiere reembolso manual",
+                         pago.id, token_ws)
+        return Response({"error": "El horario fue tomado por otro paciente mientras se procesaba el pago. "
+                                  "El cobro se reembolsará manualmente."}, status=409)
+    return Response({"error": "El horario fue tomado por otro paciente mientras se procesaba el pago. "
+                              "El cobro fue anulado."}, status=409)
+
+def _pago_cita_exitoso(cita_obj):
+    return Response({
+        "mensaje": "Pago de cita exitoso.",
+        "cita_id": cita_obj.id,
+        "estado_pago": cita_obj.estado_pago
+    }, status=200)
 
 class CitasPorRutView(APIView):
     permission_classes = [AllowAny]
@@ -157,4 +157,78 @@ REST_FRAMEWORK = {
     ],
 }
 
-BACKEND_BASE_URL = "http://127.0.0.1:8000"
\ No newline at end of file
+BACKEND_BASE_URL = "http://127.0.0.1:8000"
+
+# Análisis de sentimiento (core/modulo_ia.py)
+# El modelo se carga en la primera reseña analizada; con True se carga al arrancar cada worker (wsgi/asgi).
+SENTIMIENTO_PRECARGAR_MODELO = False
+# Micro-batching: las reseñas concurrentes se analizan juntas en lotes de hasta SENTIMIENTO_BATCH_MAX textos,
+# esperando como máximo SENTIMIENTO_BATCH_ESPERA_MS desde el primero. Con 1 se analiza cada texto por separado.
+SENTIMIENTO_BATCH_MAX = 16
+SENTIMIENTO_BATCH_ESPERA_MS = 10
+# Con True las reseñas se guardan con sentimiento=NULL y se responde de inmediato;
+# `manage.py procesar_sentimientos` las analiza en lotes en segundo plano.
+SENTIMIENTO_ASINCRONO = False
+# El worker reserva cada lote por SENTIMIENTO_TOMA_MINUTOS mientras lo analiza (si se cae, otro lo retoma después)
+# y deja de intentar una reseña cuyo análisis falló SENTIMIENTO_INTENTOS_MAX veces.
+SENTIMIENTO_TOMA_MINUTOS = 10
+SENTIMIENTO_INTENTOS_MAX = 3
+# Caché de resultados por texto normalizado: LRU en memoria por proceso (0 la desactiva)
+# y tabla cacheSentimiento compartida entre workers.
+SENTIMIENTO_CACHE_TAMANO = 10000
+SENTIMIENTO_CACHE_PERSISTENTE = True
+# recalcular_sentimientos y procesar_sentimientos purgan de la tabla las filas de otro modelo/backend
+# y las con más de SENTIMIENTO_CACHE_DIAS días (0 desactiva la purga por antigüedad).
+SENTIMIENTO_CACHE_DIAS = 180
+# Backend de inferencia: 'float32' (modelo original) o 'int8' (cuantización dinámica, menos RAM y más rápido en CPU).
+# Antes de cambiarlo, correr `manage.py verificar_cuantizacion`.
+SENTIMIENTO_BACKEND = 'float32'
+# Sidecar de inferencia (`manage.py servidor_sentimiento`): un solo modelo en RAM para todos los workers.
+# Si el socket no existe o no responde, cada worker analiza en su propio proceso.
+SENTIMIENTO_SIDECAR_SOCKET = os.path.join(BASE_DIR, 'sentimiento.sock')
+SENTIMIENTO_SIDECAR_TIMEOUT = 30
+
+# Caché de ID tokens de Firebase ya verificados (cada entrada vence con el exp del token). 0 la desactiva.
+FIREBASE_TOKEN_CACHE_TAMANO = 10000
+# Alias de CACHES donde se guardan las revocaciones de sesión (/api/logout/): debe ser compartido entre workers.
+FIREBASE_REVOCACION_CACHE = 'sesiones'
+# Segundos que cada worker reutiliza las marcas de revocación leídas de ese caché antes de volver a leerlas.
+FIREBASE_REVOCACION_TTL_LOCAL = 5
+# Verificación local de ID tokens (PyJWT) con las claves públicas de Firebase guardadas en FIREBASE_CLAVES_PATH
+# y refrescadas en segundo plano. FIREBASE_PROJECT_ID vacío = el project_id de las credenciales.
+FIREBASE_VERIFICACION_LOCAL = True
+FIREBASE_CLAVES_PATH = os.path.join(BASE_DIR, 'firebase_claves.json')
+FIREBASE_PROJECT_ID = None
+
+# Barrido de expiración (`manage.py barrer_expirados`): horarios pasados, pagos abandonados y suscripciones vencidas.
+# Un pago de cita o suscripción que sigue 'pendiente' después de estos minutos se marca 'expirado'.
+PAGO_PENDIENTE_TTL_MINUTOS = 60
+# Minutos que un horario queda 'retenido' para el paciente mientras paga en Webpay. Si no vuelve a tiempo,
+# el barrido lo libera y otro paciente lo puede tomar.
+AGENDA_RETENCION_MINUTOS = 15
+# Búsqueda difusa del directorio público (?q=): relevancia mínima (0 a 1) para aparecer en los resultados.
+# En PostgreSQL es el umbral de word_similarity de pg_trgm; en otros motores, el del índice en memoria.
+DIRECTORIO_BUSQUEDA_UMBRAL = 0.4
+CACHES = {
+    # El de Django por defecto (memoria del proceso), para el resto de los usos del caché
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Respuestas de las vistas públicas (core/utils/cache_publico.py: directorio, reseñas, horas disponibles,
+    # métodos de pago). Las señales lo invalidan desde cualquier worker, así que debe ser compartido: en disco
+    # sirve para un solo servidor; con varios, usar Redis o Memcached.
+    'publico': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache_publico'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    # Revocaciones de ID tokens de Firebase (core/authentication.py), leídas en cada request autenticado
+    'sesiones': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache_sesiones'),
+    },
+}
+# Segundos que una respuesta cacheada se considera vigente (0 desactiva el caché). Pasado ese tiempo, o si los
+# datos cambiaron, se sigue sirviendo hasta CACHE_PUBLICO_STALE segundos más mientras se reconstruye en segundo plano.
+CACHE_PUBLICO_TTL = 60
+CACHE_PUBLICO_STALE = 600
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kineayuda_backend.settings')
 
 application = get_wsgi_application()
+
+# Calentamiento opcional del modelo de sentimiento al arrancar el worker
+from django.conf import settings
+if getattr(settings, 'SENTIMIENTO_PRECARGAR_MODELO', False):
+    from core.modulo_ia import precargar_modelo
+    precargar_modelo()